@@ -0,0 +1,618 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+""" Benchmark of the events database insert and query paths.
+
+A synthetic data set is generated (see EventsGenerator) and stored in a
+temporary database, and the main DAO methods are timed on it:
+
+    - insert_event and insert_events (by batches)
+    - get_available_days
+    - get_events_for_day (all variables, and a single one)
+    - get_events (time windows picked at random in the data set, filtered or not)
+
+Each DAO is benchmarked directly, and through a local stand-in of the D-Bus
+service object, which calls its methods the same way the bus does,
+arguments and results being marshalled to D-Bus messages so that the
+serialization cost is accounted for. Through the stand-in, single events
+follow the production path (onCSTBoxEvent signals queued to the events
+writer, which writes them by batches), while batches are stored with the
+insert_events D-Bus method, intended for backfilling. The path used by each
+insert operation is reported with the results. The flush operation, which
+waits for the events writer to be drained, is timed too.
+
+Each DAO and transport combination is run in a fresh child process, so that
+the reported peak RSS is the one of this combination only. The background
+maintenance of the DAOs (rollups of the past days f.i.) is disabled, since
+the data set only contains past days.
+
+The results are written as JSON, giving for each DAO, transport and
+operation the throughput (in items per second, the items being the events
+for inserts and queries), the calls latency percentiles (in milliseconds),
+together with the peak RSS of the run and the data set parameters. The
+generator being seeded, successive runs use the same data set and queries,
+and their results can be compared.
+"""
+
+import sys
+import os
+import json
+import time
+import random
+import shutil
+import tempfile
+import threading
+import resource
+import subprocess
+import argparse
+from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
+
+import dbus
+import dbus.lowlevel
+import gobject
+
+from pycstbox import cli
+from pycstbox import log
+from pycstbox import evtdao
+from pycstbox import evtdb
+from pycstbox import evtmgr
+from pycstbox import sysutils
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+TRANSPORT_DIRECT = 'direct'
+TRANSPORT_STANDIN = 'standin'
+
+# the path of the messages built by the D-Bus stand-in
+_STANDIN_PATH = '/bench'
+# the signature of the onCSTBoxEvent signal of the event manager (the data
+# being sent as JSON)
+_EVENT_SIGNAL_SIGNATURE = 'tsss'
+
+# parameters of the data set and of the runs, passed to the child processes
+_RUN_PARAMETERS = (
+    'variables', 'period', 'days', 'payload', 'seed', 'batch_size', 'single_inserts', 'queries', 'window'
+)
+
+_VAR_TYPES = ('temperature', 'humidity', 'co2', 'power', 'switch')
+
+
+class EventsGenerator(object):
+    """ Generates a reproducible synthetic events data set.
+
+    Each variable produces events at a given average period, the actual
+    intervals being randomized by +/- 50%. The events are produced in time
+    order, one day at a time.
+    """
+    def __init__(self, variables=20, period=60., days=3, payload=0, start=None, seed=0):
+        """
+        :param int variables: the number of variables
+        :param float period: the average period of the events of each variable, in seconds
+        :param int days: the number of days covered by the data set
+        :param int payload: the size in bytes of the additional data of each event
+        :param date start: the first day of the data set (default: 2000-01-01)
+        :param int seed: the seed of the random generator
+        """
+        self.variables = [
+            (_VAR_TYPES[i % len(_VAR_TYPES)], 'var%03d' % i) for i in xrange(variables)
+        ]
+        self.period = period
+        self.days = days
+        self.payload = payload
+        self.start = datetime.combine(start, datetime.min.time()) if start else datetime(2000, 1, 1)
+        self.seed = seed
+
+    @property
+    def day_list(self):
+        return [(self.start + timedelta(days=d)).date() for d in xrange(self.days)]
+
+    @property
+    def end(self):
+        return self.start + timedelta(days=self.days)
+
+    def __iter__(self):
+        rnd = random.Random(self.seed)
+        extra = 'x' * self.payload
+        start_ms = sysutils.to_milliseconds(self.start)
+        day_ms = 86400 * 1000
+        period_ms = self.period * 1000
+        # next event time of each variable
+        next_ms = [start_ms + rnd.random() * period_ms for _ in self.variables]
+        for day in xrange(self.days):
+            day_end = start_ms + (day + 1) * day_ms
+            evts = []
+            for i, (var_type, var_name) in enumerate(self.variables):
+                msecs = next_ms[i]
+                while msecs < day_end:
+                    data = {'value': round(rnd.uniform(0, 100), 2), 'unit': 'u'}
+                    if extra:
+                        data['extra'] = extra
+                    evts.append((int(msecs), var_type, var_name, data))
+                    msecs += period_ms * rnd.uniform(0.5, 1.5)
+                next_ms[i] = msecs
+            evts.sort(key=lambda evt: evt[0])
+            for evt in evts:
+                yield evt
+
+
+class Recorder(object):
+    """ Records the latencies of the calls of an operation and the count of
+    processed items.
+    """
+    def __init__(self):
+        self.latencies = []
+        self.items = 0
+
+    def call(self, func, *args):
+        """ Calls a function returning the count of processed items, and records
+        its latency.
+        """
+        started = time.time()
+        items = func(*args)
+        self.latencies.append(time.time() - started)
+        self.items += items
+        return items
+
+    @staticmethod
+    def _percentile(ordered, p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100.))]
+
+    def report(self):
+        elapsed = sum(self.latencies)
+        ordered = sorted(self.latencies)
+        report = {
+            'calls': len(ordered),
+            'items': self.items,
+            'elapsed': elapsed,
+            'throughput': self.items / elapsed if elapsed else 0.,
+        }
+        if ordered:
+            report['latency_ms'] = {
+                'min': ordered[0] * 1000,
+                'mean': elapsed / len(ordered) * 1000,
+                'p50': self._percentile(ordered, 50) * 1000,
+                'p90': self._percentile(ordered, 90) * 1000,
+                'p99': self._percentile(ordered, 99) * 1000,
+                'max': ordered[-1] * 1000,
+            }
+        return report
+
+
+class DirectBackend(object):
+    """ Executes the benchmarked operations by calling the DAO.
+
+    All methods return the count of processed events.
+    """
+    INSERT_PATHS = {
+        'insert_event': 'DAO insert_event',
+        'insert_events': 'DAO insert_events',
+    }
+
+    def __init__(self, dao):
+        self._dao = dao
+
+    def open(self):
+        self._dao.open()
+
+    def close(self):
+        self._dao.close()
+
+    def flush(self):
+        self._dao.flush()
+        return 0
+
+    def insert_event(self, evt):
+        self._dao.insert_event(*evt)
+        return 1
+
+    def insert_events(self, evts):
+        self._dao.insert_events(evts)
+        return len(evts)
+
+    def get_available_days(self):
+        return len(list(self._dao.get_available_days()))
+
+    def get_events_for_day(self, day, var_type='', var_name=''):
+        return len(list(self._dao.get_events_for_day(day, var_type or None, var_name or None)))
+
+    def get_events(self, from_time, to_time, var_type='', var_name=''):
+        return len(list(self._dao.get_events(from_time, to_time, var_type or None, var_name or None)))
+
+
+class _StandInObject(evtdb.EventDatabaseObject):
+    """ Service object which is not connected to the event manager, the
+    events being provided by the benchmark.
+    """
+    def start(self):
+        if not self._dao.opened:
+            self._dao.open()
+        self._writer.start()
+        self._query_pool = ThreadPool(self._query_workers)
+
+    def deliver_event(self, timestamp, var_type, var_name, data):
+        """ Processes an event as received from the event manager signal."""
+        self._event_signal_handler(timestamp, var_type, var_name, data)
+
+
+class StandInBackend(object):
+    """ Executes the benchmarked operations through a local stand-in of the
+    D-Bus service object.
+
+    Method calls are performed as done by the bus: arguments are marshalled
+    in a message according to the method input signature and unmarshalled
+    before being passed to the method, and its result is marshalled according
+    to the output signature. Asynchronous methods replies are delivered by
+    the GLib main loop, run in a dedicated thread.
+
+    Single events are delivered as the event manager signals, and are thus
+    written by the events writer of the service object.
+
+    All methods return the count of processed events.
+    """
+    CALL_TIMEOUT = 600
+    INSERT_PATHS = {
+        'insert_event': 'onCSTBoxEvent signal -> EventsWriter',
+        'insert_events': 'D-Bus insert_events (backfill)',
+    }
+
+    def __init__(self, dao, channel, query_workers=evtdb.DEFAULT_QUERY_WORKERS):
+        self._obj = _StandInObject(channel, dao, query_workers=query_workers, query_timeout=0)
+        self._loop = gobject.MainLoop()
+        self._loop_thread = threading.Thread(target=self._loop.run, name='standin-loop')
+        self._loop_thread.daemon = True
+
+    def open(self):
+        self._loop_thread.start()
+        self._obj.start()
+
+    def close(self):
+        self._obj.stop()
+        self._loop.quit()
+
+    def _call(self, name, *args):
+        """ Calls a method of the service object, and returns its result
+        unmarshalled from the reply message.
+
+        :raises DBusException: if the method fails
+        """
+        method = getattr(self._obj, name)
+        msg = dbus.lowlevel.SignalMessage(_STANDIN_PATH, evtdb.SERVICE_INTERFACE, name)
+        if args:
+            msg.append(*args, signature=method._dbus_in_signature)
+        args = msg.get_args_list()
+
+        if method._dbus_async_callbacks:
+            done = threading.Event()
+            outcome = []
+
+            def reply_handler(*result):
+                outcome.append((True, result[0] if result else None))
+                done.set()
+
+            def error_handler(e):
+                outcome.append((False, e))
+                done.set()
+
+            method(*args, reply_handler=reply_handler, error_handler=error_handler)
+            if not done.wait(self.CALL_TIMEOUT):
+                raise dbus.exceptions.DBusException('no reply received for %s' % name)
+            ok, result = outcome[0]
+            if not ok:
+                raise result
+        else:
+            result = method(*args)
+
+        reply = dbus.lowlevel.SignalMessage(_STANDIN_PATH, evtdb.SERVICE_INTERFACE, name)
+        if method._dbus_out_signature:
+            reply.append(result, signature=method._dbus_out_signature)
+        result = reply.get_args_list()
+        return result[0] if result else None
+
+    def flush(self):
+        self._call('flush')
+        return 0
+
+    def insert_event(self, evt):
+        msecs, var_type, var_name, data = evt
+        msg = dbus.lowlevel.SignalMessage(_STANDIN_PATH, evtmgr.SERVICE_INTERFACE, 'onCSTBoxEvent')
+        msg.append(msecs, var_type, var_name, json.dumps(data), signature=_EVENT_SIGNAL_SIGNATURE)
+        self._obj.deliver_event(*msg.get_args_list())
+        return 1
+
+    def insert_events(self, evts):
+        return self._call('insert_events', evts)
+
+    def get_available_days(self):
+        return len(self._call('get_available_days', 0, 0))
+
+    def get_events_for_day(self, day, var_type='', var_name=''):
+        return len(self._call('get_events_for_day', day.isoformat(), var_type, var_name))
+
+    def get_events(self, from_time, to_time, var_type='', var_name=''):
+        event_filter = {
+            evtdb.FILTER_FROM_TIME: from_time.strftime(evtdao.TS_FMT_FULL),
+            evtdb.FILTER_TO_TIME: to_time.strftime(evtdao.TS_FMT_FULL),
+        }
+        if var_type:
+            event_filter[evtdb.FILTER_VAR_TYPE] = var_type
+        if var_name:
+            event_filter[evtdb.FILTER_VAR_NAME] = var_name
+        return len(self._call('get_events', dbus.Dictionary(event_filter, signature='sv')))
+
+
+def run_benchmark(backend, generator, batch_size=1000, single_inserts=1000, queries=20, window=3600):
+    """ Runs the benchmark of a backend with a given data set.
+
+    The data set must be stored in an empty database.
+
+    :param backend: the DirectBackend or StandInBackend instance
+    :param EventsGenerator generator: the data set generator
+    :param int batch_size: the number of events stored by each insert_events call
+    :param int single_inserts: the number of events (at the start of the data set)
+        stored with insert_event
+    :param int queries: the number of repetitions of each query
+    :param int window: the time span in seconds of the get_events queries
+    :returns: a dictionary of operation reports (see Recorder.report()), and
+        the paths used by the insert operations (as "insert_paths")
+    """
+    recorders = {}
+
+    def recorder(name):
+        return recorders.setdefault(name, Recorder())
+
+    backend.open()
+    try:
+        batch = []
+        for count, evt in enumerate(generator):
+            if count < single_inserts:
+                recorder('insert_event').call(backend.insert_event, evt)
+                continue
+            batch.append(evt)
+            if len(batch) >= batch_size:
+                recorder('insert_events').call(backend.insert_events, batch)
+                batch = []
+        if batch:
+            recorder('insert_events').call(backend.insert_events, batch)
+        recorder('flush').call(backend.flush)
+
+        rnd = random.Random(generator.seed)
+        days = generator.day_list
+        var_type, var_name = generator.variables[0]
+        span = max(0, int((generator.end - generator.start).total_seconds()) - window)
+        for _ in xrange(queries):
+            recorder('get_available_days').call(backend.get_available_days)
+
+            day = rnd.choice(days)
+            recorder('get_events_for_day').call(backend.get_events_for_day, day)
+            recorder('get_events_for_day(var)').call(backend.get_events_for_day, day, var_type, var_name)
+
+            from_time = generator.start + timedelta(seconds=rnd.randint(0, span))
+            to_time = from_time + timedelta(seconds=window)
+            recorder('get_events').call(backend.get_events, from_time, to_time)
+            recorder('get_events(var)').call(backend.get_events, from_time, to_time, var_type, var_name)
+    finally:
+        backend.close()
+
+    results = {name: rec.report() for name, rec in recorders.iteritems()}
+    results['insert_paths'] = backend.INSERT_PATHS
+    return results
+
+
+def _peak_rss():
+    """ Returns the peak resident set size of the process and of its
+    terminated children (parallel scan workers f.i.), in kilobytes.
+
+    Since it is a high water mark, it must be taken in a process dedicated to
+    a single run.
+    """
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+
+def execute_run(args, run_name, workdir):
+    """ Executes a single DAO and transport combination in the current process.
+
+    :returns: the run results (see run_benchmark()), including the peak RSS
+        of the process
+    """
+    dao_name, transport = run_name.split('/')
+    home = os.path.join(workdir, dao_name + '-' + transport)
+    if not os.path.exists(home):
+        os.makedirs(home)
+    dao = evtdao.get_dao(dao_name, evtmgr.SENSOR_EVENT_CHANNEL, config={
+        'db_home_dir': home,
+        evtdao.CFGKEY_HOUSEKEEPING: False,
+    })
+    if transport == TRANSPORT_DIRECT:
+        backend = DirectBackend(dao)
+    else:
+        backend = StandInBackend(dao, evtmgr.SENSOR_EVENT_CHANNEL)
+    generator = EventsGenerator(
+        variables=args.variables, period=args.period, days=args.days, payload=args.payload, seed=args.seed
+    )
+    results = run_benchmark(
+        backend, generator,
+        batch_size=args.batch_size, single_inserts=args.single_inserts,
+        queries=args.queries, window=args.window
+    )
+    results['peak_rss_kb'] = _peak_rss()
+    return results
+
+
+def spawn_run(args, run_name, workdir):
+    """ Executes a single DAO and transport combination in a child process.
+
+    :returns: the run results (see execute_run())
+    :raises RuntimeError: if the child process fails
+    """
+    output = os.path.join(workdir, run_name.replace('/', '-') + '.json')
+    cmd = [sys.executable, os.path.abspath(__file__), '--run', run_name, '--workdir', workdir,
+           '--output', output, '--loglevel', args.loglevel]
+    for name in _RUN_PARAMETERS:
+        cmd += ['--' + name, str(getattr(args, name))]
+    returncode = subprocess.call(cmd)
+    if returncode:
+        raise RuntimeError('run %s failed (exit code %d)' % (run_name, returncode))
+    with open(output) as fp:
+        return json.load(fp)
+
+
+if __name__ == '__main__':
+    parser = cli.get_argument_parser(description="CSTBox Event Database benchmark")
+    parser.add_argument(
+        '--dao',
+        help="storage engine(s) to be benchmarked (default: fsys)",
+        dest='daos',
+        action='append',
+        choices=evtdao.known_daos(),
+        default=None
+    )
+    parser.add_argument(
+        '--transport',
+        help="way the DAO is called (default: both)",
+        dest='transports',
+        action='append',
+        choices=[TRANSPORT_DIRECT, TRANSPORT_STANDIN],
+        default=None
+    )
+    parser.add_argument(
+        '--variables',
+        help="number of variables (default: %(default)s)",
+        dest='variables',
+        type=int,
+        default=20
+    )
+    parser.add_argument(
+        '--period',
+        help="average period in seconds of the events of each variable (default: %(default)s)",
+        dest='period',
+        type=float,
+        default=60.
+    )
+    parser.add_argument(
+        '--days',
+        help="number of days of the data set (default: %(default)s)",
+        dest='days',
+        type=int,
+        default=3
+    )
+    parser.add_argument(
+        '--payload',
+        help="size in bytes of the additional data of the events (default: %(default)s)",
+        dest='payload',
+        type=int,
+        default=0
+    )
+    parser.add_argument(
+        '--seed',
+        help="seed of the data set and queries generator (default: %(default)s)",
+        dest='seed',
+        type=int,
+        default=0
+    )
+    parser.add_argument(
+        '--batch_size',
+        help="number of events stored by each insert_events call (default: %(default)s)",
+        dest='batch_size',
+        type=int,
+        default=1000
+    )
+    parser.add_argument(
+        '--single_inserts',
+        help="number of events stored one at a time (default: %(default)s)",
+        dest='single_inserts',
+        type=int,
+        default=1000
+    )
+    parser.add_argument(
+        '--queries',
+        help="number of repetitions of each query (default: %(default)s)",
+        dest='queries',
+        type=int,
+        default=20
+    )
+    parser.add_argument(
+        '--window',
+        help="time span in seconds of the get_events queries (default: %(default)s)",
+        dest='window',
+        type=int,
+        default=3600
+    )
+    parser.add_argument(
+        '--workdir',
+        help="directory in which the databases are created, if needed (default: a temporary directory)",
+        dest='workdir',
+        default=None
+    )
+    parser.add_argument(
+        '--run',
+        help=argparse.SUPPRESS,
+        dest='run',
+        default=None
+    )
+    parser.add_argument(
+        '-o', '--output',
+        help="file the JSON results are written to (default: standard output)",
+        dest='output',
+        default=None
+    )
+
+    args = parser.parse_args()
+    evtdao.log_setLevel(getattr(log, args.loglevel))
+    gobject.threads_init()
+
+    if args.run:
+        # child process executing a single run
+        with open(args.output, 'w') as fp:
+            json.dump(execute_run(args, args.run, args.workdir), fp)
+        sys.exit(0)
+
+    results = {
+        'parameters': {name: getattr(args, name) for name in _RUN_PARAMETERS},
+        'started': datetime.utcnow().strftime(evtdao.TS_FMT_SECS),
+        'python': sys.version.split()[0],
+        'runs': {}
+    }
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='evtdb-bench-')
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    try:
+        for dao_name in args.daos or ['fsys']:
+            for transport in args.transports or [TRANSPORT_DIRECT, TRANSPORT_STANDIN]:
+                run_name = '%s/%s' % (dao_name, transport)
+                sys.stderr.write('running %s...\n' % run_name)
+                try:
+                    results['runs'][run_name] = spawn_run(args, run_name, workdir)
+                except RuntimeError as e:
+                    sys.exit(str(e))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2, sort_keys=True, separators=(',', ': '))
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(output + '\n')
+    else:
+        print(output)
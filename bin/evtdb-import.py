@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Imports events from NDJSON or CSV files into an events database.
+
+This tool is intended for backfilling a database (migration of history from
+another box, restoration of buffered data,...). It writes directly to the
+storage, and thus must not be used while the events database service is
+running for the same channel.
+
+NDJSON files contain one JSON object per line, with the following keys:
+    - timestamp : milliseconds since the epoch, or ISO formatted time (UTC if
+      no offset is specified)
+    - var_type, var_name : the variable
+    - value : the event value
+    - data : (optional) a dictionary of additional infos
+
+CSV files contain one event per line, with the fields timestamp, var_type,
+var_name, value and optionally the additional infos as JSON. A header line
+starting with "timestamp" is ignored.
+
+Events are read by batches, which are sorted by time before being stored,
+so that the events of each day are written at once.
+"""
+
+import sys
+import json
+import csv
+import operator
+
+import dateutil.parser
+
+from pycstbox import cli
+from pycstbox import log
+from pycstbox import evtdao
+from pycstbox import evtmgr
+from pycstbox import sysutils
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+FORMAT_NDJSON = 'ndjson'
+FORMAT_CSV = 'csv'
+
+DEFAULT_BATCH_SIZE = 100000
+
+
+def _parse_timestamp(ts):
+    """ Returns the timestamp in milliseconds of an event, given as a number
+    of milliseconds or as an ISO formatted time.
+    """
+    if isinstance(ts, (int, long, float)):
+        return int(ts)
+    try:
+        return int(ts)
+    except ValueError:
+        dt = dateutil.parser.parse(ts)
+        if dt.utcoffset() is not None:
+            dt = (dt - dt.utcoffset()).replace(tzinfo=None)
+        return sysutils.to_milliseconds(dt)
+
+
+def read_ndjson(fp):
+    """ Generator returning the events of an NDJSON file, as DAO insert_events() tuples.
+    """
+    for line in fp:
+        line = line.strip()
+        if not line:
+            continue
+        d = json.loads(line)
+        data = dict((str(k), v) for k, v in d.get('data', {}).iteritems())
+        data['value'] = d['value']
+        yield _parse_timestamp(d['timestamp']), str(d['var_type']), str(d['var_name']), data
+
+
+def read_csv(fp):
+    """ Generator returning the events of a CSV file, as DAO insert_events() tuples.
+    """
+    for row in csv.reader(fp):
+        if not row or row[0] == 'timestamp':
+            continue
+        data = dict((str(k), v) for k, v in json.loads(row[4]).iteritems()) if len(row) > 4 and row[4] else {}
+        data['value'] = row[3]
+        yield _parse_timestamp(row[0]), row[1], row[2], data
+
+
+def import_events(dao, evts, batch_size=DEFAULT_BATCH_SIZE):
+    """ Stores events by sorted batches.
+
+    :param dao: the DAO
+    :param evts: an iterable of DAO insert_events() tuples
+    :param int batch_size: the number of events sorted and stored at once
+    :returns: the number of events submitted to the DAO
+    """
+    count = 0
+    batch = []
+    for evt in evts:
+        batch.append(evt)
+        if len(batch) >= batch_size:
+            batch.sort(key=operator.itemgetter(0))
+            dao.insert_events(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        batch.sort(key=operator.itemgetter(0))
+        dao.insert_events(batch)
+        count += len(batch)
+    return count
+
+
+if __name__ == '__main__':
+    parser = cli.get_argument_parser(description="CSTBox Event Database importer")
+    parser.add_argument(
+        'files',
+        nargs='*',
+        help='files to be imported (standard input if none)'
+    )
+    parser.add_argument(
+        '--channel',
+        help="events channel (default: %(default)s)",
+        dest='channel',
+        default=evtmgr.SENSOR_EVENT_CHANNEL
+    )
+    parser.add_argument(
+        '--dao',
+        help="storage engine (default: %(default)s)",
+        dest='dao',
+        choices=evtdao.known_daos(),
+        default='fsys'
+    )
+    parser.add_argument(
+        '--format',
+        help="files format (default: guessed from files extension, ndjson for standard input)",
+        dest='format',
+        choices=[FORMAT_NDJSON, FORMAT_CSV],
+        default=None
+    )
+    parser.add_argument(
+        '--batch_size',
+        help="number of events sorted and stored at once (default: %(default)s)",
+        dest='batch_size',
+        type=int,
+        default=DEFAULT_BATCH_SIZE
+    )
+
+    args = parser.parse_args()
+    evtdao.log_setLevel(getattr(log, args.loglevel))
+
+    dao = evtdao.get_dao(args.dao, args.channel)
+    total = 0
+    try:
+        for path in args.files or ['-']:
+            fmt = args.format or (FORMAT_CSV if path.lower().endswith('.csv') else FORMAT_NDJSON)
+            reader = read_csv if fmt == FORMAT_CSV else read_ndjson
+            fp = sys.stdin if path == '-' else open(path)
+            try:
+                count = import_events(dao, reader(fp), args.batch_size)
+            except (ValueError, KeyError, IndexError) as e:
+                sys.exit('invalid content in %s (%s)' % (path, e))
+            finally:
+                if fp is not sys.stdin:
+                    fp.close()
+            print('%s: %d event(s) imported' % (path, count))
+            total += count
+    finally:
+        dao.close()
+    if len(args.files) > 1:
+        print('total: %d event(s) imported' % total)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Computes the rollups of the past days of file based events databases.
+
+Rollups are normally computed by the events database service when days are
+closed. This tool is used to backfill them for databases created by previous
+versions, or to recompute them all.
+
+Databases are opened in read only mode, so that the state maintained by a
+running service (statistics, journal,...) is left untouched.
+"""
+
+import sys
+
+from pycstbox import cli
+from pycstbox import log
+from pycstbox import evtdao
+from pycstbox import evtmgr
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+if __name__ == '__main__':
+    parser = cli.get_argument_parser(description="CSTBox Event Database rollups builder")
+    parser.add_argument(
+        'channels',
+        nargs='*',
+        help='Event channels list. If none specified, defaulted to sensor events channel',
+        default=[evtmgr.SENSOR_EVENT_CHANNEL]
+    )
+    parser.add_argument(
+        '--force',
+        help="recompute the rollups even if up to date",
+        dest='force',
+        action='store_true',
+        default=False
+    )
+
+    args = parser.parse_args()
+    evtdao.log_setLevel(getattr(log, args.loglevel))
+
+    for channel in args.channels:
+        try:
+            dao = evtdao.get_dao('fsys', channel, readonly=True)
+        except Exception as e: #pylint: disable=W
+            sys.exit('cannot open %s events database (%s)' % (channel, e))
+        count = dao.build_rollups(force=args.force)
+        dao.close()
+        print('%s: %d rollup(s) computed' % (channel, count))
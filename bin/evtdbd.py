@@ -25,16 +25,20 @@ associated to one or more events channel.
 import argparse
 import sys
 
+import dbus.mainloop.glib
+import gobject
+
 from pycstbox import evtdb 
 from pycstbox import cli 
 from pycstbox import log 
 from pycstbox import dbuslib 
 from pycstbox import evtdao 
 from pycstbox import evtmgr 
+from pycstbox.evtdao.fsys import dao_fsys
 
 __author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
 
-# the database "driver" is selected here
+# the default database "driver"
 DAO_name = 'fsys'
 
 
@@ -47,6 +51,19 @@ def _event_channel_name(s):
     else:
         raise argparse.ArgumentTypeError('invalid channel name : %s' % s)
 
+
+def _channel_setting(s):
+    """ Parses a setting given as [CHANNEL:]VALUE, VALUE being an integer.
+
+    :returns: a (channel, value) tuple, channel being None if not specified
+    """
+    channel, _, value = s.rpartition(':')
+    try:
+        value = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid value : %s' % s)
+    return (_event_channel_name(channel) if channel else None), value
+
 if __name__ == '__main__':
     parser = cli.get_argument_parser(description="CSTBox Event Database service")
     parser.add_argument(
@@ -55,6 +72,13 @@ if __name__ == '__main__':
         help='Event channels list. If none specified, defaulted to sensor events channel',
         type=_event_channel_name
     )
+    parser.add_argument(
+        '--dao',
+        help="storage engine (default: %(default)s)",
+        dest='dao',
+        choices=evtdao.known_daos(),
+        default=DAO_name
+    )
     parser.add_argument(
         '--flash_memory',
         help="optimize IO strategy for flash memory",
@@ -62,6 +86,162 @@ if __name__ == '__main__':
         action='store_true',
         default=False
     )
+    parser.add_argument(
+        '--compression',
+        help="compression method of the past days files (default: none)",
+        dest='compression',
+        choices=dao_fsys.compression_methods(),
+        default=None
+    )
+    parser.add_argument(
+        '--recent_span',
+        help="time span in seconds of the recent events kept in memory, 0 to disable (default: DAO specific)",
+        dest='recent_span',
+        type=int,
+        default=None
+    )
+    parser.add_argument(
+        '--recent_memory',
+        help="maximum memory in bytes used by the recent events kept in memory (default: DAO specific)",
+        dest='recent_memory',
+        type=int,
+        default=None
+    )
+    parser.add_argument(
+        '--scan_workers',
+        help="number of processes scanning the days of long range queries in parallel, 0 to disable (default: DAO specific)",
+        dest='scan_workers',
+        type=int,
+        default=None
+    )
+    parser.add_argument(
+        '--scan_min_days',
+        help="minimal number of days of a query for using the parallel scan (default: DAO specific)",
+        dest='scan_min_days',
+        type=int,
+        default=None
+    )
+    parser.add_argument(
+        '--retention_max_age',
+        help="number of days the events are kept, as [CHANNEL:]DAYS. Can be repeated for "
+             "setting it per channel (default: unlimited)",
+        dest='retention_max_age',
+        type=_channel_setting,
+        action='append',
+        default=None
+    )
+    parser.add_argument(
+        '--retention_max_bytes',
+        help="maximum disk space in bytes used by the events of a channel, as [CHANNEL:]BYTES. "
+             "Can be repeated for setting it per channel (default: unlimited)",
+        dest='retention_max_bytes',
+        type=_channel_setting,
+        action='append',
+        default=None
+    )
+    parser.add_argument(
+        '--retention_downsample_age',
+        help="number of days the raw events are kept, only their hourly rollups being kept afterwards, "
+             "as [CHANNEL:]DAYS. Can be repeated for setting it per channel (default: unlimited)",
+        dest='retention_downsample_age',
+        type=_channel_setting,
+        action='append',
+        default=None
+    )
+    parser.add_argument(
+        '--deadband',
+        help="write side compression rule, as PATTERN[,abs=X][,rel=X][,max_silence=SECS], PATTERN being "
+             "matched against the variable types and the var_type:var_name keys. Can be repeated, "
+             "the first matching rule being applied (default: none)",
+        dest='deadband',
+        action='append',
+        default=None
+    )
+    parser.add_argument(
+        '--max_cursors',
+        help="maximum number of simultaneously opened query cursors (default: %(default)s)",
+        dest='max_cursors',
+        type=int,
+        default=evtdb.DEFAULT_MAX_CURSORS
+    )
+    parser.add_argument(
+        '--cursor_timeout',
+        help="delay in seconds after which an idle query cursor is discarded (default: %(default)s)",
+        dest='cursor_timeout',
+        type=int,
+        default=evtdb.DEFAULT_CURSOR_TIMEOUT
+    )
+
+    parser.add_argument(
+        '--write_queue_size',
+        help="maximum number of events waiting to be written (default: %(default)s)",
+        dest='write_queue_size',
+        type=int,
+        default=evtdb.DEFAULT_WRITE_QUEUE_SIZE
+    )
+    parser.add_argument(
+        '--write_batch_size',
+        help="maximum number of events written in a single batch (default: %(default)s)",
+        dest='write_batch_size',
+        type=int,
+        default=evtdb.DEFAULT_WRITE_BATCH_SIZE
+    )
+    parser.add_argument(
+        '--write_max_latency',
+        help="maximum delay in seconds before a received event is written (default: %(default)s)",
+        dest='write_max_latency',
+        type=float,
+        default=evtdb.DEFAULT_WRITE_MAX_LATENCY
+    )
+
+    parser.add_argument(
+        '--query_workers',
+        help="number of threads executing the queries (default: %(default)s)",
+        dest='query_workers',
+        type=int,
+        default=evtdb.DEFAULT_QUERY_WORKERS
+    )
+    parser.add_argument(
+        '--query_timeout',
+        help="maximum execution time in seconds of a query, 0 for no limit (default: %(default)s)",
+        dest='query_timeout',
+        type=int,
+        default=evtdb.DEFAULT_QUERY_TIMEOUT
+    )
+
+    parser.add_argument(
+        '--metrics_file',
+        help="path of the file in which the metrics are periodically written as JSON (default: none)",
+        dest='metrics_file',
+        default=None
+    )
+    parser.add_argument(
+        '--metrics_period',
+        help="period in seconds of the metrics file update (default: %(default)s)",
+        dest='metrics_period',
+        type=int,
+        default=evtdb.DEFAULT_METRICS_PERIOD
+    )
+
+    parser.add_argument(
+        '--profile',
+        help="profile the service calls from the start (can be toggled at runtime with set_profiling)",
+        dest='profiling',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--profile_dir',
+        help="directory in which the profiling statistics are written (default: %(default)s)",
+        dest='profile_dir',
+        default=evtdb.DEFAULT_PROFILE_DIR
+    )
+    parser.add_argument(
+        '--slow_call_threshold',
+        help="duration in seconds beyond which the service calls are logged, 0 for none (default: %(default)s)",
+        dest='slow_call_threshold',
+        type=float,
+        default=0
+    )
 
     args = parser.parse_args()
     loglevel = getattr(log, args.loglevel)
@@ -70,14 +250,55 @@ if __name__ == '__main__':
     channels = list(set(args.channels)) if args.channels else [evtmgr.SENSOR_EVENT_CHANNEL]
 
     dbuslib.dbus_init()
+    # events are written and queries executed by dedicated threads
+    dbus.mainloop.glib.threads_init()
+    gobject.threads_init()
 
     evtdao.log_setLevel(loglevel)
     config = {
-        evtdao.CFGKEY_FLASH_MEM_SUPPORT: args.flash_memory
+        evtdao.CFGKEY_FLASH_MEM_SUPPORT: args.flash_memory,
+        evtdao.CFGKEY_COMPRESSION: args.compression
     }
-    daos = [(ch, evtdao.get_dao(DAO_name, ch, config=config)) for ch in channels]
+    if args.recent_span is not None:
+        config[evtdao.CFGKEY_RECENT_SPAN] = args.recent_span
+    if args.recent_memory is not None:
+        config[evtdao.CFGKEY_RECENT_MEMORY] = args.recent_memory
+    if args.scan_workers is not None:
+        config[evtdao.CFGKEY_SCAN_WORKERS] = args.scan_workers
+    if args.scan_min_days is not None:
+        config[evtdao.CFGKEY_SCAN_MIN_DAYS] = args.scan_min_days
+    # retention settings are keyed by channel, None being used for all the other ones
+    if args.retention_max_age:
+        config[evtdao.CFGKEY_RETENTION_MAX_AGE] = dict(args.retention_max_age)
+    if args.retention_max_bytes:
+        config[evtdao.CFGKEY_RETENTION_MAX_BYTES] = dict(args.retention_max_bytes)
+    if args.retention_downsample_age:
+        config[evtdao.CFGKEY_RETENTION_DOWNSAMPLE_AGE] = dict(args.retention_downsample_age)
+    if args.deadband:
+        config[evtdao.CFGKEY_DEADBAND] = args.deadband
+    daos = [(ch, evtdao.get_dao(args.dao, ch, config=config)) for ch in channels]
+    # open the DAOs before the D-Bus connection is set up, so that the worker
+    # processes they fork (parallel scans) do not inherit it
+    for _, dao in daos:
+        dao.open()
 
-    svc = evtdb.EventsDatabase(dbuslib.get_bus(), daos)
+    svc = evtdb.EventsDatabase(
+        dbuslib.get_bus(), daos,
+        max_cursors=args.max_cursors,
+        cursor_timeout=args.cursor_timeout,
+        write_options={
+            'queue_size': args.write_queue_size,
+            'batch_size': args.write_batch_size,
+            'max_latency': args.write_max_latency
+        },
+        query_workers=args.query_workers,
+        query_timeout=args.query_timeout,
+        profiling=args.profiling,
+        profile_dir=args.profile_dir,
+        slow_call_threshold=args.slow_call_threshold,
+        metrics_file=args.metrics_file,
+        metrics_period=args.metrics_period
+    )
     svc.log_setLevel(loglevel)
     try:
         svc.start()
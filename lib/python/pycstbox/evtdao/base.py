@@ -21,14 +21,20 @@
 
 from datetime import datetime
 import os.path
+import math
+import re
+import fnmatch
 
 import importlib
-from collections import namedtuple
+from collections import namedtuple, deque
 from copy import deepcopy
 
 import pycstbox.evtmgr as evtmgr
+import pycstbox.events as events
 import pycstbox.log as log
+import pycstbox.sysutils as sysutils
 from pycstbox.config import GlobalSettings
+from pycstbox.evtdao.metrics import Metrics
 
 __author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
 
@@ -43,6 +49,16 @@ DriverSpecs = namedtuple('DriverSpecs', 'modname cfg')
 
 CFGKEY_EVTS_DB_HOME_DIR = 'evts_db_home_dir'
 CFGKEY_FLASH_MEM_SUPPORT = 'flash_memory'
+CFGKEY_COMPRESSION = 'compression'
+CFGKEY_RECENT_SPAN = 'recent_events_span'
+CFGKEY_RECENT_MEMORY = 'recent_events_memory'
+CFGKEY_SCAN_WORKERS = 'scan_workers'
+CFGKEY_SCAN_MIN_DAYS = 'scan_min_days'
+CFGKEY_RETENTION_MAX_AGE = 'retention_max_age'
+CFGKEY_RETENTION_MAX_BYTES = 'retention_max_bytes'
+CFGKEY_RETENTION_DOWNSAMPLE_AGE = 'retention_downsample_age'
+CFGKEY_DEADBAND = 'deadband'
+CFGKEY_HOUSEKEEPING = 'housekeeping'
 
 #
 # The dictionary of the supported DAOs, together with their configuration
@@ -51,17 +67,29 @@ CFGKEY_FLASH_MEM_SUPPORT = 'flash_memory'
 # TODO replace static dictionary by a discovery mechanism
 #
 _known_DAOs = {
-#    'sqlite': DriverSpecs(
-#        modname = 'pycstbox.evtdao.sqlite.dao_apsw',
-#        cfg = {'dbhome' : '/var/db/cstbox'}
-#    ),
+    'sqlite': DriverSpecs(
+        modname='pycstbox.evtdao.sqlite.dao_sqlite',
+        cfg={CFGKEY_EVTS_DB_HOME_DIR : '%(db_home_dir)s/events-sql'}
+    ),
     'fsys': DriverSpecs(
         modname='pycstbox.evtdao.fsys.dao_fsys',
         cfg={CFGKEY_EVTS_DB_HOME_DIR : '%(db_home_dir)s/events'}
+    ),
+    'colstore': DriverSpecs(
+        modname='pycstbox.evtdao.colstore.dao_colstore',
+        cfg={CFGKEY_EVTS_DB_HOME_DIR : '%(db_home_dir)s/events-col'}
     )
 }
 
 
+def known_daos():
+    """ Returns the names of the supported DAOs.
+
+    :rtype: list of str
+    """
+    return sorted(_known_DAOs.keys())
+
+
 def get_dao(dao_name, events_channel=evtmgr.SENSOR_EVENT_CHANNEL, config=None, readonly=False):
     """ Returns an instance of the DAO specified by its name, and for a given
     event channel.
@@ -123,6 +151,202 @@ TS_FMT_SECS = DATE_FMT + ' ' + TOD_FMT
 TS_FMT_FULL = TS_FMT_SECS + '.%f'
 
 
+AGG_MIN = 'min'
+AGG_MAX = 'max'
+AGG_MEAN = 'mean'
+AGG_COUNT = 'count'
+AGG_FIRST = 'first'
+AGG_LAST = 'last'
+AGG_FUNCTIONS = (AGG_MIN, AGG_MAX, AGG_MEAN, AGG_COUNT, AGG_FIRST, AGG_LAST)
+
+# fields of the records returned by get_records()
+FIELD_TS = 'ts'
+FIELD_VAR_TYPE = 'var_type'
+FIELD_VAR_NAME = 'var_name'
+FIELD_VALUE = 'value'
+FIELD_DATA = 'data'
+RECORD_FIELDS = (FIELD_TS, FIELD_VAR_TYPE, FIELD_VAR_NAME, FIELD_VALUE, FIELD_DATA)
+
+# timestamp forms of the records returned by get_records()
+TS_DATETIME = 'datetime'    # naive UTC datetime
+TS_EPOCH = 'epoch'          # milliseconds since the epoch
+TS_TEXT = 'text'            # string formatted with TS_FMT_FULL
+TS_RAW = 'raw'              # storage native form (TS_TEXT if none)
+TS_FORMATS = (TS_DATETIME, TS_EPOCH, TS_TEXT, TS_RAW)
+
+# prefix of the regular expressions in variable filters
+REGEX_PREFIX = 're:'
+
+_GLOB_CHARS = frozenset('*?[')
+
+
+class VarFilter(object):
+    """ Matcher of variable types or names.
+
+    It is built from a filter specification, which can be:
+
+        - a string, being an exact name, a glob pattern if it contains one of
+          the "*?[" characters, or a regular expression if prefixed by "re:"
+          (which must match the whole name)
+        - a list of such strings, matching if any of them matches
+
+    Exact names are looked up in a set, and patterns are compiled in a single
+    regular expression, so that the cost of a match does not depend much on
+    the number of items of the specification.
+    """
+    def __init__(self, spec):
+        """
+        :param str_or_list spec: the filter specification
+        """
+        self.spec = spec
+        items = [spec] if isinstance(spec, basestring) else list(spec)
+        self.names = set()
+        patterns = []
+        for item in items:
+            item = str(item)
+            if item.startswith(REGEX_PREFIX):
+                patterns.append(item[len(REGEX_PREFIX):])
+            elif _GLOB_CHARS.intersection(item):
+                patterns.append(fnmatch.translate(item).replace('\\Z(?ms)', ''))
+            else:
+                self.names.add(item)
+        try:
+            self.regex = re.compile(
+                '(?s)(?:%s)\\Z' % '|'.join('(?:%s)' % p for p in patterns)
+            ) if patterns else None
+        except re.error as e:
+            raise ValueError('invalid variable filter pattern (%s)' % e)
+
+    @classmethod
+    def from_spec(cls, spec):
+        """ Returns the filter corresponding to a specification.
+
+        :param spec: the filter specification, or an already built filter
+        :returns: the filter, or None if the specification is empty (ie matches everything)
+        :raises ValueError: if a regular expression is invalid
+        """
+        if not spec or isinstance(spec, VarFilter):
+            return spec or None
+        return cls(spec)
+
+    @property
+    def exact(self):
+        """ True if the filter only contains exact names."""
+        return self.regex is None
+
+    def match(self, value):
+        """ Returns True if a variable type or name matches the filter."""
+        return value in self.names or (self.regex is not None and self.regex.match(value) is not None)
+
+    def select(self, values):
+        """ Returns the values matching the filter among an iterable
+        (the keys of an index f.i.).
+        """
+        if self.regex is None:
+            return [v for v in self.names if v in values] if isinstance(values, (dict, set, frozenset)) \
+                else [v for v in values if v in self.names]
+        return [v for v in values if self.match(v)]
+
+    def __reduce__(self):
+        # for passing filters to the parallel scan worker processes
+        return VarFilter, (self.spec,)
+
+    def __repr__(self):
+        return 'VarFilter(%r)' % (self.spec,)
+
+
+class Aggregate(object):
+    """ Streaming summary of a set of numeric values.
+
+    Values are added one at a time and are not kept, so that memory usage does
+    not depend on the number of aggregated events. First and last values are
+    the ones with the lowest and highest timestamps, whatever the order in which
+    they are added is.
+    """
+    __slots__ = ['count', 'min', 'max', 'sum', 'first_ts', 'first', 'last_ts', 'last']
+
+    def __init__(self):
+        self.count = 0
+        self.min = self.max = self.first = self.last = None
+        self.sum = 0.0
+        self.first_ts = self.last_ts = None
+
+    def add(self, timestamp, value):
+        """ Adds a value to the summary.
+
+        :param timestamp: the timestamp of the value (any comparable type)
+        :param float value: the value
+        """
+        if self.count:
+            if value < self.min:
+                self.min = value
+            elif value > self.max:
+                self.max = value
+            if timestamp < self.first_ts:
+                self.first_ts, self.first = timestamp, value
+            if timestamp >= self.last_ts:
+                self.last_ts, self.last = timestamp, value
+        else:
+            self.min = self.max = self.first = self.last = value
+            self.first_ts = self.last_ts = timestamp
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        """ Adds the values summarized by another aggregate.
+        """
+        if not other.count:
+            return
+        if self.count:
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            if other.first_ts < self.first_ts:
+                self.first_ts, self.first = other.first_ts, other.first
+            if other.last_ts >= self.last_ts:
+                self.last_ts, self.last = other.last_ts, other.last
+        else:
+            self.min, self.max = other.min, other.max
+            self.first_ts, self.first = other.first_ts, other.first
+            self.last_ts, self.last = other.last_ts, other.last
+        self.count += other.count
+        self.sum += other.sum
+
+    def as_list(self):
+        """ Returns the serializable form of the aggregate."""
+        return [self.count, self.min, self.max, self.sum, self.first_ts, self.first, self.last_ts, self.last]
+
+    @classmethod
+    def from_list(cls, l):
+        """ Builds an aggregate from its serializable form, as returned by as_list()."""
+        agg = cls()
+        agg.count, agg.min, agg.max, agg.sum, agg.first_ts, agg.first, agg.last_ts, agg.last = l
+        return agg
+
+    def result(self, functions=AGG_FUNCTIONS):
+        """ Returns the requested aggregation results as a dictionary keyed by
+        the function names.
+        """
+        results = {
+            AGG_MIN: self.min,
+            AGG_MAX: self.max,
+            AGG_MEAN: self.sum / self.count if self.count else None,
+            AGG_COUNT: self.count,
+            AGG_FIRST: self.first,
+            AGG_LAST: self.last
+        }
+        return {f: results[f] for f in functions}
+
+
+def to_number(value):
+    """ Converts an event value to a float, returning None if it is not numeric.
+    """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+
 class AbstractDAO(log.Loggable):
     """ Root abstract class for implementing a DAO.
 
@@ -139,6 +363,18 @@ class AbstractDAO(log.Loggable):
                 pre-defined ones.
         """
         log.Loggable.__init__(self, logname='EventsDAO(ch:%s)' % events_channel)
+        # counters and latency histograms of the implementation hot paths
+        self.metrics = Metrics()
+        # the write side compression policy (see pycstbox.evtdao.deadband),
+        # set by the implementations supporting it
+        self._deadband = None
+        self._opened = False
+
+    @property
+    def opened(self):
+        """ True if the database has been opened and not closed since.
+        """
+        return self._opened
 
     def insert_event(self, msecs, var_type, var_name, data):
         """ Inserts an event in the database.
@@ -153,6 +389,19 @@ class AbstractDAO(log.Loggable):
         """
         raise NotImplementedError()
 
+    def insert_events(self, evts):
+        """ Inserts a batch of events in the database.
+
+        The default implementation inserts the events one at a time. Concrete
+        implementations should override it when they can process a batch more
+        efficiently than its individual events (single write, single commit,...).
+
+        :param evts: an iterable of (msecs, var_type, var_name, data) tuples,
+            with the same meaning as insert_event() parameters
+        """
+        for msecs, var_type, var_name, data in evts:
+            self.insert_event(msecs, var_type, var_name, data)
+
     def insert_timed_event(self, event):
         """ Convenience method handling a instance of pycstbox.events.TimedEvent
         for the event to be inserted in the database.
@@ -179,6 +428,33 @@ class AbstractDAO(log.Loggable):
         """
         raise NotImplementedError()
 
+    def get_last_values(self, pattern=None):
+        """ Returns the most recent event of each variable.
+
+        This method is mandatory.
+
+        :param str pattern: (optional) a variable type, or a glob pattern
+            matched against the variable types and the "var_type:var_name"
+            keys, for restricting the result
+        :returns: the list of the events (as pycstbox.events.TimedEvent
+            instances), sorted by variable type and name
+        """
+        raise NotImplementedError()
+
+    def get_days_catalog(self, month=None):
+        """ Returns the list of days for which we have events in the database,
+        together with their number of events and storage size.
+
+        The default implementation returns the available days without size
+        information. DAOs maintaining these metrics should override it.
+
+        :param tuple month: (optional) a tuple containing the year and month
+            number if only days for this month are wanted
+        :returns: a list of (day, records count, size in bytes) tuples, sorted
+            by day, counts and sizes being -1 when not known
+        """
+        return [(day, -1, -1) for day in self.get_available_days(month)]
+
     def get_events_for_day(self, day, var_type=None, var_name=None):
         """ Generator returning the events available for a given day,
         optionally filtering them by event class and/or var_name.
@@ -191,6 +467,12 @@ class AbstractDAO(log.Loggable):
         :param str var_type:
                 an optional variable type (eg: temperature) which is used to
                 filter the extracted events if provided
+        :param str var_name:
+                an optional variable name which is used to filter the extracted
+                events if provided
+
+        Both filters can also be glob patterns, regular expressions or lists
+        (see VarFilter).
 
         :returns: the list of corresponding events (as pycstbox.events.TimedEvent instances),
         if any
@@ -211,11 +493,260 @@ class AbstractDAO(log.Loggable):
         :param str var_type: type of the variable (ignored if var_name provided)
         :param str var_name: name of the variable
 
+        Variable filters can be exact names, glob patterns, regular expressions
+        prefixed by "re:", or lists of them, all the matching events being
+        returned in a single stream (see VarFilter).
+
         :returns: the list of corresponding events (as pycstbox.events.TimedEvent instances),
         if any
         """
         pass
 
+    def get_records(self, from_time=None, to_time=None, var_type=None, var_name=None,
+                    fields=RECORD_FIELDS, ts_format=TS_DATETIME):
+        """ Generator for event queries returning only some of their fields.
+
+        Filtering parameters are the same as for get_events(). DAOs can
+        override this method for avoiding the decoding of the fields which are
+        not requested. The default implementation projects the result of
+        get_events().
+
+        :param fields: the requested fields (see RECORD_FIELDS), in the order
+            they must appear in the records
+        :param str ts_format: the form of the returned timestamps (see TS_FORMATS)
+
+        :returns: the records, as lists of the requested fields values
+        :raises ValueError: if an unknown field or timestamp format is requested
+        """
+        self._check_records_args(fields, ts_format)
+        getters = {
+            FIELD_TS: lambda e: self._format_ts(e.timestamp, ts_format),
+            FIELD_VAR_TYPE: lambda e: e.var_type,
+            FIELD_VAR_NAME: lambda e: e.var_name,
+            FIELD_VALUE: lambda e: e.value,
+            FIELD_DATA: lambda e: dict((k, v) for k, v in e.data.iteritems() if k != events.DataKeys.VALUE),
+        }
+        getters = [getters[f] for f in fields]
+        for event in self.get_events(from_time, to_time, var_type, var_name):
+            yield [get(event) for get in getters]
+
+    @staticmethod
+    def _match_var_pattern(pattern, var_type, var_name):
+        """ Tells if a variable is matched by a get_last_values() pattern.
+        """
+        return (
+            fnmatch.fnmatchcase(var_type, pattern) or
+            fnmatch.fnmatchcase(var_type + ':' + var_name, pattern)
+        )
+
+    @staticmethod
+    def _check_records_args(fields, ts_format):
+        """ Checks the parameters of get_records().
+
+        :raises ValueError: if they are not valid
+        """
+        unknown = set(fields) - set(RECORD_FIELDS)
+        if unknown:
+            raise ValueError('unknown field(s) : %s' % ', '.join(unknown))
+        if ts_format not in TS_FORMATS:
+            raise ValueError('unknown timestamp format : %s' % ts_format)
+
+    @staticmethod
+    def _format_ts(timestamp, ts_format):
+        """ Returns a timestamp in the given form.
+
+        :param datetime timestamp: the timestamp
+        :param str ts_format: the form (see TS_FORMATS). TS_RAW is handled as TS_TEXT.
+        """
+        if ts_format == TS_DATETIME:
+            return timestamp
+        elif ts_format == TS_EPOCH:
+            return sysutils.to_milliseconds(timestamp)
+        else:
+            return timestamp.strftime(TS_FMT_FULL)
+
+    def get_aggregates(self, var_name, from_time=None, to_time=None, bucket_seconds=3600,
+                       functions=AGG_FUNCTIONS):
+        """ Computes statistics of the values of a variable over time buckets.
+
+        Buckets are aligned on multiples of their duration since the epoch. The
+        default implementation computes the aggregates in a single streaming
+        pass over the result of get_events(), the values being converted to
+        numbers once. Events with non numeric values are ignored.
+
+        :param str var_name: name of the variable
+        :param datetime.datetime from_time: inclusive lower bound of the time span to consider
+        :param datetime.datetime to_time: inclusive upper bound of the time span to consider
+        :param int bucket_seconds: the duration of the buckets, in seconds
+        :param functions: the names of the aggregation functions to be computed
+            (see AGG_FUNCTIONS)
+
+        :returns: the list of (bucket start time, results dictionary) tuples,
+            sorted by bucket start time. Buckets without values are omitted.
+        :raises ValueError: if an unsupported function is requested or if
+            the bucket duration is not positive
+        """
+        self._check_aggregates_args(bucket_seconds, functions)
+
+        buckets = {}
+        self._aggregate_events(
+            buckets, bucket_seconds * 1000,
+            self.get_events(from_time=from_time, to_time=to_time, var_name=var_name)
+        )
+        return self._aggregates_result(buckets, functions)
+
+    @staticmethod
+    def _check_aggregates_args(bucket_seconds, functions):
+        """ Checks the parameters of get_aggregates().
+
+        :raises ValueError: if they are not valid
+        """
+        unknown = set(functions) - set(AGG_FUNCTIONS)
+        if unknown:
+            raise ValueError('unsupported aggregation function(s) : %s' % ', '.join(unknown))
+        if bucket_seconds <= 0:
+            raise ValueError('invalid bucket duration : %s' % bucket_seconds)
+
+    @staticmethod
+    def _aggregate_events(buckets, bucket_ms, evts):
+        """ Adds the numeric values of events to the aggregates of their bucket.
+
+        :param dict buckets: the aggregates, keyed by bucket start time (in milliseconds)
+        :param int bucket_ms: the duration of the buckets, in milliseconds
+        :param evts: an iterable of events (as pycstbox.events.TimedEvent instances)
+        """
+        for event in evts:
+            value = to_number(event.value)
+            if value is None:
+                continue
+            msecs = sysutils.to_milliseconds(event.timestamp)
+            bucket = msecs - msecs % bucket_ms
+            try:
+                agg = buckets[bucket]
+            except KeyError:
+                agg = buckets[bucket] = Aggregate()
+            agg.add(msecs, value)
+
+    @staticmethod
+    def _aggregates_result(buckets, functions):
+        """ Returns the get_aggregates() result corresponding to a buckets dictionary.
+        """
+        return [
+            (datetime.utcfromtimestamp(bucket / 1000), buckets[bucket].result(functions))
+            for bucket in sorted(buckets)
+        ]
+
+    def get_variables_for_day(self, day):
+        """ Returns the variables for which events are available for a given day.
+
+        The default implementation scans the events of the day. Concrete
+        implementations should override it when they can do better.
+
+        :param str_or_date day: the day (see get_events_for_day())
+        :returns: the sorted list of (var_type, var_name) tuples
+        """
+        return sorted(set((evt.var_type, evt.var_name) for evt in self.get_events_for_day(day)))
+
+    def get_day_file(self, day):
+        """ Returns the path of a file containing all the events of a past
+        day in the raw export format (see the export module), so that it can
+        be exported by copying it as is.
+
+        The default implementation returns None, meaning that the events must
+        be exported one at a time.
+
+        :param date day: the day
+        :returns: the file path, or None if not available
+        """
+        return None
+
+    def get_retention_report(self):
+        """ Returns the report of the retention policy enforcement.
+
+        The default implementation returns an empty dictionary, meaning that
+        no retention policy is supported.
+
+        :returns: a dictionary of statistics, which content depends on the implementation
+        """
+        return {}
+
+    def get_deadband_report(self):
+        """ Returns the report of the write side compression.
+
+        :returns: a dictionary containing the rules of the deadband policy and
+            the counts of stored and suppressed events, globally and per
+            variable, or an empty one if no policy is used
+        """
+        return self._deadband.report() if self._deadband else {}
+
+    def get_value_intervals(self, from_time=None, to_time=None, var_type=None, var_name=None):
+        """ Generator returning the intervals during which the stored values
+        remained valid.
+
+        When events are compressed, a stored event stands for the suppressed
+        ones which followed it. Its value is thus valid from its timestamp until
+        the next stored event of its variable, without exceeding the maximum
+        silence of the deadband rule applied to the variable if any (beyond it,
+        the missing heartbeat means that the value is not known anymore). The
+        intervals of the last events end at to_time, or are not bounded if it
+        is not provided.
+
+        Filtering parameters are the same as for get_events(). Intervals are
+        returned as soon as they are closed, so that only the ones of the
+        variables which have not changed since are kept in memory. Events
+        older than the last one of their variable (late events appended to the
+        storage) do not alter the interval of the latter, theirs ending at its
+        start at most.
+
+        :returns: (var_type, var_name, value, valid_from, valid_to) tuples,
+            in the order of the events returned by get_events() (ie sorted by
+            valid_from, late events apart), times being datetimes and valid_to
+            None when not bounded
+        """
+        def close(interval, end):
+            limit = interval[5]
+            interval[4] = min(end, limit) if end and limit else end or limit
+            interval[6] = True
+
+        # the intervals not returned yet, as [var_type, var_name, value,
+        # valid_from, valid_to, validity limit, closed] lists, in chronological order
+        pending = deque()
+        # (var_type, var_name) -> the last interval of the variable
+        last = {}
+        silences = {}
+        for event in self.get_events(from_time, to_time, var_type, var_name):
+            ts = event.timestamp
+            key = (event.var_type, event.var_name)
+            try:
+                silence = silences[key]
+            except KeyError:
+                silence = silences[key] = self._deadband.max_silence_for(*key) if self._deadband else None
+            interval = [event.var_type, event.var_name, event.value, ts, None,
+                        ts + silence if silence else None, False]
+
+            previous = last.get(key)
+            if previous is not None and ts < previous[3]:
+                close(interval, previous[3])
+            else:
+                if previous is not None and not previous[6]:
+                    close(previous, ts)
+                last[key] = interval
+            pending.append(interval)
+
+            while pending:
+                head = pending[0]
+                if not head[6]:
+                    if head[5] is None or head[5] > ts:
+                        break
+                    close(head, head[5])
+                pending.popleft()
+                yield tuple(head[:5])
+
+        for interval in pending:
+            if not interval[6]:
+                close(interval, to_time)
+            yield tuple(interval[:5])
+
     def open(self):
         """ Opens the database, creating it on the fly if not yet available.
 
@@ -223,15 +754,18 @@ class AbstractDAO(log.Loggable):
 
         Calling open() for an already opened database should do nothing,
         apart maybe logging it as a warning.
+
+        Implementations overriding this method must set the opened flag.
         """
-        pass
+        self._opened = True
 
     def close(self):
         """ Closes the database if not yet done
 
         This is an optional method, depending on the underlying implementation.
+        Implementations overriding it must reset the opened flag.
         """
-        pass
+        self._opened = False
 
     def flush(self):
         """ Flushes pending writes
@@ -0,0 +1,807 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Compact binary columnar storage for events.
+
+Each day is stored in a directory named "YYMMDD", containing:
+
+    - a string table ("vars"), listing the variables of the day as
+      "<var_type> TAB <var_name>" lines, the line number being the variable id
+    - for each variable, four column files named after its id :
+        - "<id>.ts" : the timestamps, as milliseconds counts since the epoch
+        - "<id>.val" : the numeric form of the values
+        - "<id>.typ" : the type tags of the values, one byte per event, telling
+          how the value must be restored (float, integer, boolean, or verbatim
+          value kept in the data column) and if the event has additional data
+        - "<id>.dat" : the additional data, as one JSON line per event (an empty
+          line meaning no additional data)
+
+Timestamps and values are stored as native 64 bits floats (array typecode 'd'),
+so that they can be loaded in a single operation with array.fromfile(). A
+64 bits float represents exactly the milliseconds counts of any realistic date,
+and Python 2 arrays do not provide a portable 64 bits integer type. Values
+which are not numbers (strings, None,...) are stored as NaN in the values
+column and kept verbatim in the data column.
+
+Reading the events of a given variable is thus done without any per-record
+parsing, the data column being only loaded and decoded for the events which
+carry additional data or a non numeric value.
+
+The columns are appended one after the other when committed. Their lengths
+are checked when a day is opened for writing, and the rows of an interrupted
+commit are removed. Rows not committed yet are served from memory.
+"""
+
+import os
+import array
+import json
+import heapq
+import threading
+import time
+from datetime import date, datetime
+
+from pycstbox import evtdao
+from pycstbox import evtmgr
+from pycstbox import events
+from pycstbox import sysutils
+from pycstbox.evtdao.deadband import DeadbandPolicy
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+
+_DAY_DIR_FMT = '%y%m%d'
+_VARS_FNAME = 'vars'
+_TS_EXT = '.ts'
+_VALUE_EXT = '.val'
+_TYPE_EXT = '.typ'
+_DATA_EXT = '.dat'
+_FLD_SEP = '\t'
+
+_COLUMN_TYPE = 'd'
+_ITEM_SIZE = array.array(_COLUMN_TYPE).itemsize
+_TAG_TYPE = 'B'
+
+# kinds of the values, stored in the low bits of the type tags
+_KIND_FLOAT = 0
+_KIND_INT = 1
+_KIND_BOOL = 2
+_KIND_RAW = 3           # kept verbatim in the data column
+_KIND_MASK = 0x0f
+# flag of the events having a data line
+_HAS_DATA = 0x10
+
+# integers beyond this cannot be stored exactly as floats
+_MAX_EXACT_INT = 2 ** 53
+
+# key used in the data column for storing non numeric values
+_RAW_VALUE_KEY = events.DataKeys.VALUE
+
+
+def _encode_value(value):
+    """ Returns the kind and the numeric form of a value.
+    """
+    if isinstance(value, bool):
+        return _KIND_BOOL, float(value)
+    if isinstance(value, (int, long)) and abs(value) <= _MAX_EXACT_INT:
+        return _KIND_INT, float(value)
+    if isinstance(value, float):
+        return _KIND_FLOAT, value
+    return _KIND_RAW, float('nan')
+
+
+class _Columns(object):
+    """ The columns of a variable, or a part of them.
+
+    The data lines are loaded on first access when the columns are read from
+    the files.
+    """
+    __slots__ = ['timestamps', 'values', 'tags', 'data_lines', 'data_path']
+
+    def __init__(self, timestamps=None, values=None, tags=None, data_lines=None, data_path=None):
+        self.timestamps = timestamps if timestamps is not None else array.array(_COLUMN_TYPE)
+        self.values = values if values is not None else array.array(_COLUMN_TYPE)
+        self.tags = tags if tags is not None else array.array(_TAG_TYPE)
+        # None until loaded from data_path
+        self.data_lines = [] if data_lines is None and data_path is None else data_lines
+        self.data_path = data_path
+
+    def __len__(self):
+        return len(self.tags)
+
+    def append(self, msecs, value, tag, data_line):
+        self.timestamps.append(msecs)
+        self.values.append(value)
+        self.tags.append(tag)
+        self.data_lines.append(data_line)
+
+    def copy(self):
+        return _Columns(
+            array.array(_COLUMN_TYPE, self.timestamps), array.array(_COLUMN_TYPE, self.values),
+            array.array(_TAG_TYPE, self.tags), list(self.data_lines)
+        )
+
+    def get_data(self, i):
+        """ Returns the additional data of a row, as a dictionary.
+        """
+        if self.data_lines is None:
+            try:
+                with open(self.data_path) as fp:
+                    self.data_lines = fp.readlines()
+            except IOError:
+                self.data_lines = []
+        try:
+            line = self.data_lines[i]
+        except IndexError:
+            return {}
+        return json.loads(line) if len(line) > 1 else {}
+
+    def rows(self, from_ms=None, to_ms=None, with_data=True, start=0):
+        """ Generator returning the rows included in a time span, as
+        (index, msecs, value, data) tuples.
+
+        :param bool with_data: if False, the additional data are not decoded
+            (unless the value is kept in them) and are returned as None
+        :param int start: the index of the first examined row
+        """
+        timestamps, values, tags = self.timestamps, self.values, self.tags
+        for i in xrange(start, len(tags)):
+            msecs = timestamps[i]
+            if (from_ms is not None and msecs < from_ms) or (to_ms is not None and msecs > to_ms):
+                continue
+            tag = tags[i]
+            kind = tag & _KIND_MASK
+            if kind == _KIND_RAW:
+                data = self.get_data(i)
+                value = data.pop(_RAW_VALUE_KEY, None)
+                if not with_data:
+                    data = None
+            else:
+                data = (self.get_data(i) if tag & _HAS_DATA else {}) if with_data else None
+                if kind == _KIND_FLOAT:
+                    value = values[i]
+                elif kind == _KIND_INT:
+                    value = int(values[i])
+                else:
+                    value = bool(values[i])
+            yield i, msecs, value, data
+
+
+class _DayWriter(object):
+    """ Write side state of a day directory.
+
+    Columns are accumulated in memory and appended to the files when committed.
+    """
+    def __init__(self, path, logger):
+        self.path = path
+        if not os.path.exists(path):
+            os.mkdir(path)
+        _repair_day(path, logger)
+        self.var_ids = _load_vars(path)
+        self.new_vars = []
+        # var id -> count of the rows written in the column files
+        self.committed = {
+            var_id: _column_length(os.path.join(path, str(var_id)) + _TYPE_EXT, 1)
+            for var_id in self.var_ids.itervalues()
+        }
+        # var id -> _Columns
+        self.pending = {}
+
+    def append(self, msecs, var_type, var_name, value, tag, data_line):
+        key = (var_type, var_name)
+        try:
+            var_id = self.var_ids[key]
+        except KeyError:
+            var_id = self.var_ids[key] = len(self.var_ids)
+            self.new_vars.append(key)
+
+        try:
+            columns = self.pending[var_id]
+        except KeyError:
+            columns = self.pending[var_id] = _Columns()
+        columns.append(msecs, value, tag, data_line)
+
+    def commit(self):
+        """ Appends the pending data to the column files."""
+        if self.new_vars:
+            with open(os.path.join(self.path, _VARS_FNAME), 'a') as fp:
+                fp.write(''.join(_FLD_SEP.join(key) + '\n' for key in self.new_vars))
+            self.new_vars = []
+
+        for var_id, columns in self.pending.iteritems():
+            base = os.path.join(self.path, str(var_id))
+            with open(base + _TS_EXT, 'ab') as fp:
+                columns.timestamps.tofile(fp)
+            with open(base + _VALUE_EXT, 'ab') as fp:
+                columns.values.tofile(fp)
+            with open(base + _TYPE_EXT, 'ab') as fp:
+                columns.tags.tofile(fp)
+            with open(base + _DATA_EXT, 'ab') as fp:
+                fp.write(''.join(columns.data_lines))
+            self.committed[var_id] = self.committed.get(var_id, 0) + len(columns)
+        self.pending = {}
+
+
+def _load_vars(path):
+    """ Loads the string table of a day directory.
+
+    :returns: a dictionary giving the id of the variables, keyed by (var_type, var_name) tuples
+    """
+    try:
+        with open(os.path.join(path, _VARS_FNAME)) as fp:
+            return {
+                tuple(line.rstrip('\n').split(_FLD_SEP, 1)): var_id
+                for var_id, line in enumerate(fp)
+                if line.endswith('\n')
+            }
+    except IOError:
+        return {}
+
+
+def _column_length(path, item_size):
+    """ Returns the number of items of a column file (0 if it does not exist)."""
+    try:
+        return os.path.getsize(path) // item_size
+    except OSError:
+        return 0
+
+
+def _load_column(path, typecode=_COLUMN_TYPE, count=None):
+    """ Loads a column file as an array.
+
+    :param int count: the maximum number of items to be loaded (all if None)
+    """
+    column = array.array(typecode)
+    try:
+        with open(path, 'rb') as fp:
+            available = os.fstat(fp.fileno()).st_size // column.itemsize
+            column.fromfile(fp, available if count is None else min(count, available))
+    except IOError:
+        pass
+    return column
+
+
+def _load_columns(path, var_id, count=None):
+    """ Loads the columns of a variable, the data being loaded on first access.
+
+    Columns are truncated to the shortest of them, since they can be unbalanced
+    if read while being committed by a writer in another process.
+
+    :param int count: the maximum number of rows to be loaded (all if None)
+    """
+    base = os.path.join(path, str(var_id))
+    timestamps = _load_column(base + _TS_EXT, count=count)
+    values = _load_column(base + _VALUE_EXT, count=count)
+    tags = _load_column(base + _TYPE_EXT, _TAG_TYPE, count)
+    count = min(len(timestamps), len(values), len(tags))
+    for column in (timestamps, values, tags):
+        del column[count:]
+    return _Columns(timestamps, values, tags, data_path=base + _DATA_EXT)
+
+
+def _truncate(path, size):
+    with open(path, 'r+b') as fp:
+        fp.truncate(size)
+
+
+def _repair_day(path, logger):
+    """ Restores the consistency of the files of a day directory after an
+    interrupted commit, by removing the incomplete rows.
+    """
+    vars_path = os.path.join(path, _VARS_FNAME)
+    try:
+        with open(vars_path) as fp:
+            content = fp.read()
+    except IOError:
+        return
+    if content and not content.endswith('\n'):
+        logger.warning("%s: incomplete variable definition removed", vars_path)
+        content = content[:content.rfind('\n') + 1]
+        _truncate(vars_path, len(content))
+
+    for var_id in xrange(content.count('\n')):
+        base = os.path.join(path, str(var_id))
+        try:
+            with open(base + _DATA_EXT, 'rb') as fp:
+                data = fp.read()
+        except IOError:
+            data = ''
+        lengths = [
+            _column_length(base + _TS_EXT, _ITEM_SIZE),
+            _column_length(base + _VALUE_EXT, _ITEM_SIZE),
+            _column_length(base + _TYPE_EXT, 1),
+            data.count('\n')
+        ]
+        count = min(lengths)
+        if max(lengths) == count:
+            continue
+
+        logger.warning("%s: unbalanced columns %s, truncated to %d rows", base, lengths, count)
+        for ext, item_size in ((_TS_EXT, _ITEM_SIZE), (_VALUE_EXT, _ITEM_SIZE), (_TYPE_EXT, 1)):
+            if os.path.exists(base + ext):
+                _truncate(base + ext, count * item_size)
+        offset = 0
+        for _ in xrange(count):
+            offset = data.index('\n', offset) + 1
+        if os.path.exists(base + _DATA_EXT):
+            _truncate(base + _DATA_EXT, offset)
+
+
+
+class EventsDAO(evtdao.AbstractDAO):
+    """ Implements the event data object as a binary columnar storage.
+
+    See module documentation for the storage layout.
+    """
+    MAX_FLUSH_AGE = 3600 * 2        # flush files every 2 hours at least
+
+    class Error(Exception):
+        """ Exceptions specialized for this DAO."""
+        pass
+
+    def __init__(self,
+                 events_channel=evtmgr.SENSOR_EVENT_CHANNEL,
+                 config=None,
+                 readonly=False):
+        """ Constructor.
+
+        Day directories are stored in the directory which path is defined by
+        <dbhome>/<channel>. If the database is opened in write mode, the storage
+        directories are created if not yet available.
+
+        Parameters:
+            events_channel:
+                the channel (ie sensor, sysmon,...) of the events to be stored
+            config:
+                the DAO configuration parameters (mandatory)
+            readonly:
+                guess what... (default: False)
+
+        Raises:
+            ValueError:
+                if mandatory parameters not provided
+            IOError:
+                if provided dbhome does not exists, is not a directory or
+                cannot be written to
+        """
+        if not config:
+            raise ValueError("missing mandatory parameter : config")
+
+        dbhome = config[evtdao.CFGKEY_EVTS_DB_HOME_DIR]
+        if not os.path.exists(dbhome):
+            if readonly:
+                raise IOError('path not found : %s' % dbhome)
+            else:
+                os.mkdir(dbhome)
+        else:
+            if not os.path.isdir(dbhome):
+                raise IOError('path is not a directory : %s' % dbhome)
+
+        super(EventsDAO, self).__init__(events_channel)
+
+        self._dbhome = os.path.join(dbhome, events_channel)
+        if not os.path.exists(self._dbhome):
+            if readonly:
+                raise IOError('path not found : %s' % self._dbhome)
+            os.mkdir(self._dbhome)
+
+        self._readonly = readonly
+        self._flash_memory = config.get(evtdao.CFGKEY_FLASH_MEM_SUPPORT, False)
+        if self._flash_memory:
+            self._logger.warning("flash memory support declared: systematic flush on write will be disabled")
+        self._last_flush = 0
+
+        self._deadband = DeadbandPolicy.from_config(config)
+        if self._deadband:
+            self._logger.info("deadband policy: %s", self._deadband)
+
+        # day -> _DayWriter
+        self._writers = {}
+        self._write_lock = threading.RLock()
+        # latest event of each variable, as (msecs, value, data) tuples keyed
+        # by (var_type, var_name), maintained by the writes once opened
+        self._last_values = None
+        # day -> (size of the vars file, var ids), for the days not written
+        self._day_vars = {}
+
+    def __enter__(self):
+        return self
+
+    def insert_event(self, msecs, var_type, var_name, data):
+        """ See DAOObject class"""
+        assert msecs
+        assert var_type
+        assert var_name
+        assert data
+
+        self.insert_events([(msecs, var_type, var_name, data)])
+
+    def insert_events(self, evts):
+        """ See DAOObject class"""
+        if self._readonly:
+            msg = 'database opened in readonly'
+            self._logger.error(msg)
+            raise IOError(msg)
+
+        inserted = 0
+        suppressed = 0
+        deadband_changes = {}
+        with self.metrics.timed('insert_events'), self._write_lock:
+            for msecs, var_type, var_name, data in evts:
+                if type(data) is dict:
+                    data_dict = dict(data)
+                else:
+                    try:
+                        data_dict = json.loads(data)
+                    except ValueError as e:
+                        self._logger.error('malformed event data (%s): %s', data, e.message)
+                        continue
+
+                try:
+                    value = data_dict.pop(events.DataKeys.VALUE)
+                except KeyError:
+                    self._logger.error('missing value field in data (%s)', data)
+                    continue
+
+                if self._deadband and not self._deadband.accept(msecs, var_type, var_name, value, deadband_changes):
+                    suppressed += 1
+                    continue
+
+                if self._last_values is not None:
+                    key = (var_type, var_name)
+                    last = self._last_values.get(key)
+                    if last is None or msecs >= last[0]:
+                        self._last_values[key] = (msecs, value, data_dict)
+
+                tag, num_value = _encode_value(value)
+                if tag == _KIND_RAW:
+                    data_dict = dict(data_dict)
+                    data_dict[_RAW_VALUE_KEY] = value
+                if data_dict:
+                    tag |= _HAS_DATA
+
+                day = datetime.utcfromtimestamp(msecs / 1000.0).date()
+                try:
+                    writer = self._writers[day]
+                except KeyError:
+                    writer = self._writers[day] = _DayWriter(self._get_path_for_day(day), self._logger)
+
+                writer.append(msecs, str(var_type), str(var_name), num_value, tag,
+                              json.dumps(data_dict) + '\n' if data_dict else '\n')
+                inserted += 1
+
+            now = time.time()
+            if not self._flash_memory or (now - self._last_flush >= self.MAX_FLUSH_AGE):
+                self._commit()
+                self._last_flush = now
+            if deadband_changes:
+                self._deadband.commit(deadband_changes)
+        self.metrics.inc('events_inserted', inserted)
+        if suppressed:
+            self.metrics.inc('events_suppressed', suppressed)
+
+    def _commit(self):
+        """ Writes the pending data of all the days, and forgets the writers
+        of the past days.
+        """
+        with self._write_lock:
+            for writer in self._writers.itervalues():
+                writer.commit()
+            if len(self._writers) > 1:
+                latest = max(self._writers)
+                self._writers = {latest: self._writers[latest]}
+
+    def flush(self):
+        """ Flushes the pending writes.
+        """
+        with self.metrics.timed('flush'):
+            self._commit()
+        self._logger.info('on-demand data flush executed')
+
+    def open(self):
+        """ Loads the latest event of each variable if in write mode, so that
+        it is maintained by the writes from now on.
+        """
+        self._opened = True
+        if self._readonly:
+            return
+        with self._write_lock:
+            if self._last_values is None:
+                self._last_values = self._scan_last_values()
+
+    def close(self):
+        self._opened = False
+        if not self._readonly:
+            self._commit()
+
+    def get_available_days(self, month=None):
+        """ See DAOObject class"""
+        if month and not isinstance(month, tuple):
+            raise ValueError('month must be a tuple')
+
+        for name in sorted(n for n in os.listdir(self._dbhome) if len(n) == 6 and n.isdigit()):
+            if month:
+                yy, mm = month
+                if yy > 2000:
+                    yy -= 2000
+                if not (int(name[0:2]) == yy and int(name[2:4]) == mm):
+                    continue
+            yield datetime.strptime(name, _DAY_DIR_FMT).date()
+
+    def get_events_for_day(self, day, var_type=None, var_name=None):
+        """ See DAOObject class"""
+        self._logger.debug("get_events_for_day('%s','%s','%s') called" %
+                           (day, var_type, var_name))
+
+        if not isinstance(day, date):
+            yyyy, mm, dd = (int(x) for x in day[:10].replace('/', '-').split('-'))
+            day = date(yyyy, mm, dd)
+
+        return self._get_day_events(day, var_type, var_name)
+
+    def get_events(self, from_time=None, to_time=None, var_type=None, var_name=None):
+        """ See DAOObject class"""
+        self._logger.debug("get_events(%s,%s,%s,%s) called", from_time, to_time, var_type, var_name)
+
+        for day, from_ms, to_ms in self._get_scanned_days(from_time, to_time):
+            for event in self._get_day_events(day, var_type, var_name, from_ms, to_ms):
+                yield event
+
+    def get_records(self, from_time=None, to_time=None, var_type=None, var_name=None,
+                    fields=evtdao.RECORD_FIELDS, ts_format=evtdao.TS_DATETIME):
+        """ See DAOObject class
+
+        Records are built from the columns without creating event objects, and
+        the additional data are only decoded when requested (or for the non
+        numeric values, which are kept in them).
+        """
+        self._check_records_args(fields, ts_format)
+
+        if ts_format == evtdao.TS_EPOCH:
+            format_ts = int
+        elif ts_format == evtdao.TS_DATETIME:
+            format_ts = lambda msecs: datetime.utcfromtimestamp(msecs / 1000.0)
+        else:
+            format_ts = lambda msecs: datetime.utcfromtimestamp(msecs / 1000.0).strftime(evtdao.TS_FMT_FULL)
+        getters = {
+            evtdao.FIELD_TS: lambda row: format_ts(row[0]),
+            evtdao.FIELD_VAR_TYPE: lambda row: row[1],
+            evtdao.FIELD_VAR_NAME: lambda row: row[2],
+            evtdao.FIELD_VALUE: lambda row: row[3],
+            evtdao.FIELD_DATA: lambda row: row[4],
+        }
+        getters = [getters[f] for f in fields]
+        with_data = evtdao.FIELD_DATA in fields
+
+        for day, from_ms, to_ms in self._get_scanned_days(from_time, to_time):
+            for row in self._get_day_rows(day, var_type, var_name, from_ms, to_ms, with_data):
+                yield [get(row) for get in getters]
+
+    def _get_scanned_days(self, from_time, to_time):
+        """ Returns the days overlapping a time span, with the bounds of the
+        span in milliseconds on the first and last ones (None otherwise).
+
+        :returns: a list of (day, from_ms, to_ms) tuples
+        """
+        from_day = from_time.date() if from_time else None
+        to_day = to_time.date() if to_time else None
+
+        scanned_days = [
+            day for day in self.get_available_days()
+            if (not from_day or day >= from_day) and (not to_day or day <= to_day)
+        ]
+        if not scanned_days:
+            return []
+
+        from_ms = sysutils.to_milliseconds(from_time) if from_time else None
+        to_ms = sysutils.to_milliseconds(to_time) if to_time else None
+        return [
+            (day, from_ms if day == scanned_days[0] else None, to_ms if day == scanned_days[-1] else None)
+            for day in scanned_days
+        ]
+
+    def _get_day_events(self, day, var_type=None, var_name=None, from_ms=None, to_ms=None):
+        """ Generator returning the events of a given day, filtered by variable
+        and time span.
+        """
+        for msecs, vt, vn, value, data in self._get_day_rows(day, var_type, var_name, from_ms, to_ms):
+            yield events.make_timed_event(
+                datetime.utcfromtimestamp(msecs / 1000.0), vt, vn,
+                value=value,
+                **data
+            )
+
+    def _get_day_rows(self, day, var_type=None, var_name=None, from_ms=None, to_ms=None, with_data=True):
+        """ Generator returning the rows of a given day, filtered by variable
+        and time span, as (msecs, var_type, var_name, value, data) tuples.
+
+        Only the columns of the selected variables are read, including their
+        rows not committed yet if the day is opened for writing. Rows of the
+        different variables are merged by timestamp.
+
+        :param int from_ms: inclusive lower bound of the time span, in milliseconds
+        :param int to_ms: inclusive upper bound of the time span, in milliseconds
+        :param bool with_data: if False, the additional data are returned as None
+        """
+        var_type = evtdao.VarFilter.from_spec(var_type)
+        var_name = evtdao.VarFilter.from_spec(var_name)
+
+        def selected(key):
+            return (not var_type or var_type.match(key[0])) and (not var_name or var_name.match(key[1]))
+
+        streams = [
+            self._get_var_rows(parts, var_id, key, from_ms, to_ms, with_data)
+            for key, var_id, parts in self._get_day_columns(day, selected)
+        ]
+        for _, _, _, row in heapq.merge(*streams):
+            yield row
+
+    def _get_day_columns(self, day, selected):
+        """ Returns the columns of the variables of a given day, including
+        their rows not committed yet if the day is opened for writing.
+
+        :param callable selected: a callable telling if a variable, given as
+            a (var_type, var_name) tuple, is selected
+        :returns: a list of (key, var_id, parts) tuples, sorted by variable id,
+            parts being the successive parts of the columns of the variable
+            (as _Columns instances)
+        """
+        path = self._get_path_for_day(day)
+        # the state of the writer is taken at once, so that rows committed
+        # meanwhile are neither missed nor returned twice
+        with self._write_lock:
+            writer = self._writers.get(day)
+            if writer:
+                var_ids = dict(writer.var_ids)
+                committed = dict(writer.committed)
+                pending = {
+                    var_id: columns.copy() for var_id, columns in writer.pending.iteritems()
+                }
+        if not writer:
+            var_ids = self._get_day_vars(day)
+            committed = None
+            pending = {}
+
+        result = []
+        for key, var_id in sorted(var_ids.iteritems(), key=lambda item: item[1]):
+            if not selected(key):
+                continue
+            parts = [_load_columns(path, var_id, committed.get(var_id, 0) if committed is not None else None)]
+            if var_id in pending:
+                parts.append(pending[var_id])
+            result.append((key, var_id, parts))
+        return result
+
+    def _get_day_vars(self, day):
+        """ Returns the variable ids of a day which is not opened for writing,
+        the string table being loaded again only if it has grown.
+        """
+        path = os.path.join(self._get_path_for_day(day), _VARS_FNAME)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return {}
+        cached = self._day_vars.get(day)
+        if cached and cached[0] == size:
+            return cached[1]
+        var_ids = _load_vars(os.path.dirname(path))
+        self._day_vars[day] = (size, var_ids)
+        return var_ids
+
+    def get_last_values(self, pattern=None):
+        """ See DAOObject class
+
+        Once opened in write mode, the latest events are maintained in memory
+        by the writes. Otherwise they are searched in the stored days (see
+        _scan_last_values()).
+        """
+        if self._last_values is not None:
+            with self._write_lock:
+                found = {
+                    key: row for key, row in self._last_values.iteritems()
+                    if not pattern or self._match_var_pattern(pattern, *key)
+                }
+        else:
+            found = self._scan_last_values(pattern)
+
+        return [
+            events.make_timed_event(
+                datetime.utcfromtimestamp(msecs / 1000.0), var_type, var_name,
+                value=value,
+                **data
+            )
+            for (var_type, var_name), (msecs, value, data) in sorted(found.iteritems())
+        ]
+
+    def _scan_last_values(self, pattern=None):
+        """ Searches the latest event of the variables in the stored days.
+
+        The days are examined from the most recent one, only the columns of
+        the variables not found in the more recent days being read, and the
+        search stops as soon as all the variables are found.
+
+        :param str pattern: optional variables pattern (see get_last_values())
+        :returns: a dictionary of (msecs, value, data) tuples, keyed by
+            (var_type, var_name) tuples
+        """
+        days = sorted(self.get_available_days(), reverse=True)
+        missing = set()
+        for day in days:
+            with self._write_lock:
+                writer = self._writers.get(day)
+                keys = list(writer.var_ids) if writer else None
+            if keys is None:
+                keys = self._get_day_vars(day)
+            missing.update(key for key in keys if not pattern or self._match_var_pattern(pattern, *key))
+
+        found = {}
+        for day in days:
+            if not missing:
+                break
+            for key, _, parts in self._get_day_columns(day, missing.__contains__):
+                row = self._get_last_row(parts)
+                if row:
+                    found[key] = row
+                    missing.discard(key)
+        return found
+
+    @staticmethod
+    def _get_last_row(parts):
+        """ Returns the most recent row of a variable (the last stored one in
+        case of equal timestamps), as a (msecs, value, data) tuple, or None
+        if it has no row.
+
+        :param list parts: the successive parts of the columns of the variable
+            (as _Columns instances)
+        """
+        last = None
+        for columns in parts:
+            if not len(columns):
+                continue
+            timestamps = columns.timestamps
+            top = max(timestamps)
+            if last is None or top >= last[0]:
+                last = top, columns, len(timestamps) - 1 - timestamps[::-1].index(top)
+        if last is None:
+            return None
+        _, columns, i = last
+        _, msecs, value, data = next(columns.rows(start=i))
+        return msecs, value, data
+
+    @staticmethod
+    def _get_var_rows(parts, var_id, key, from_ms, to_ms, with_data):
+        """ Generator returning the rows of a variable for a given day, as
+        (msecs, var_id, rank, row) tuples, so that they can be merged in a
+        deterministic order.
+
+        :param list parts: the successive parts of the columns of the variable
+            (as _Columns instances)
+        """
+        var_type, var_name = key
+        rank = 0
+        for columns in parts:
+            for i, msecs, value, data in columns.rows(from_ms, to_ms, with_data):
+                yield msecs, var_id, rank + i, (msecs, var_type, var_name, value, data)
+            rank += len(columns)
+
+    def _get_path_for_day(self, day):
+        """ Returns the path of the storage directory for a given date.
+
+        A result is always returned, no matter if the directory really exists
+        for the given date.
+        """
+        return os.path.join(self._dbhome, day.strftime(_DAY_DIR_FMT))
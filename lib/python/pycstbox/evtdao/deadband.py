@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Write side compression of the events, based on deadbands.
+
+Many sensors report the same value at a high rate. A deadband policy
+suppresses the events which do not bring new information, so that they are
+neither written nor scanned by the queries afterwards.
+
+The policy is defined by the "deadband" DAO configuration parameter, which is
+a list of rules, the first rule matching a variable being applied to it.
+Variables not matched by any rule are not compressed. A rule is either a
+dictionary or a string of comma separated items, as follows:
+
+    <pattern>[,abs=<deadband>][,rel=<deadband>][,max_silence=<seconds>]
+
+    - pattern : a glob pattern matched against the variable type and against
+      the "var_type:var_name" key (as for get_last_values())
+    - abs : the absolute deadband. An event is stored if its value differs
+      from the last stored one by more than this. Defaults to 0, which means
+      that events are stored on change only.
+    - rel : the deadband relative to the last stored value (0.01 for 1%)
+    - max_silence : the maximum delay in seconds between two stored events
+      of a variable, the event being stored whatever its value when it is
+      reached (heartbeat)
+
+When both deadbands are set, the largest one applies. Non numeric values are
+stored on change. Events older than the last stored one of their variable
+(late arrivals, backfills) are always stored.
+
+The last stored values are only kept in memory, hence the first event of
+each variable is always stored after a restart. They are updated once the
+events are written, so that an event which could not be written does not
+cause the next ones to be suppressed.
+"""
+
+import fnmatch
+import threading
+from datetime import timedelta
+
+from pycstbox import evtdao
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+RULE_PATTERN = 'pattern'
+RULE_ABS = 'abs'
+RULE_REL = 'rel'
+RULE_MAX_SILENCE = 'max_silence'
+RULE_KEYS = (RULE_PATTERN, RULE_ABS, RULE_REL, RULE_MAX_SILENCE)
+
+
+class DeadbandRule(object):
+    """ The compression rule of the variables matching a pattern.
+    """
+    __slots__ = ['pattern', 'abs_deadband', 'rel_deadband', 'max_silence']
+
+    def __init__(self, pattern, abs_deadband=0., rel_deadband=0., max_silence=None):
+        """
+        :param str pattern: the glob pattern of the variables the rule applies to
+        :param float abs_deadband: the absolute deadband
+        :param float rel_deadband: the deadband relative to the last stored value
+        :param float max_silence: the maximum delay in seconds between two
+            stored events (None for no heartbeat)
+        :raises ValueError: if a parameter is negative
+        """
+        if abs_deadband < 0 or rel_deadband < 0 or (max_silence is not None and max_silence <= 0):
+            raise ValueError('deadbands must be positive or null, and max_silence positive')
+        self.pattern = pattern
+        self.abs_deadband = abs_deadband
+        self.rel_deadband = rel_deadband
+        self.max_silence = max_silence
+
+    @classmethod
+    def from_spec(cls, spec):
+        """ Returns the rule defined by a specification, given as a dictionary
+        or as a string (see module documentation).
+
+        :raises ValueError: if the specification is not valid
+        """
+        if isinstance(spec, basestring):
+            items = [item.strip() for item in spec.split(',')]
+            d = {RULE_PATTERN: items[0]}
+            for item in items[1:]:
+                key, sep, value = item.partition('=')
+                if not sep:
+                    raise ValueError('invalid deadband rule item : %s' % item)
+                d[key.strip()] = value.strip()
+            spec = d
+        elif not isinstance(spec, dict):
+            raise ValueError('invalid deadband rule : %r' % (spec,))
+
+        unknown = set(spec) - set(RULE_KEYS)
+        if unknown:
+            raise ValueError('unknown deadband rule item(s) : %s' % ', '.join(sorted(unknown)))
+        if not spec.get(RULE_PATTERN):
+            raise ValueError('missing pattern in deadband rule : %r' % (spec,))
+        try:
+            return cls(
+                str(spec[RULE_PATTERN]),
+                abs_deadband=float(spec.get(RULE_ABS) or 0),
+                rel_deadband=float(spec.get(RULE_REL) or 0),
+                max_silence=float(spec[RULE_MAX_SILENCE]) if spec.get(RULE_MAX_SILENCE) else None
+            )
+        except (TypeError, ValueError) as e:
+            raise ValueError('invalid deadband rule %r (%s)' % (spec, e))
+
+    def matches(self, var_type, key):
+        """ Tells if the rule applies to a variable.
+
+        :param str var_type: the variable type
+        :param str key: the "var_type:var_name" key of the variable
+        """
+        return fnmatch.fnmatchcase(var_type, self.pattern) or fnmatch.fnmatchcase(key, self.pattern)
+
+    def is_significant(self, elapsed, last_value, last_number, value, number):
+        """ Tells if an event must be stored, given the last stored one.
+
+        :param int elapsed: the delay in milliseconds since the last stored event
+        :param last_value: the last stored value
+        :param float last_number: its numeric form (None if not numeric)
+        :param value: the value of the event
+        :param float number: its numeric form (None if not numeric)
+        """
+        if self.max_silence is not None and elapsed >= self.max_silence * 1000:
+            return True
+        if number is None or last_number is None:
+            return value != last_value
+        return abs(number - last_number) > max(self.abs_deadband, self.rel_deadband * abs(last_number))
+
+    def __str__(self):
+        items = [self.pattern]
+        if self.abs_deadband:
+            items.append('%s=%g' % (RULE_ABS, self.abs_deadband))
+        if self.rel_deadband:
+            items.append('%s=%g' % (RULE_REL, self.rel_deadband))
+        if self.max_silence is not None:
+            items.append('%s=%g' % (RULE_MAX_SILENCE, self.max_silence))
+        return ','.join(items)
+
+
+class DeadbandPolicy(object):
+    """ The compression policy of a channel, which tracks the last stored
+    value of the compressed variables and counts the suppressed events.
+    """
+    def __init__(self, rules):
+        """
+        :param rules: the list of the rules (DeadbandRule instances), the first
+            one matching a variable being applied to it
+        """
+        self.rules = list(rules)
+        self._lock = threading.Lock()
+        # "var_type:var_name" -> the rule applied to the variable (None if not compressed)
+        self._var_rules = {}
+        # "var_type:var_name" -> [timestamp in milliseconds, value, numeric value] of the last stored event
+        self._last = {}
+        # "var_type:var_name" -> [stored events count, suppressed events count]
+        self._counts = {}
+        self.suppressed = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """ Returns the policy defined by a DAO configuration.
+
+        :returns: the policy, or None if no rule is defined
+        :raises ValueError: if a rule is not valid
+        """
+        specs = config.get(evtdao.CFGKEY_DEADBAND)
+        if not specs:
+            return None
+        if isinstance(specs, (basestring, dict)):
+            specs = [specs]
+        return cls(DeadbandRule.from_spec(spec) for spec in specs)
+
+    def rule_for(self, var_type, var_name):
+        """ Returns the rule applied to a variable, or None if it is not compressed.
+        """
+        key = var_type + ':' + var_name
+        try:
+            return self._var_rules[key]
+        except KeyError:
+            rule = self._var_rules[key] = next((r for r in self.rules if r.matches(var_type, key)), None)
+            return rule
+
+    def max_silence_for(self, var_type, var_name):
+        """ Returns the maximum delay between two stored events of a variable,
+        as a timedelta, or None if not limited.
+        """
+        rule = self.rule_for(var_type, var_name)
+        if rule is None or rule.max_silence is None:
+            return None
+        return timedelta(seconds=rule.max_silence)
+
+    def accept(self, msecs, var_type, var_name, value, pending):
+        """ Tells if an event must be stored.
+
+        The state of the policy is not changed, since the event could finally
+        not be written : the decision is recorded in the pending changes of
+        the batch being inserted, against which the next events of the same
+        variable are checked, and which must be applied with commit() once
+        the batch is written.
+
+        :param int msecs: the timestamp of the event, in milliseconds
+        :param str var_type: the variable type
+        :param str var_name: the variable name
+        :param value: the value of the event
+        :param dict pending: the pending changes of the batch, initially empty
+        :returns: False if the event is suppressed
+        """
+        rule = self.rule_for(var_type, var_name)
+        if rule is None:
+            return True
+
+        key = var_type + ':' + var_name
+        try:
+            change = pending[key]
+        except KeyError:
+            with self._lock:
+                last = self._last.get(key)
+            # [last stored event, stored events count, suppressed events count]
+            change = pending[key] = [last, 0, 0]
+        last = change[0]
+        number = evtdao.to_number(value)
+        if last is not None:
+            if msecs < last[0]:
+                change[1] += 1
+                return True
+            if not rule.is_significant(msecs - last[0], last[1], last[2], value, number):
+                change[2] += 1
+                return False
+        change[0] = [msecs, value, number]
+        change[1] += 1
+        return True
+
+    def commit(self, pending):
+        """ Updates the state of the policy with the decisions taken for a
+        batch of events, once they are written.
+
+        :param dict pending: the pending changes filled by accept()
+        """
+        with self._lock:
+            for key, (last, stored, suppressed) in pending.iteritems():
+                try:
+                    counts = self._counts[key]
+                except KeyError:
+                    counts = self._counts[key] = [0, 0]
+                counts[0] += stored
+                counts[1] += suppressed
+                self.suppressed += suppressed
+                if last is not None:
+                    current = self._last.get(key)
+                    # a concurrent batch may have stored a more recent event
+                    if current is None or last[0] >= current[0]:
+                        self._last[key] = last
+
+    def report(self):
+        """ Returns the rules of the policy and the counts of stored and
+        suppressed events, globally and per variable.
+        """
+        with self._lock:
+            return {
+                'rules': [str(rule) for rule in self.rules],
+                'stored': sum(counts[0] for counts in self._counts.itervalues()),
+                'suppressed': self.suppressed,
+                'variables': {
+                    key: {'stored': counts[0], 'suppressed': counts[1]}
+                    for key, counts in self._counts.iteritems()
+                }
+            }
+
+    def __str__(self):
+        return ' '.join(str(rule) for rule in self.rules)
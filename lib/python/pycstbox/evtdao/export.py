@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Bulk export of events to a file descriptor.
+
+Events are written in one of the following formats:
+
+    - ndjson : one JSON object per line, with the keys timestamp (text form),
+      var_type, var_name, value and data
+    - csv : one line per event, with the fields timestamp (text form),
+      var_type, var_name, value and data (as JSON), preceded by a header line
+    - raw : the native line format of the file based DAO, ie tab separated
+      timestamp ("YYMMDD-HHMMSS.ffffff"), var_type, var_name, value and data
+      (as JSON)
+
+NDJSON and CSV exports can be imported back with the evtdb-import tool.
+
+Output is written in fixed size chunks. For raw exports without variable
+filter, the past days entirely included in the time span are copied from
+their storage file as is when the DAO provides it (see AbstractDAO.get_day_file()),
+using sendfile when available.
+"""
+
+import os
+import csv
+import json
+import time
+import cStringIO
+from datetime import datetime, timedelta
+
+from pycstbox.evtdao.base import (
+    RECORD_FIELDS, TS_RAW, TS_TEXT, TS_FMT_FULL
+)
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+EXPORT_NDJSON = 'ndjson'
+EXPORT_CSV = 'csv'
+EXPORT_RAW = 'raw'
+EXPORT_FORMATS = (EXPORT_NDJSON, EXPORT_CSV, EXPORT_RAW)
+
+CHUNK_SIZE = 64 * 1024
+
+_CSV_HEADER = 'timestamp,var_type,var_name,value,data\r\n'
+_RAW_TS_FMT = '%y%m%d-%H%M%S.%f'
+
+
+class ExportTimeout(Exception):
+    """ Raised when the export exceeds its deadline."""
+    pass
+
+
+class ExportError(Exception):
+    """ Raised when a record cannot be formatted or when the output cannot be written."""
+    pass
+
+
+def _to_bytes(value):
+    """ Returns the UTF-8 encoded form of a value, names and values being
+    unicode when they come from D-Bus.
+    """
+    return value.encode('utf-8') if isinstance(value, unicode) else str(value)
+
+
+def _format_ndjson(record):
+    ts, var_type, var_name, value, data = record
+    return json.dumps({
+        'timestamp': ts, 'var_type': var_type, 'var_name': var_name, 'value': value, 'data': data
+    }, separators=(',', ':')) + '\n'
+
+
+def _format_raw(record):
+    ts, var_type, var_name, value, data = record
+    if ' ' in ts:
+        # text form returned by the storages without native form
+        ts = datetime.strptime(ts, TS_FMT_FULL).strftime(_RAW_TS_FMT)
+    return '\t'.join(_to_bytes(v) for v in (ts, var_type, var_name, value, json.dumps(data))) + '\n'
+
+
+class _CsvFormatter(object):
+    def __init__(self):
+        self._buffer = cStringIO.StringIO()
+        self._writer = csv.writer(self._buffer)
+
+    def __call__(self, record):
+        ts, var_type, var_name, value, data = record
+        # the csv module of Python 2 does not handle unicode
+        self._writer.writerow((
+            _to_bytes(ts), _to_bytes(var_type), _to_bytes(var_name), _to_bytes(value),
+            json.dumps(data) if data else ''
+        ))
+        line = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return line
+
+
+def write_all(fd, data):
+    """ Writes a string to a file descriptor, handling partial writes (pipes f.i.).
+    """
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+def copy_file(path, fd):
+    """ Copies the content of a file to a file descriptor, using sendfile if
+    available (Python 3), and chunked copy otherwise.
+
+    :returns: the number of copied bytes
+    """
+    sendfile = getattr(os, 'sendfile', None)
+    copied = 0
+    with open(path, 'rb') as fp:
+        if sendfile:
+            size = os.fstat(fp.fileno()).st_size
+            while copied < size:
+                sent = sendfile(fd, fp.fileno(), copied, size - copied)
+                if not sent:
+                    break
+                copied += sent
+        else:
+            while True:
+                chunk = fp.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                write_all(fd, chunk)
+                copied += len(chunk)
+    return copied
+
+
+def export_events(dao, fd, fmt, from_time=None, to_time=None, var_type=None, var_name=None, deadline=None):
+    """ Writes the events matching a filter to a file descriptor.
+
+    The file descriptor is not closed.
+
+    :param dao: the DAO providing the events
+    :param int fd: the file descriptor
+    :param str fmt: the export format (see EXPORT_FORMATS)
+    :param datetime from_time: inclusive lower bound of the time span (None if none)
+    :param datetime to_time: inclusive upper bound of the time span (None if none)
+    :param str var_type: the type of the exported variables (None for all)
+    :param str var_name: the name of the exported variables (None for all)
+    :param float deadline: the time (as a time.time() value) beyond which the
+        export is aborted (None for no limit)
+    :returns: the number of written bytes
+    :raises ValueError: if the format is not supported
+    :raises ExportTimeout: if the deadline is exceeded
+    :raises ExportError: if a record cannot be formatted or if the output
+        cannot be written
+    """
+    if fmt == EXPORT_NDJSON:
+        formatter, ts_format = _format_ndjson, TS_TEXT
+    elif fmt == EXPORT_CSV:
+        formatter, ts_format = _CsvFormatter(), TS_TEXT
+    elif fmt == EXPORT_RAW:
+        formatter, ts_format = _format_raw, TS_RAW
+    else:
+        raise ValueError('unsupported export format : %s' % fmt)
+
+    def check_deadline():
+        if deadline and time.time() > deadline:
+            raise ExportTimeout('export execution time exceeded')
+
+    def emit(data):
+        try:
+            write_all(fd, data)
+        except (IOError, OSError) as e:
+            raise ExportError('output write failed (%s)' % e)
+
+    def format_record(record):
+        try:
+            line = formatter(record)
+            # formatters return unicode if some fields are
+            return line.encode('utf-8') if isinstance(line, unicode) else line
+        except (TypeError, ValueError, UnicodeError) as e:
+            raise ExportError('cannot format record %r (%s)' % (record, e))
+
+    written = 0
+    if fmt == EXPORT_CSV:
+        emit(_CSV_HEADER)
+        written += len(_CSV_HEADER)
+
+    today = datetime.utcnow().date()
+    days = [
+        day for day in dao.get_available_days()
+        if (not from_time or day >= from_time.date()) and (not to_time or day <= to_time.date())
+    ]
+    for day in days:
+        day_start = datetime(day.year, day.month, day.day)
+        day_end = day_start + timedelta(days=1) - timedelta(microseconds=1)
+
+        if fmt == EXPORT_RAW and not (var_type or var_name) and day < today \
+                and (not from_time or from_time <= day_start) and (not to_time or to_time >= day_end):
+            path = dao.get_day_file(day)
+            if path:
+                try:
+                    written += copy_file(path, fd)
+                except (IOError, OSError) as e:
+                    raise ExportError('day file copy failed (%s)' % e)
+                check_deadline()
+                continue
+
+        chunk = []
+        size = 0
+        for record in dao.get_records(
+                max(from_time, day_start) if from_time else day_start,
+                min(to_time, day_end) if to_time else day_end,
+                var_type, var_name, RECORD_FIELDS, ts_format):
+            line = format_record(record)
+            chunk.append(line)
+            size += len(line)
+            if size >= CHUNK_SIZE:
+                emit(''.join(chunk))
+                written += size
+                chunk, size = [], 0
+                check_deadline()
+        if chunk:
+            emit(''.join(chunk))
+            written += size
+        check_deadline()
+
+    return written
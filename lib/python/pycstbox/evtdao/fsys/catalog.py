@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Catalog of the days available in a channel directory of the file based DAO.
+
+The catalog keeps the sorted list of the days for which a day file exists,
+together with their number of records and data size (uncompressed), so that
+day selections by month or time span are done by bisection instead of
+listing and parsing the directory content on each query.
+
+The DAO writing the directory reports the days it creates or removes, and
+its catalog is thus only scanned once. Catalogs of readonly DAOs (which can
+live in processes other than the writer) are refreshed from the day files
+themselves: the days which files have been added, removed or modified since
+the last refresh are updated, without being disturbed by the other files
+saved in the directory. Records counts and sizes are persisted in a snapshot
+file ("catalog.dat") to avoid computing them again at startup.
+"""
+
+import os
+import json
+import bisect
+import threading
+from datetime import date
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+CATALOG_FNAME = 'catalog.dat'
+
+_DATE_FMT = '%y%m%d'
+
+UNKNOWN = -1
+
+
+class DayCatalog(object):
+    """ The catalog of the days of a channel directory.
+
+    Day infos are (records count, data size) pairs, which values are UNKNOWN
+    until they have been set.
+    """
+    def __init__(self, scanner, tracked=False):
+        """
+        :param callable scanner: a callable returning the days currently
+            stored in the directory, as a dictionary keyed by date instances,
+            and giving a signature of the files of each day (changing when
+            they are modified)
+        :param bool tracked: if True, all the changes of the days are reported
+            by the owner (see add() and remove()), and the directory is only
+            scanned for the first refresh or when invalidated
+        """
+        self._scanner = scanner
+        self._tracked = tracked
+        self._lock = threading.RLock()
+        self._days = []
+        # day -> [records count, data size]
+        self._infos = {}
+        # day -> signature of its files when last scanned
+        self._signatures = None
+        self._dirty = False
+
+    def refresh(self, force=False):
+        """ Synchronizes the catalog with the day files.
+
+        The infos of the days which files have been modified since the last
+        refresh are reset.
+        """
+        with self._lock:
+            if self._tracked and self._signatures is not None and not force:
+                return
+            signatures = self._scanner()
+            if self._signatures is not None and signatures == self._signatures:
+                return
+            self._days = sorted(signatures)
+            for day in set(self._infos) - set(signatures):
+                del self._infos[day]
+                self._dirty = True
+            for day, signature in signatures.iteritems():
+                if day not in self._infos:
+                    self._infos[day] = [UNKNOWN, UNKNOWN]
+                elif self._signatures is not None and self._signatures.get(day) != signature:
+                    self._infos[day] = [UNKNOWN, UNKNOWN]
+            self._signatures = signatures
+
+    def invalidate(self):
+        """ Forces the next refresh to scan the directory.
+        """
+        with self._lock:
+            self._signatures = None
+
+    def add(self, day):
+        """ Adds a day to the catalog if not yet known.
+        """
+        with self._lock:
+            if day not in self._infos:
+                bisect.insort(self._days, day)
+                self._infos[day] = [UNKNOWN, UNKNOWN]
+
+    def remove(self, day):
+        """ Removes a day from the catalog.
+        """
+        with self._lock:
+            if day in self._infos:
+                del self._infos[day]
+                del self._days[bisect.bisect_left(self._days, day)]
+                self._dirty = True
+
+    def set_info(self, day, records, size):
+        """ Sets the records count and data size of a day.
+        """
+        with self._lock:
+            if day in self._infos and self._infos[day] != [records, size]:
+                self._infos[day] = [records, size]
+                self._dirty = True
+
+    def get_info(self, day):
+        """ Returns the (records count, data size) tuple of a day.
+
+        :raises KeyError: if the day is not in the catalog
+        """
+        with self._lock:
+            return tuple(self._infos[day])
+
+    def select(self, from_day=None, to_day=None):
+        """ Returns the sorted list of the days included in a span.
+
+        :param date from_day: the first day of the span (inclusive), None for no lower bound
+        :param date to_day: the last day of the span (inclusive), None for no upper bound
+        """
+        with self._lock:
+            lo = bisect.bisect_left(self._days, from_day) if from_day else 0
+            hi = bisect.bisect_right(self._days, to_day) if to_day else len(self._days)
+            return self._days[lo:hi]
+
+    def select_month(self, year, month):
+        """ Returns the sorted list of the days of a given month.
+        """
+        first = date(year, month, 1)
+        last = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+        with self._lock:
+            return self._days[bisect.bisect_left(self._days, first):bisect.bisect_left(self._days, last)]
+
+    def save(self, path):
+        """ Saves a snapshot of the days infos if modified since last saved,
+        using a temporary file for not exposing partial content to concurrent
+        readers.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            d = {
+                day.strftime(_DATE_FMT): info
+                for day, info in self._infos.iteritems() if UNKNOWN not in info
+            }
+            self._dirty = False
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(d, fp, separators=(',', ':'))
+        os.rename(tmp_path, path)
+
+    def load(self, path):
+        """ Loads the days infos from a snapshot, for the days present in the catalog.
+
+        :raises IOError: if the file cannot be read
+        :raises ValueError: if its content is not valid
+        """
+        with open(path) as fp:
+            d = json.load(fp)
+        try:
+            infos = {
+                date(2000 + int(name[0:2]), int(name[2:4]), int(name[4:6])): [int(info[0]), int(info[1])]
+                for name, info in d.iteritems()
+            }
+        except (AttributeError, TypeError, IndexError, ValueError) as e:
+            raise ValueError('invalid catalog content (%s)' % e)
+        with self._lock:
+            for day, info in infos.iteritems():
+                if day in self._infos:
+                    self._infos[day] = info
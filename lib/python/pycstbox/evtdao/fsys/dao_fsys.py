@@ -20,15 +20,33 @@
 """
 
 import os
-from datetime import date, datetime
+import errno
+from datetime import date, datetime, timedelta
 import json
 import time
 import threading
+import Queue
+import shutil
+import collections
+import multiprocessing
+import gzip
+import bz2
+try:
+    import lzma
+except ImportError:
+    lzma = None
 
 from pycstbox import evtdao
 from pycstbox import evtmgr
 from pycstbox import events
 from pycstbox import sysutils
+from pycstbox.evtdao.fsys.dayindex import DayIndex, INDEX_FILE_EXT, read_ranges
+from pycstbox.evtdao.fsys.rollups import DayRollup, ROLLUP_FILE_EXT, compute_rollup, raw_ts_to_ms
+from pycstbox.evtdao.fsys.catalog import DayCatalog, CATALOG_FNAME, UNKNOWN
+from pycstbox.evtdao.fsys.statsjournal import StatsJournal
+from pycstbox.evtdao.fsys.recent import RecentEvents
+from pycstbox.evtdao.fsys.retention import RetentionPolicy
+from pycstbox.evtdao.deadband import DeadbandPolicy
 
 __author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
 
@@ -38,7 +56,95 @@ _FILE_EXT = '.evt-log'
 _FLD_SEP = '\t'
 _TS_FMT = '%y%m%d-%H%M%S.%f'
 
-STATS_FNAME = 'stats.dat'
+# supported compression methods of the closed day files (name -> (file suffix, opener))
+_CODECS = {
+    'gzip': ('.gz', gzip.open),
+    'bz2': ('.bz2', bz2.BZ2File),
+}
+if lzma:
+    _CODECS['lzma'] = ('.xz', lzma.open)
+
+
+def compression_methods():
+    """ Returns the names of the compression methods available on this system.
+
+    :rtype: list of str
+    """
+    return sorted(_CODECS.keys())
+
+
+class _Housekeeper(threading.Thread):
+    """ Executes the maintenance tasks of the DAO (compression of closed
+    days,...) in the background, so that they do not delay the writes.
+
+    An optional periodic task is executed at regular intervals between the
+    scheduled ones.
+    """
+    def __init__(self, logger, period=None, periodic_task=None):
+        """
+        :param logger: the logger of the DAO
+        :param float period: the interval of the periodic task, in seconds
+        :param callable periodic_task: the periodic task (none if None)
+        """
+        threading.Thread.__init__(self, name='evtdao-housekeeper')
+        self.daemon = True
+        self._logger = logger
+        self._tasks = Queue.Queue()
+        self._period = period
+        self._periodic_task = periodic_task
+
+    def schedule(self, task, *args):
+        self._tasks.put((task, args))
+
+    def run(self):
+        next_run = time.time() + self._period if self._periodic_task else None
+        while True:
+            try:
+                task, args = self._tasks.get(
+                    timeout=max(0, next_run - time.time()) if next_run is not None else None
+                )
+            except Queue.Empty:
+                task, args = self._periodic_task, ()
+                next_run = time.time() + self._period
+            if task is None:
+                return
+            try:
+                task(*args)
+            except Exception as e: #pylint: disable=W0703
+                self._logger.exception(e)
+
+    def stop(self):
+        self._tasks.put((None, None))
+        self.join()
+
+
+class _DayWriter(object):
+    """ The write state of a day file opened in append mode.
+    """
+    def __init__(self, day, fpath, index):
+        """
+        :param date day: the day
+        :param str fpath: the path of the day file
+        :param DayIndex index: the index of the day file, up to date with its current content
+        """
+        self.day = day
+        self.fpath = fpath
+        self.fp = open(fpath, 'a')
+        self.fp.seek(0, os.SEEK_END)
+        self.offset = self.fp.tell()
+        self.index = index
+        self.last_used = time.time()
+
+    def append(self, records):
+        """ Appends records to the file using a single write, and indexes them.
+
+        :param list records: (raw timestamp, var_type, var_name, record) tuples
+        """
+        self.fp.write(''.join(r[3] for r in records))
+        for s_timestamp, var_type, var_name, record in records:
+            self.index.add(self.offset, len(record), var_type, var_name, s_timestamp)
+            self.offset += len(record)
+        self.last_used = time.time()
 
 
 class EventsDAO(evtdao.AbstractDAO):
@@ -46,8 +152,49 @@ class EventsDAO(evtdao.AbstractDAO):
 
     The events are stored in plain tabulated text files, using a distinct file
     for each day, named using the pattern "YYMMDD.evt-log".
+
+    Each day file is accompanied by a sidecar index ("YYMMDD.evt-idx"), giving
+    the location of the records of each variable. It is maintained while
+    writing and rebuilt on the fly for days which have not been indexed yet.
+
+    Once a day is closed, a rollup file ("YYMMDD.evt-sum") summarizing the
+    events of each variable is computed in the background. It is used for
+    answering aggregate queries without reading the raw events again.
+
+    If a compression method is configured, the files of the past days are
+    compressed in the background once they are closed, the file name being
+    suffixed by the compression method extension. Compressed and plain files
+    are read transparently.
+
+    Several day files can be opened for writing at the same time, so that
+    late events interleaved with current ones (delayed sensors around
+    midnight f.i.) do not cause files to be closed and reopened repeatedly.
+    The least recently used one is closed when the maximum count is reached,
+    and files which have not been written for a while are closed too.
+
+    The most recently written events are kept in memory, and used for
+    answering the queries on the recent past without reading the files.
+
+    Queries spanning many days can be executed by a pool of worker processes,
+    each one scanning whole days. Results are streamed in day order as soon
+    as available.
+
+    A retention policy (see the retention module) can be configured for
+    limiting the age of the stored days and the disk space they use. It is
+    enforced in the background after the past days are processed. Days which
+    raw events have been removed by downsampling keep their rollup file, and
+    are still used for answering aggregate queries.
     """
     MAX_FLUSH_AGE = 3600 * 2        # flush files every 2 hours at least
+    COMPRESSION_DELAY = 1           # number of past days kept uncompressed
+    INDEX_CACHE_SIZE = 8            # number of past days indexes kept in memory
+    MAX_OPEN_DAYS = 4               # maximum number of day files simultaneously opened for writing
+    WRITER_IDLE_TIMEOUT = 300       # delay after which a day file not written anymore is closed
+    HOUSEKEEPING_PERIOD = 60        # interval of the periodic checks of the housekeeper
+    RECENT_SPAN = 3600 * 6          # maximum time span of the recent events buffer
+    RECENT_MEMORY = 8 * 1024 * 1024 # maximum memory footprint of the recent events buffer
+    SCAN_WORKERS = 0                # number of processes scanning days in parallel (0: disabled)
+    SCAN_MIN_DAYS = 7               # minimal number of scanned days for using the parallel scan
 
     class Error(Exception):
         """ Exceptions specialized for this DAO."""
@@ -94,39 +241,98 @@ class EventsDAO(evtdao.AbstractDAO):
 
         super(EventsDAO, self).__init__(events_channel)
 
+        self._channel = events_channel
+        self._config = dict(config)
         self._dbhome = os.path.join(dbhome, events_channel)
         if not os.path.exists(self._dbhome):
             os.mkdir(self._dbhome)
 
         self._readonly = readonly
-        self._current_file = None
-        self._current_day = None
+        # the day files opened for writing (day -> _DayWriter), in LRU order
+        self._writers = collections.OrderedDict()
+        self._index_cache = {}
+        self._index_cache_lock = threading.Lock()
         self._flash_memory = config.get(evtdao.CFGKEY_FLASH_MEM_SUPPORT, False)
         if self._flash_memory:
             self._logger.warning("flash memory support declared: systematic flush on write will be disabled")
         self._last_flush = 0
 
-        stats_path = os.path.join(self._dbhome, STATS_FNAME)
-        if os.path.exists(stats_path):
-            self._logger.info("loading stats data from %s...", stats_path)
-            with open(stats_path) as fp:
-                try:
-                    self._stats = json.load(fp)
-                except ValueError:
-                    self._logger.warning("could not load stats data (content follows)")
-                    self._logger.warning("--------")
-                    fp.seek(0)
-                    for l in fp:
-                        self._logger.warning('... %s', l.strip())
-                    self._logger.warning("--------")
-                    self._stats = {}
-                else:
-                    self._logger.info("stats data loaded")
+        self._compression = config.get(evtdao.CFGKEY_COMPRESSION, None)
+        if self._compression and self._compression not in _CODECS:
+            raise ValueError('unsupported compression method : %s' % self._compression)
+        # the background maintenance can be disabled (benchmarks f.i.)
+        self._housekeeping = config.get(evtdao.CFGKEY_HOUSEKEEPING, True)
+        self._housekeeper = None
+        self._housekeeping_day = None
+        # past days already rolled up, and the ones completely processed
+        # (rolled up and compressed if needed), so that they are not examined
+        # again by each pass, unless written by late events in the meantime
+        self._rolled_up_days = set()
+        self._closed_days = set()
+        self._dirty_days = set()
+
+        self._catalog_path = os.path.join(self._dbhome, CATALOG_FNAME)
+        self._catalog = DayCatalog(self._scan_days, tracked=not readonly)
+        self._catalog.refresh()
+        try:
+            self._catalog.load(self._catalog_path)
+        except IOError:
+            pass
+        except ValueError as e:
+            self._logger.warning("ignoring invalid days catalog (%s)", e)
+
+        # last event of the variables, keyed by "var_type:var_name", as
+        # [timestamp in milliseconds, value, data] lists
+        self._stats_journal = StatsJournal(self._dbhome, self._logger)
+        self._stats = {
+            # stats written by previous versions only contain the timestamp
+            key: entry if isinstance(entry, list) else [entry, None, {}]
+            for key, entry in self._stats_journal.load().iteritems()
+        }
+        self._stats_dirty = set()
+        self._stats_compacted = False
+
+        # Events already stored are not in the buffer, hence it only covers
+        # the events which are more recent than all of them.
+        recent_span = config.get(evtdao.CFGKEY_RECENT_SPAN, self.RECENT_SPAN)
+        if recent_span and not readonly:
+            coverage_start = datetime.utcnow()
+            if self._stats:
+                last_ms = max(entry[0] for entry in self._stats.itervalues())
+                coverage_start = max(coverage_start, datetime.utcfromtimestamp(last_ms / 1000.0) + timedelta(milliseconds=1))
+            self._recent = RecentEvents(
+                coverage_start, recent_span,
+                config.get(evtdao.CFGKEY_RECENT_MEMORY, self.RECENT_MEMORY)
+            )
         else:
-            self._stats = {}
-        self._stats_fp = open(stats_path, 'r+')
+            self._recent = None
+
+        self._scan_workers = config.get(evtdao.CFGKEY_SCAN_WORKERS, self.SCAN_WORKERS)
+        self._scan_min_days = config.get(evtdao.CFGKEY_SCAN_MIN_DAYS, self.SCAN_MIN_DAYS)
+        self._scan_pool = None
+        self._scan_pool_lock = threading.Lock()
         self._stats_lock = threading.Lock()
 
+        self._retention = RetentionPolicy.from_config(config, events_channel)
+        self._deadband = DeadbandPolicy.from_config(config)
+        if self._deadband:
+            self._logger.info("deadband policy: %s", self._deadband)
+        # the days which raw events have been removed, only their rollup being kept
+        self._downsampled = DayCatalog(self._scan_downsampled_days, tracked=not readonly)
+        self._retention_report = {
+            'runs': 0,
+            'last_run': '',
+            'duration': 0.,
+            'days_removed': 0,
+            'days_downsampled': 0,
+            'bytes_reclaimed': 0,
+            'events_discarded': 0,
+        }
+
+        # protects the writing state against concurrent accesses (writer
+        # thread vs. queries and flush requests)
+        self._write_lock = threading.RLock()
+
     def __enter__(self):
         return self
 
@@ -137,11 +343,109 @@ class EventsDAO(evtdao.AbstractDAO):
         assert var_name
         assert data
 
+        self.insert_events([(msecs, var_type, var_name, data)])
+
+    def insert_events(self, evts):
+        """ See DAOObject class
+
+        The records are encoded first, and then appended to the day file(s)
+        using a single write per day, the order of the records of a given day
+        being preserved. Flush and stats persistence are done once for the
+        whole batch.
+        """
         if self._readonly:
             msg = 'database opened in readonly'
             self._logger.error(msg)
             raise IOError(msg)
 
+        started = time.time()
+        # encode the records and group them by day, preserving their order
+        groups = collections.OrderedDict()
+        last_seen = {}
+        recent = []
+        # late events of days which raw events are not kept anymore would be
+        # removed on next retention run (or would outdate their rollup)
+        raw_events_limit = self._retention.raw_events_limit()
+        discarded = 0
+        suppressed = 0
+        deadband_changes = {}
+        for msecs, var_type, var_name, data in evts:
+            # names received from D-Bus are unicode, while the ones read from
+            # the files are str : normalize them so that events served from
+            # the recent buffer are the same as the ones read from the files
+            var_type, var_name = str(var_type), str(var_name)
+            encoded = self._encode_event(msecs, var_type, var_name, data)
+            if not encoded:
+                continue
+            timestamp, s_timestamp, value, data_dict, record = encoded
+            if raw_events_limit and timestamp.date() < raw_events_limit:
+                discarded += 1
+                continue
+            # the stats report the last received event, even if suppressed,
+            # so that steady variables do not look stale
+            key = var_type + ":" + var_name
+            if key not in last_seen or msecs >= last_seen[key][0]:
+                last_seen[key] = [int(msecs), value, data_dict]
+            if self._deadband and not self._deadband.accept(msecs, var_type, var_name, value, deadband_changes):
+                suppressed += 1
+                continue
+            groups.setdefault(timestamp.date(), []).append((s_timestamp, var_type, var_name, record))
+            if self._recent is not None:
+                recent.append((timestamp, var_type, var_name, value, data_dict, len(record)))
+
+        if discarded:
+            self.metrics.inc('events_discarded', discarded)
+            self._logger.warning("%d event(s) older than the retention limit discarded", discarded)
+            with self._write_lock:
+                self._retention_report['events_discarded'] += discarded
+        if suppressed:
+            self.metrics.inc('events_suppressed', suppressed)
+
+        if not last_seen:
+            return
+
+        with self._write_lock:
+            for day, records in groups.iteritems():
+                self._get_writer(day).append(records)
+            if deadband_changes:
+                self._deadband.commit(deadband_changes)
+
+            if self._recent is not None:
+                self._recent.add(recent)
+
+            # update the stats
+            with self._stats_lock:
+                for key, entry in last_seen.iteritems():
+                    current = self._stats.get(key)
+                    # late events do not replace more recent ones
+                    if current is None or entry[0] >= current[0]:
+                        self._stats[key] = entry
+                        self._stats_dirty.add(key)
+
+            # Do not stress flash memories by too frequent physical writes, and let the
+            # system driver do its job by optimizing this. There is a risk of loosing
+            # some data in case of brutal stop (power loss f.i.) but it's better than
+            # corrupting a whole SD card.
+            now = time.time()
+            if not self._flash_memory or (now - self._last_flush >= self.MAX_FLUSH_AGE):
+                for writer in self._writers.itervalues():
+                    writer.fp.flush()
+
+                # persist the stats data
+                self._stats_dump()
+
+                self._last_flush = now
+
+        self.metrics.observe('insert_events', time.time() - started)
+        self.metrics.inc('events_inserted', sum(len(records) for records in groups.itervalues()))
+
+    def _encode_event(self, msecs, var_type, var_name, data):
+        """ Encodes an event as a storage record.
+
+        :returns: a tuple containing the event timestamp as a datetime, its raw
+            storage form, the value as stored, the additional data and the
+            record, or None if the event is invalid
+        """
         # the time stamp is stored as a datetime type in the database, so that
         # we can benefit from available hi-level datetime manipulation
         # functions.
@@ -158,182 +462,1153 @@ class EventsDAO(evtdao.AbstractDAO):
             except ValueError as e:
                 self._logger.error('malformed event data (%s): %s',
                                   data, e.message)
-                return
+                return None
 
         # move the value from the dictionary to a "first class" field
         try:
             value = data_dict[events.DataKeys.VALUE]
         except KeyError:
             self._logger.error('missing value field in data (%s)', data)
-            return
+            return None
 
         del data_dict[events.DataKeys.VALUE]
         json_data = json.dumps(data_dict)
 
-        # check if we have to open a new storage file
-        if timestamp.day != self._current_day:
-            if self._current_file:
-                self._current_file.close()
-            self._current_file = open(self._get_path_for_day(timestamp.year,
-                                                        timestamp.month,
-                                                        timestamp.day), 'a')
-            self._current_day = timestamp.day
-
         s_timestamp = timestamp.strftime(_TS_FMT)
-        self._current_file.write(
-            '\t'.join([s_timestamp,
+        value = str(value)
+        record = '\t'.join([s_timestamp,
                 var_type,
                 var_name,
-                str(value),
-                json_data]) + '\n')
+                value,
+                json_data]) + '\n'
+        return timestamp, s_timestamp, value, data_dict, record
 
-        # update the stats
-        with self._stats_lock:
-            self._stats[var_type + ":" + var_name] = timestamp
+    def _get_writer(self, day):
+        """ Returns the writer of the file of a given day, opening it if needed.
 
-        # Do not stress flash memories by too frequent physical writes, and let the
-        # system driver do its job by optimizing this. There is a risk of loosing
-        # some data in case of brutal stop (power loss f.i.) but it's better than
-        # corrupting a whole SD card.
-        now = time.time()
-        if not self._flash_memory or (now - self._last_flush >= self.MAX_FLUSH_AGE):
-            self._current_file.flush()
+        The least recently used writer is closed if the maximum count of
+        opened ones is reached. Must be called with the write lock held.
+        """
+        try:
+            writer = self._writers.pop(day)
+        except KeyError:
+            if len(self._writers) >= self.MAX_OPEN_DAYS:
+                self._close_writer(next(iter(self._writers)))
+            fpath = self._get_path_for_day(day.year, day.month, day.day)
+            if not os.path.exists(fpath):
+                # late event for an already compressed day
+                self._decompress_day_file(fpath)
+            writer = _DayWriter(day, fpath, self._load_index(fpath))
+            self._catalog.add(day)
+            self._mark_dirty(day)
+        self._writers[day] = writer
+        return writer
 
-            # persist the stats data
-            self._stats_dump()
+    def _mark_dirty(self, day):
+        """ Records that a day has been modified, so that it is processed
+        again by the next pass over the past days. Must be called with the
+        write lock held.
+        """
+        self._rolled_up_days.discard(day)
+        self._closed_days.discard(day)
+        self._dirty_days.add(day)
 
-            self._last_flush = now
+    def _get_open_writer(self, fpath):
+        """ Returns the writer of a day file if it is currently opened for
+        writing, None otherwise. Must be called with the write lock held.
+        """
+        for writer in self._writers.itervalues():
+            if writer.fpath == fpath:
+                return writer
+        return None
 
-    def _stats_dump(self):
-        d = {
-            vn: sysutils.to_milliseconds(ts)
-            for vn, ts in self._stats.iteritems()
-        }
+    def _close_writer(self, day):
+        """ Closes the file of a given day opened for writing, and saves its index.
 
+        Must be called with the write lock held.
+        """
+        writer = self._writers.pop(day)
+        writer.fp.close()
+        self._save_index(writer.index, self._get_index_path(writer.fpath))
+        self._catalog.set_info(day, writer.index.records, writer.index.size)
+        self._save_catalog()
+        if day < datetime.utcnow().date():
+            # the day can now be rolled up and compressed
+            self._schedule(self._close_past_days)
+
+    def _close_idle_writers(self):
+        """ Closes the day files which have not been written for a while.
+        """
+        limit = time.time() - self.WRITER_IDLE_TIMEOUT
+        with self._write_lock:
+            for day in [day for day, writer in self._writers.iteritems() if writer.last_used < limit]:
+                self._close_writer(day)
+
+    def _periodic_housekeeping(self):
+        """ Periodic task of the housekeeper: closes the idle day files, and
+        processes the past days when the current day changes.
+        """
+        self._close_idle_writers()
+        today = datetime.utcnow().date()
+        if today != self._housekeeping_day:
+            self._housekeeping_day = today
+            self._close_past_days()
+
+    def _stats_dump(self, compact=False):
+        """ Persists the stats entries changed since the last call.
+
+        The journal is compacted the first time (so that it does not contain
+        records left by a previous crash), when it becomes too large, or if
+        requested.
+        """
+        if self._readonly:
+            return
+        started = time.time()
         with self._stats_lock:
-            self._stats_fp.seek(0)
-            json.dump(d, self._stats_fp, indent=4)
-            self._stats_fp.flush()
+            try:
+                if compact or not self._stats_compacted:
+                    self._stats_journal.compact(self._stats)
+                    self._stats_compacted = True
+                elif self._stats_dirty:
+                    changed = {key: self._stats[key] for key in self._stats_dirty}
+                    if self._stats_journal.append(changed):
+                        self._stats_journal.compact(self._stats)
+                else:
+                    return
+            except (IOError, OSError) as e:
+                self._logger.error("cannot persist stats data (%s)", e)
+                return
+            self._stats_dirty.clear()
 
-        self._logger.info("stats data flushed to storage")
+        self.metrics.observe('stats_dump', time.time() - started)
+        self._logger.debug("stats data flushed to storage")
 
-    # def _stats_load(self, fp):
-    #     with self._stats_lock:
-    #         fp.seek(0)
-    #         d = json.load(self._stats_fp)
-    #         self._stats = {
-    #             vn: datetime.utcfromtimestamp(ts / 1000)
-    #             for vn, ts in d.iteritems()
-    #         }
+    def _save_catalog(self):
+        try:
+            self._catalog.save(self._catalog_path)
+        except (IOError, OSError) as e:
+            self._logger.error("cannot save days catalog %s (%s)", self._catalog_path, e)
 
     def flush(self):
         """ Flushes the pending writes.
         """
-        if self._current_file:
-            self._current_file.flush()
-            self._logger.info('on-demand data flush executed')
-        else:
-            self._logger.info('nothing to flush (no file currently in write mode)')
+        started = time.time()
+        with self._write_lock:
+            if self._writers:
+                for writer in self._writers.itervalues():
+                    writer.fp.flush()
+                    self._save_index(writer.index, self._get_index_path(writer.fpath))
+                self._logger.info('on-demand data flush executed')
+            else:
+                self._logger.info('nothing to flush (no file currently in write mode)')
 
         self._stats_dump()
+        self.metrics.observe('flush', time.time() - started)
+
+    def open(self):
+        """ Starts the background maintenance tasks if in write mode, unless
+        disabled by the configuration.
+
+        The parallel scan workers are started here if configured, so that
+        they are forked before the DAO threads are started.
+        """
+        self._opened = True
+        if self._scan_workers > 1:
+            self._get_scan_pool()
+        if self._readonly or self._housekeeper or not self._housekeeping:
+            return
+        self._housekeeper = _Housekeeper(self._logger, self.HOUSEKEEPING_PERIOD, self._periodic_housekeeping)
+        self._housekeeping_day = datetime.utcnow().date()
+        self._housekeeper.start()
+        self._schedule(self._close_past_days)
+
+    def close(self):
+        """ Closes the files currently in write mode and persists the stats.
+        """
+        self._opened = False
+        with self._scan_pool_lock:
+            if self._scan_pool:
+                self._scan_pool.terminate()
+                self._scan_pool.join()
+                self._scan_pool = None
+        if self._readonly:
+            return
+        if self._housekeeper:
+            self._housekeeper.stop()
+            self._housekeeper = None
+        with self._write_lock:
+            for day in self._writers.keys():
+                self._close_writer(day)
+        self._stats_dump(compact=True)
+        self._stats_journal.close()
+
+    def _schedule(self, task, *args):
+        """ Schedules a background maintenance task, if the DAO has been opened."""
+        if self._housekeeper:
+            self._housekeeper.schedule(task, *args)
+
+    def _close_past_days(self):
+        """ Processes the days which are over: computes their rollup if not
+        yet done (or if outdated by late events), and compresses the ones
+        older than the compression delay. The retention policy is enforced
+        afterwards.
+
+        The days completely processed by a previous pass are skipped, unless
+        written by late events since then.
+        """
+        today = datetime.utcnow().date()
+        compression_limit = today - timedelta(days=self.COMPRESSION_DELAY)
+        downsampling_limit = self._retention.downsampling_limit(today)
+        for day in [d for d in self.get_available_days() if d < today]:
+            with self._write_lock:
+                if day in self._closed_days:
+                    continue
+                # late events written from now on will make it dirty again
+                self._dirty_days.discard(day)
+                rolled_up = day in self._rolled_up_days
+
+            if not rolled_up:
+                rolled_up = (self._get_valid_rollup(day) or self._build_rollup(day, force=True)) is not None
+            closed = rolled_up
+            if downsampling_limit and day < downsampling_limit:
+                # compressing it would be useless
+                pass
+            elif self._compression:
+                fpath = self._get_path_for_day(day.year, day.month, day.day)
+                if day >= compression_limit:
+                    closed = False
+                elif os.path.exists(fpath) and not self._compress_day_file(fpath):
+                    closed = False
+
+            with self._write_lock:
+                if day in self._dirty_days or day in self._writers:
+                    continue
+                if rolled_up:
+                    self._rolled_up_days.add(day)
+                if closed:
+                    self._closed_days.add(day)
+
+        if self._retention.enabled:
+            self._enforce_retention()
+
+    def _enforce_retention(self):
+        """ Enforces the retention policy.
+
+        The raw events of the days older than the downsampling age are removed
+        first, then the days older than the maximum age, and finally the oldest
+        days until the maximum disk space is respected. The current day and the
+        days opened for writing are never touched.
+
+        Days are processed one at a time, the write lock being only held while
+        removing the files of a given day, so that the writes are not delayed
+        by the first run after the policy has been set up.
+        """
+        started = time.time()
+        today = datetime.utcnow().date()
+        downsampled = removed = reclaimed = 0
+
+        limit = self._retention.downsampling_limit(today)
+        if limit:
+            for day in self._select_days(to_day=limit - timedelta(days=1)):
+                freed = self._downsample_day(day)
+                if freed is not None:
+                    downsampled += 1
+                    reclaimed += freed
+
+        limit = self._retention.expiry_limit(today)
+        if limit:
+            for day in self._get_stored_days(to_day=limit - timedelta(days=1)):
+                freed = self._remove_day(day)
+                if freed is not None:
+                    removed += 1
+                    reclaimed += freed
+
+        if self._retention.max_bytes:
+            usage = self._get_days_usage()
+            total = sum(usage.itervalues())
+            for day in sorted(usage):
+                if total <= self._retention.max_bytes or day >= today:
+                    break
+                freed = self._remove_day(day)
+                if freed is not None:
+                    removed += 1
+                    reclaimed += freed
+                    total -= usage[day]
+            if total > self._retention.max_bytes:
+                self._logger.warning(
+                    "retention: disk usage still above limit (%d > %d bytes)", total, self._retention.max_bytes
+                )
+
+        if removed:
+            self._purge_stats()
+        if removed or downsampled:
+            self._save_catalog()
+
+        duration = time.time() - started
+        with self._write_lock:
+            report = self._retention_report
+            report['runs'] += 1
+            report['last_run'] = datetime.utcnow().strftime(evtdao.TS_FMT_SECS)
+            report['duration'] = duration
+            report['days_removed'] += removed
+            report['days_downsampled'] += downsampled
+            report['bytes_reclaimed'] += reclaimed
+        self._logger.info(
+            "retention (%s): %d day(s) removed, %d day(s) downsampled, %d bytes reclaimed in %.3fs",
+            self._retention, removed, downsampled, reclaimed, duration
+        )
+
+    def _get_stored_days(self, to_day=None):
+        """ Returns the sorted list of the days for which raw events or a
+        rollup are stored, up to a given day (included).
+        """
+        self._downsampled.refresh()
+        return sorted(self._select_days(to_day=to_day) + self._downsampled.select(to_day=to_day))
+
+    def _get_day_files(self, day):
+        """ Returns the paths of the files of a given day currently existing
+        (events, index and rollup).
+        """
+        prefix = day.strftime(_FNAME_DATE_FMT)
+        return [
+            os.path.join(self._dbhome, name) for name in os.listdir(self._dbhome)
+            if name.startswith(prefix) and not name.endswith('.tmp')
+        ]
+
+    def _get_days_usage(self):
+        """ Returns the disk space used by the files of each stored day.
+
+        :returns: a dictionary keyed by the days
+        """
+        usage = collections.defaultdict(int)
+        for name in os.listdir(self._dbhome):
+            try:
+                day = datetime.strptime(name[:6], _FNAME_DATE_FMT).date()
+                usage[day] += os.path.getsize(os.path.join(self._dbhome, name))
+            except (ValueError, OSError):
+                # not a day file, or removed in the meantime
+                continue
+        return usage
+
+    def _remove_files(self, day, paths):
+        """ Removes files of a given day, unless it is opened for writing.
+
+        :returns: the number of bytes freed, or None if the day is in use
+        """
+        freed = 0
+        with self._write_lock:
+            if day in self._writers:
+                return None
+            for path in paths:
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        self._logger.error("retention: cannot remove %s (%s)", path, e)
+                    continue
+                freed += size
+        fpath = self._get_path_for_day(day.year, day.month, day.day)
+        with self._index_cache_lock:
+            self._index_cache.pop(fpath, None)
+        return freed
+
+    def _remove_day(self, day):
+        """ Removes all the files of a given day.
+
+        :returns: the number of bytes freed, or None if the day has not been removed
+        """
+        freed = self._remove_files(day, self._get_day_files(day))
+        if freed is None:
+            return None
+        self._catalog.remove(day)
+        self._downsampled.remove(day)
+        self._logger.info("retention: %s removed (%d bytes)", day, freed)
+        return freed
+
+    def _downsample_day(self, day):
+        """ Removes the raw events of a given day, keeping its rollup.
+
+        The rollup is computed before if not available or outdated.
+
+        :returns: the number of bytes freed, or None if the day has not been downsampled
+        """
+        with self._write_lock:
+            if day in self._writers:
+                return None
+        if not self._get_valid_rollup(day) and not self._build_rollup(day):
+            self._logger.warning("retention: no rollup for %s, raw events kept", day)
+            return None
+        rpath = self._get_rollup_path(self._get_path_for_day(day.year, day.month, day.day))
+        freed = self._remove_files(day, [p for p in self._get_day_files(day) if p != rpath])
+        if freed is None:
+            return None
+        self._catalog.remove(day)
+        self._downsampled.add(day)
+        self._logger.info("retention: %s downsampled (%d bytes)", day, freed)
+        return freed
+
+    def _purge_stats(self):
+        """ Removes the stats entries of the variables which last event is
+        older than the oldest stored day.
+        """
+        stored = self._get_stored_days()
+        limit_ms = sysutils.to_milliseconds(datetime(stored[0].year, stored[0].month, stored[0].day)) if stored else None
+        with self._stats_lock:
+            purged = [
+                key for key, entry in self._stats.iteritems()
+                if limit_ms is None or entry[0] < limit_ms
+            ]
+            for key in purged:
+                del self._stats[key]
+                self._stats_dirty.discard(key)
+        if purged:
+            self._logger.info("retention: %d variable(s) removed from stats", len(purged))
+            self._stats_dump(compact=True)
+
+    def get_retention_report(self):
+        """ See DAOObject class
+
+        The report contains the retention policy settings, the cumulated
+        results of its enforcement since the DAO has been opened, and the
+        current disk usage of the channel.
+        """
+        with self._write_lock:
+            report = dict(self._retention_report)
+        report.update({
+            'max_age': self._retention.max_age or 0,
+            'max_bytes': self._retention.max_bytes or 0,
+            'downsample_age': self._retention.downsample_age or 0,
+            'disk_usage': sum(self._get_days_usage().itervalues()),
+        })
+        return report
+
+    def build_rollups(self, force=False):
+        """ Computes the rollups of the past days.
+
+        :param bool force: if True, existing rollups are computed again even if up to date
+        :returns: the number of computed rollups
+        """
+        today = datetime.utcnow().date()
+        return len([
+            day for day in self.get_available_days()
+            if day < today and self._build_rollup(day, force)
+        ])
+
+    def _build_rollup(self, day, force=False):
+        """ Computes and saves the rollup of a past day, unless it is up to date.
+
+        :returns: the computed rollup, or None if not computed
+        """
+        fpath = self._get_path_for_day(day.year, day.month, day.day)
+        with self._write_lock:
+            if self._get_open_writer(fpath):
+                return None
+        if not force and self._get_valid_rollup(day):
+            return None
+
+        try:
+            with self._open_day_file(day.year, day.month, day.day) as fp:
+                rollup = compute_rollup(fp, sysutils.to_milliseconds(datetime(day.year, day.month, day.day)))
+        except IOError as e:
+            self._logger.error("cannot compute rollup of %s (%s)", day, e)
+            return None
+
+        rpath = self._get_rollup_path(fpath)
+        try:
+            rollup.save(rpath)
+        except (IOError, OSError) as e:
+            self._logger.error("cannot save rollup %s (%s)", rpath, e)
+            return None
+        self._logger.info("rollup of %s computed (%d variables)", day, len(rollup.vars))
+        return rollup
+
+    def _get_valid_rollup(self, day):
+        """ Returns the rollup of a day if available and up to date, None otherwise.
+
+        A rollup is outdated if the (plain) day file size differs from the
+        one it has been computed for.
+        """
+        fpath = self._get_path_for_day(day.year, day.month, day.day)
+        try:
+            rollup = DayRollup.load(self._get_rollup_path(fpath))
+        except (IOError, ValueError):
+            return None
+        try:
+            size = os.path.getsize(fpath)
+        except OSError:
+            # compressed days are not modified anymore
+            return rollup
+        return rollup if size == rollup.size else None
+
+    def get_variables_for_day(self, day):
+        """ See DAOObject class
+
+        The rollup of the day is used if available, and the day index otherwise.
+        """
+        yyyy, mm, dd = self._parse_day(day)
+        rollup = self._get_valid_rollup(date(yyyy, mm, dd))
+        if rollup:
+            return sorted(rollup.vars)
+
+        fpath = self._get_path_for_day(yyyy, mm, dd)
+        with self._write_lock:
+            writer = self._get_open_writer(fpath)
+            if writer:
+                index = writer.index
+                return sorted((vt, vn) for vt in index.var_types() for vn in index.var_names(vt))
+        try:
+            with self._open_day_file(yyyy, mm, dd) as fp:
+                index = self._get_day_index(fpath, fp)
+        except IOError:
+            return []
+        return sorted((vt, vn) for vt in index.var_types() for vn in index.var_names(vt))
+
+    def get_aggregates(self, var_name, from_time=None, to_time=None, bucket_seconds=3600,
+                       functions=evtdao.AGG_FUNCTIONS):
+        """ See DAOObject class
+
+        When the buckets are made of whole hours, the rollups of the past days
+        entirely included in the time span are used instead of their events.
+
+        The days which raw events have been removed by the retention policy
+        are included, using the rollup hours entirely included in the time span.
+        Their results are only available for whole hours buckets.
+        """
+        self._check_aggregates_args(bucket_seconds, functions)
+        if bucket_seconds % 3600:
+            return super(EventsDAO, self).get_aggregates(var_name, from_time, to_time, bucket_seconds, functions)
+
+        bucket_ms = bucket_seconds * 1000
+        buckets = {}
+
+        def merge(msecs, agg):
+            bucket = msecs - msecs % bucket_ms
+            try:
+                buckets[bucket].merge(agg)
+            except KeyError:
+                buckets[bucket] = evtdao.Aggregate()
+                buckets[bucket].merge(agg)
+
+        from_day = from_time.date() if from_time else None
+        to_day = to_time.date() if to_time else None
+        self._downsampled.refresh()
+        downsampled = set(self._downsampled.select(from_day, to_day))
+        for day in sorted(set(self._select_days(from_day, to_day)) | downsampled):
+            day_start = datetime(day.year, day.month, day.day)
+            day_end = day_start + timedelta(days=1) - timedelta(microseconds=1)
+            covered = (not from_time or from_time <= day_start) and (not to_time or to_time >= day_end)
+
+            if day in downsampled:
+                rollup = self._get_valid_rollup(day)
+                if not rollup:
+                    continue
+                # only the hours entirely included in the time span can be used
+                hours = set(
+                    h for h in xrange(24)
+                    if (not from_time or from_time <= day_start + timedelta(hours=h))
+                    and (not to_time or to_time >= day_start + timedelta(hours=h + 1) - timedelta(microseconds=1))
+                )
+            else:
+                rollup = self._get_valid_rollup(day) if covered else None
+                hours = None
+            if rollup:
+                day_ms = sysutils.to_milliseconds(day_start)
+                for _, var_rollup in rollup.for_var(var_name=var_name):
+                    if bucket_seconds % 86400 == 0 and covered:
+                        merge(day_ms, var_rollup.day)
+                    else:
+                        for hour, agg in var_rollup.hours.iteritems():
+                            if hours is None or hour in hours:
+                                merge(day_ms + hour * 3600000, agg)
+            else:
+                self._aggregate_events(buckets, bucket_ms, self._get_day_events(
+                    day.year, day.month, day.day, var_name=var_name,
+                    from_ts=from_time.strftime(_TS_FMT) if from_time and day == from_day else None,
+                    to_ts=to_time.strftime(_TS_FMT) if to_time and day == to_day else None
+                ))
+
+        return self._aggregates_result(buckets, functions)
+
+    def _compress_day_file(self, fpath):
+        """ Replaces a day file by its compressed version.
+
+        The index is completed before compressing, since it is not updated
+        anymore afterwards. The compressed file is written under a temporary
+        name, and only replaces the plain one if this one has not been written
+        in the meantime.
+
+        :returns: True if the file has been compressed
+        """
+        suffix, opener = _CODECS[self._compression]
+        with self._write_lock:
+            if self._get_open_writer(fpath):
+                return False
+        with open(fpath) as fp:
+            self._load_index(fpath, fp)
+
+        size = os.path.getsize(fpath)
+        tmp_path = fpath + suffix + '.tmp'
+        src = open(fpath, 'rb')
+        dst = opener(tmp_path, 'wb')
+        try:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        finally:
+            src.close()
+            dst.close()
+
+        with self._write_lock:
+            if self._get_open_writer(fpath) or os.path.getsize(fpath) != size:
+                self._logger.info("%s modified while being compressed: compression postponed", fpath)
+                os.remove(tmp_path)
+                return False
+            os.rename(tmp_path, fpath + suffix)
+            os.remove(fpath)
+        self._logger.info("%s compressed (%d -> %d bytes)", fpath, size, os.path.getsize(fpath + suffix))
+        return True
+
+    def _decompress_day_file(self, fpath):
+        """ Restores the plain version of a compressed day file if any, so that
+        events can be appended to it.
+        """
+        for suffix, opener in _CODECS.itervalues():
+            cpath = fpath + suffix
+            if os.path.exists(cpath):
+                self._logger.info("decompressing %s for appending late event(s)", cpath)
+                tmp_path = fpath + '.tmp'
+                src = opener(cpath, 'rb')
+                dst = open(tmp_path, 'wb')
+                try:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                finally:
+                    src.close()
+                    dst.close()
+                os.rename(tmp_path, fpath)
+                os.remove(cpath)
+                return
+
+    def _open_day_file(self, yyyy, mm, dd):
+        """ Opens the file of a given day for reading, whether it is
+        compressed or not.
+
+        :returns: the file object
+        :raises IOError: if there is no file for this day
+        """
+        fpath = self._get_path_for_day(yyyy, mm, dd)
+        try:
+            return open(fpath)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        for suffix, opener in _CODECS.itervalues():
+            cpath = fpath + suffix
+            if os.path.exists(cpath):
+                return opener(cpath)
+        raise IOError(errno.ENOENT, 'no event file for day', fpath)
+
+    def _load_index(self, fpath, fp=None):
+        """ Returns the index of a day file, up to date with its current content.
+
+        The index is loaded from its sidecar file if available, and caught up
+        with the records appended since it was saved. It is built from scratch
+        if the sidecar file is missing, invalid or does not match the data file.
+
+        For compressed day files, the sidecar index is used as is if available,
+        since they are not written anymore.
+
+        :param str fpath: the path of the (plain) day file
+        :param file fp: the day file opened for reading (opened on the fly if not provided)
+        :returns: the index
+        """
+        ipath = self._get_index_path(fpath)
+        try:
+            index = DayIndex.load(ipath)
+            loaded = True
+        except (IOError, ValueError):
+            index = DayIndex()
+            loaded = False
+
+        if fp is None:
+            try:
+                with open(fpath) as fp:
+                    return self._load_index(fpath, fp)
+            except IOError:
+                # the day file does not exist (yet)
+                return index
+
+        if isinstance(fp, file):
+            fsize = os.fstat(fp.fileno()).st_size
+            if index.size > fsize:
+                self._logger.warning("index does not match day file (%s): rebuilding it", fpath)
+                index = DayIndex()
+            up_to_date = index.size == fsize
+        else:
+            up_to_date = loaded
+
+        if not up_to_date:
+            added = index.update_from(fp)
+            self._logger.debug("%d record(s) added to index of %s", added, fpath)
+            if not self._readonly:
+                self._save_index(index, ipath)
+        return index
+
+    def _save_index(self, index, ipath):
+        try:
+            index.save(ipath)
+        except (IOError, OSError) as e:
+            self._logger.error("cannot save index %s (%s)", ipath, e)
+
+    def _get_day_ranges(self, fpath, fp, var_type=None, var_name=None, from_ts=None, to_ts=None):
+        """ Returns the byte ranges of a day file which can contain records
+        matching the given filter.
+
+        See DayIndex.ranges_for() for details.
+
+        :param str fpath: the path of the (plain) day file
+        :param file fp: the day file opened for reading
+        """
+        with self._write_lock:
+            writer = self._get_open_writer(fpath)
+            if writer:
+                return writer.index.ranges_for(var_type, var_name, from_ts, to_ts)
+
+        return self._get_day_index(fpath, fp).ranges_for(var_type, var_name, from_ts, to_ts)
+
+    def _get_day_index(self, fpath, fp):
+        """ Returns the index of a past day file, caching the most recently used ones.
+
+        :param str fpath: the path of the (plain) day file
+        :param file fp: the day file opened for reading
+        """
+        # compressed files are not modified anymore
+        fsize = os.fstat(fp.fileno()).st_size if isinstance(fp, file) else None
+
+        with self._index_cache_lock:
+            index = self._index_cache.get(fpath)
+            if index is None or (fsize is not None and index.size != fsize):
+                index = self._load_index(fpath, fp)
+                if len(self._index_cache) >= self.INDEX_CACHE_SIZE:
+                    self._index_cache.clear()
+                self._index_cache[fpath] = index
+            return index
+
+    def _scan_days(self):
+        """ Returns the days for which a day file exists, in plain or
+        compressed form.
+
+        :returns: a dictionary keyed by the days, giving the sorted list of the
+            (name, size, mtime) tuples of their day files
+        """
+        suffixes = tuple(_FILE_EXT + suffix for suffix, _ in _CODECS.itervalues()) + (_FILE_EXT,)
+        days = {}
+        # a day can be temporarily present in both forms while being compressed
+        for name in sorted(n for n in os.listdir(self._dbhome) if n.endswith(suffixes)):
+            try:
+                day = date(2000 + int(name[0:2]), int(name[2:4]), int(name[4:6]))
+            except ValueError:
+                self._logger.warning("ignoring unexpected file name: %s", name)
+                continue
+            try:
+                st = os.stat(os.path.join(self._dbhome, name))
+            except OSError:
+                # removed in the meantime
+                continue
+            days.setdefault(day, []).append((name, st.st_size, st.st_mtime))
+        return days
+
+    def _scan_downsampled_days(self):
+        """ Returns the days for which only the rollup file exists.
+
+        :returns: a dictionary keyed by the days (see _scan_days()), the
+            signature of the day files being always None
+        """
+        days = set()
+        for name in os.listdir(self._dbhome):
+            if name.endswith(ROLLUP_FILE_EXT):
+                try:
+                    days.add(datetime.strptime(name[:6], _FNAME_DATE_FMT).date())
+                except ValueError:
+                    self._logger.warning("ignoring unexpected file name: %s", name)
+        return dict.fromkeys(days - set(self._scan_days()))
+
+    def _select_days(self, from_day=None, to_day=None):
+        """ Returns the sorted list of the available days included in a span
+        (bounds included).
+        """
+        self._catalog.refresh()
+        return self._catalog.select(from_day, to_day)
+
+    def get_last_values(self, pattern=None):
+        """ See DAOObject class
+
+        The result is computed from the in-memory stats, without any file access.
+        """
+        with self._stats_lock:
+            entries = sorted(self._stats.iteritems())
+
+        result = []
+        for key, (msecs, value, data) in entries:
+            var_type, var_name = key.split(':', 1)
+            if pattern and not self._match_var_pattern(pattern, var_type, var_name):
+                continue
+            if value is None:
+                # only the timestamp is known
+                continue
+            result.append(events.make_timed_event(
+                datetime.utcfromtimestamp(msecs / 1000.0), var_type, var_name,
+                value=value,
+                **data
+            ))
+        return result
 
     def get_available_days(self, month=None):
         """ See DAOObject class"""
         if month and not isinstance(month, tuple):
             raise ValueError('month must be a tuple')
 
-        for name in sorted([n for n in os.listdir(self._dbhome) if
-                            n.endswith(_FILE_EXT)]):
-            if month:
-                yy, mm = month
-                if yy > 2000:
-                    yy -= 2000
-                if not (int(name[0:2]) == yy and int(name[2:4]) == mm):
+        self._catalog.refresh()
+        if month:
+            yy, mm = month
+            if yy < 100:
+                yy += 2000
+            days = self._catalog.select_month(yy, mm)
+        else:
+            days = self._catalog.select()
+        for day in days:
+            yield day
+
+    def get_days_catalog(self, month=None):
+        """ See DAOObject class
+
+        Records counts and sizes are taken from the catalog, and computed from
+        the day index for the days not known yet.
+        """
+        result = []
+        for day in self.get_available_days(month):
+            with self._write_lock:
+                writer = self._writers.get(day)
+                if writer:
+                    result.append((day, writer.index.records, writer.index.size))
                     continue
-            yield datetime.strptime(name[:6], _FNAME_DATE_FMT).date()
+            try:
+                records, size = self._catalog.get_info(day)
+            except KeyError:
+                # removed in the meantime
+                continue
+            if UNKNOWN in (records, size):
+                fpath = self._get_path_for_day(day.year, day.month, day.day)
+                try:
+                    with self._open_day_file(day.year, day.month, day.day) as fp:
+                        index = self._get_day_index(fpath, fp)
+                except IOError:
+                    continue
+                records, size = index.records, index.size
+                self._catalog.set_info(day, records, size)
+            result.append((day, records, size))
+
+        if not self._readonly:
+            self._save_catalog()
+        return result
+
+    def get_day_file(self, day):
+        """ See DAOObject class
+
+        The day file is returned if it is not compressed and not opened for
+        writing.
+        """
+        fpath = self._get_path_for_day(day.year, day.month, day.day)
+        with self._write_lock:
+            if self._get_open_writer(fpath):
+                return None
+        return fpath if os.path.exists(fpath) else None
 
     def get_events_for_day(self, day, var_type=None, var_name=None):
         """ See DAOObject class"""
         self._logger.debug("get_events_for_day('%s','%s','%s') called" %
                            (day, var_type, var_name))
 
+        yyyy, mm, dd = self._parse_day(day)
+        var_type, var_name = evtdao.VarFilter.from_spec(var_type), evtdao.VarFilter.from_spec(var_name)
+        if self._recent is not None:
+            from_time = datetime(yyyy, mm, dd)
+            evts = self._recent.select(from_time, from_time + timedelta(days=1) - timedelta(microseconds=1),
+                                       var_type, var_name)
+            if evts is not None:
+                return self._make_events(evts)
+        return self._get_day_events(yyyy, mm, dd, var_type, var_name)
+
+    @staticmethod
+    def _make_events(evts):
+        """ Generator returning the events corresponding to recent events buffer tuples.
+        """
+        for timestamp, var_type, var_name, value, data, _ in evts:
+            yield events.make_timed_event(timestamp, var_type, var_name, value=value, **data)
+
+    @staticmethod
+    def _parse_day(day):
+        """ Returns the (year, month, day) tuple of a day given as a date or as
+        a YYYY-MM-DD or YYYY/MM/DD string.
+        """
         if isinstance(day, date):
-            yyyy, mm, dd = day.year, day.month, day.day
+            return day.year, day.month, day.day
         else:
-            yyyy, mm, dd = (int(x) for x in day[:10].replace('/', '-').split('-'))
+            return tuple(int(x) for x in day[:10].replace('/', '-').split('-'))
 
-        def ignore_corrupted_event(_rec_num, _record):
-            self._logger.warning("ignoring corrupted event ([rec:%d] %s)" % (_rec_num, _record))
+    def _scan_day(self, yyyy, mm, dd, var_type=None, var_name=None, from_ts=None, to_ts=None):
+        """ Generator returning the raw fields of the records of a given day,
+        filtered by variable and time span.
 
+        The index of the day file is used to read only the records which can
+        match the filter. Filters are checked on the raw record fields, so that
+        nothing is decoded for the discarded ones.
+
+        It can be used concurrently with the writer: the last record of the
+        file is ignored if it is not complete yet.
+
+        :param var_type: the variable types filter (see evtdao.VarFilter)
+        :param var_name: the variable names filter (see evtdao.VarFilter)
+        :param str from_ts: inclusive lower bound of the time span, in raw storage format
+        :param str to_ts: inclusive upper bound of the time span, in raw storage format
+        :returns: the (timestamp, var_type, var_name, value, data) tuples of
+            undecoded fields, timestamps being padded to the full raw format
+            length
+        """
+        var_type, var_name = evtdao.VarFilter.from_spec(var_type), evtdao.VarFilter.from_spec(var_name)
         fpath = self._get_path_for_day(yyyy, mm, dd)
         try:
-            with open(fpath) as evtfile:
+            with self._open_day_file(yyyy, mm, dd) as evtfile:
+                if var_type or var_name or from_ts or to_ts:
+                    ranges = self._get_day_ranges(fpath, evtfile, var_type, var_name, from_ts, to_ts)
+                else:
+                    ranges = None
+                if ranges is not None:
+                    # use the index to read only the records which can match the filter
+                    records = read_ranges(evtfile, ranges)
+                else:
+                    records = evtfile
+
                 rec_num = 0
-                for record in evtfile:
+                for record in records:
                     rec_num += 1
+                    if not record.endswith('\n'):
+                        # record being written
+                        break
                     try:
                         rec_ts, rec_var_type, rec_var_name, rec_value, rec_data = \
                             record.strip().split(_FLD_SEP)
                     except ValueError:
-                        ignore_corrupted_event(rec_num, record)
+                        self._ignore_corrupted_record(record, rec_num)
                     else:
-                        try:
-                            rec_ts = datetime.strptime(rec_ts.ljust(20, '0'), _TS_FMT)
-                        except (TypeError, ValueError):
-                            ignore_corrupted_event(rec_num, record)
-                        else:
-                            if var_type and rec_var_type != var_type:
-                                continue
-                            if var_name and var_name != rec_var_name:
-                                continue
-                            try:
-                                data = json.loads(rec_data)
-                            except ValueError:
-                                ignore_corrupted_event(rec_num, record)
-                            else:
-                                yield events.make_timed_event(
-                                    rec_ts, rec_var_type, rec_var_name,
-                                    value=rec_value,
-                                    **data
-                                )
+                        if var_type and not var_type.match(rec_var_type):
+                            continue
+                        if var_name and not var_name.match(rec_var_name):
+                            continue
+                        rec_ts = rec_ts.ljust(20, '0')
+                        if from_ts and rec_ts < from_ts:
+                            continue
+                        if to_ts and rec_ts > to_ts:
+                            continue
+                        yield rec_ts, rec_var_type, rec_var_name, rec_value, rec_data
 
         except IOError as e:
             self._logger.exception(e)
 
+    def _ignore_corrupted_record(self, record, rec_num=None):
+        self.metrics.inc('corrupted_records')
+        if rec_num is None:
+            self._logger.warning("ignoring corrupted event (%s)" % _FLD_SEP.join(record))
+        else:
+            self._logger.warning("ignoring corrupted event ([rec:%d] %s)" % (rec_num, record))
+
+    def _get_day_events(self, yyyy, mm, dd, var_type=None, var_name=None, from_ts=None, to_ts=None):
+        """ Generator returning the events of a given day, filtered by variable
+        and time span.
+
+        See _scan_day() for parameters.
+        """
+        for fields in self._scan_day(yyyy, mm, dd, var_type, var_name, from_ts, to_ts):
+            rec_ts, rec_var_type, rec_var_name, rec_value, rec_data = fields
+            try:
+                rec_ts = datetime.strptime(rec_ts, _TS_FMT)
+                data = json.loads(rec_data)
+            except (TypeError, ValueError):
+                self._ignore_corrupted_record(fields)
+            else:
+                yield events.make_timed_event(
+                    rec_ts, rec_var_type, rec_var_name,
+                    value=rec_value,
+                    **data
+                )
+
+    def _get_day_records(self, yyyy, mm, dd, var_type, var_name, from_ts, to_ts, fields, ts_format):
+        """ Generator returning the projection of the records of a given day.
+
+        Only the requested fields are decoded. Timestamps are converted to
+        text or milliseconds by slicing their raw form, without going through
+        datetime parsing.
+
+        See _scan_day() and get_records() for parameters.
+        """
+        day_ms = sysutils.to_milliseconds(datetime(yyyy, mm, dd))
+        positions = [evtdao.RECORD_FIELDS.index(f) for f in fields]
+        decode_data = evtdao.FIELD_DATA in fields
+        data_pos = evtdao.RECORD_FIELDS.index(evtdao.FIELD_DATA)
+        decode_ts = evtdao.FIELD_TS in fields
+
+        for raw in self._scan_day(yyyy, mm, dd, var_type, var_name, from_ts, to_ts):
+            record = list(raw)
+            try:
+                if decode_ts:
+                    rec_ts = raw[0]
+                    if rec_ts[6] != '-' or rec_ts[13] != '.':
+                        raise ValueError()
+                    if ts_format == evtdao.TS_EPOCH:
+                        record[0] = raw_ts_to_ms(rec_ts, day_ms)
+                    elif ts_format == evtdao.TS_TEXT:
+                        record[0] = '20%s-%s-%s %s:%s:%s.%s' % (
+                            rec_ts[0:2], rec_ts[2:4], rec_ts[4:6],
+                            rec_ts[7:9], rec_ts[9:11], rec_ts[11:13], rec_ts[14:20]
+                        )
+                    elif ts_format == evtdao.TS_DATETIME:
+                        record[0] = datetime.strptime(rec_ts, _TS_FMT)
+                if decode_data:
+                    record[data_pos] = json.loads(raw[data_pos])
+            except (TypeError, ValueError):
+                self._ignore_corrupted_record(raw)
+            else:
+                yield [record[pos] for pos in positions]
+
     def get_events(self, from_time=None, to_time=None, var_type=None, var_name=None):
-        """ See DAOObject class"""
-        self._logger.debug("get_events(%s,%s,%s,%s) called", from_time, to_time, var_type, var_name)
+        """ See DAOObject class
 
-        from_day = from_time.date() if from_time else None
-        to_day = to_time.date() if to_time else None
+        All the variable filters are evaluated in a single scan of the days,
+        using the days index for reading only the records of the matching
+        variables.
+        """
+        self._logger.debug("get_events(%s,%s,%s,%s) called", from_time, to_time, var_type, var_name)
+        var_type, var_name = evtdao.VarFilter.from_spec(var_type), evtdao.VarFilter.from_spec(var_name)
 
-        if from_day or to_day:
-            scanned_days = [
-                day for day in self.get_available_days() \
-                if (not from_day or day >= from_day) and \
-                   (not to_day or day <= to_day)
-            ]
+        if self._recent is not None and from_time:
+            evts = self._recent.select(from_time, to_time, var_type, var_name)
+            if evts is not None:
+                for event in self._make_events(evts):
+                    yield event
+                return
 
-        else:
-            scanned_days = self.get_available_days()
-
-        for day in scanned_days:
-            sday = day.strftime(evtdao.TS_FMT_FULL)
-            for event in self.get_events_for_day(sday):
-                if from_time and \
-                   day == scanned_days[0] and \
-                   event.timestamp < from_time:
-                    continue
-                if to_time and day == scanned_days[-1] \
-                   and event.timestamp > to_time:
-                    continue
-                if var_type and event.var_type != var_type:
-                    continue
-                if var_name and event.var_name != var_name:
-                    continue
+        scanned_days = self._get_scanned_days(from_time, to_time)
+        if self._use_scan_pool(scanned_days):
+            for ts, rec_var_type, rec_var_name, value, data in self._scan_days_parallel(
+                    scanned_days, var_type, var_name, evtdao.RECORD_FIELDS, evtdao.TS_DATETIME):
+                yield events.make_timed_event(ts, rec_var_type, rec_var_name, value=value, **data)
+            return
 
+        for day, from_ts, to_ts in scanned_days:
+            for event in self._get_day_events(day.year, day.month, day.day, var_type, var_name, from_ts, to_ts):
                 yield event
 
+    def get_records(self, from_time=None, to_time=None, var_type=None, var_name=None,
+                    fields=evtdao.RECORD_FIELDS, ts_format=evtdao.TS_DATETIME):
+        """ See DAOObject class
+
+        Only the requested fields of the records matching the filter are
+        decoded. The raw timestamp form is the one used in the day files
+        ("YYMMDD-HHMMSS.ffffff").
+        """
+        self._logger.debug("get_records(%s,%s,%s,%s,%s,%s) called",
+                           from_time, to_time, var_type, var_name, fields, ts_format)
+        self._check_records_args(fields, ts_format)
+        var_type, var_name = evtdao.VarFilter.from_spec(var_type), evtdao.VarFilter.from_spec(var_name)
+
+        if self._recent is not None and from_time:
+            evts = self._recent.select(from_time, to_time, var_type, var_name)
+            if evts is not None:
+                positions = [evtdao.RECORD_FIELDS.index(f) for f in fields]
+                for evt in evts:
+                    timestamp = evt[0]
+                    if ts_format == evtdao.TS_RAW:
+                        timestamp = timestamp.strftime(_TS_FMT)
+                    elif ts_format != evtdao.TS_DATETIME:
+                        timestamp = self._format_ts(timestamp, ts_format)
+                    record = (timestamp,) + evt[1:4] + (dict(evt[4]),)
+                    yield [record[pos] for pos in positions]
+                return
+
+        scanned_days = self._get_scanned_days(from_time, to_time)
+        if self._use_scan_pool(scanned_days):
+            for record in self._scan_days_parallel(scanned_days, var_type, var_name, fields, ts_format):
+                yield record
+            return
+
+        for day, from_ts, to_ts in scanned_days:
+            for record in self._get_day_records(day.year, day.month, day.day, var_type, var_name,
+                                                from_ts, to_ts, fields, ts_format):
+                yield record
+
+    def _get_scan_pool(self):
+        """ Returns the pool of the parallel scan worker processes, creating it if needed.
+        """
+        with self._scan_pool_lock:
+            if self._scan_pool is None:
+                self._scan_pool = multiprocessing.Pool(
+                    self._scan_workers,
+                    initializer=_init_scan_worker,
+                    initargs=(self._config, self._channel)
+                )
+                self._logger.info("parallel scan pool started (%d workers)", self._scan_workers)
+            return self._scan_pool
+
+    def _use_scan_pool(self, scanned_days):
+        return self._scan_workers > 1 and len(scanned_days) >= max(self._scan_min_days, 2)
+
+    def _scan_days_parallel(self, scanned_days, var_type, var_name, fields, ts_format):
+        """ Generator returning the projection of the records of a list of
+        days, the days being scanned by the worker processes.
+
+        Results are returned in day order, as soon as the ones of the next
+        day are available. The files currently in write mode are scanned
+        locally, since their last records may not have been flushed yet.
+
+        See _get_scanned_days() and get_records() for parameters.
+        """
+        with self._write_lock:
+            open_days = set(self._writers)
+
+        tasks = [
+            (day, var_type, var_name, from_ts, to_ts, fields, ts_format)
+            for day, from_ts, to_ts in scanned_days if day not in open_days
+        ]
+        results = self._get_scan_pool().imap(_scan_day_task, tasks)
+        for day, from_ts, to_ts in scanned_days:
+            if day in open_days:
+                records = self._get_day_records(day.year, day.month, day.day, var_type, var_name,
+                                                from_ts, to_ts, fields, ts_format)
+            else:
+                records = results.next()
+            for record in records:
+                yield record
+
+    def _get_scanned_days(self, from_time=None, to_time=None):
+        """ Returns the days to be scanned for a time span, with the raw bounds
+        to be checked for each of them.
+
+        The time span is only checked for the first and last days, since the
+        other ones are entirely included in it.
+
+        :returns: a list of (day, from_ts, to_ts) tuples
+        """
+        scanned_days = self._select_days(
+            from_time.date() if from_time else None,
+            to_time.date() if to_time else None
+        )
+        from_ts = from_time.strftime(_TS_FMT) if from_time else None
+        to_ts = to_time.strftime(_TS_FMT) if to_time else None
+        return [
+            (day,
+             from_ts if day == scanned_days[0] else None,
+             to_ts if day == scanned_days[-1] else None)
+            for day in scanned_days
+        ]
+
     def _get_path_for_day(self, year, month, day):
         """ Returns the path of the storage file for a given date.
 
@@ -352,3 +1627,37 @@ class EventsDAO(evtdao.AbstractDAO):
                                 year % 100, month, day, _FILE_EXT
                             )
                            )
+
+    @staticmethod
+    def _get_index_path(fpath):
+        """ Returns the path of the sidecar index of a day file.
+        """
+        return fpath[:fpath.rindex(_FILE_EXT)] + INDEX_FILE_EXT
+
+    @staticmethod
+    def _get_rollup_path(fpath):
+        """ Returns the path of the rollup file of a day file.
+        """
+        return fpath[:fpath.rindex(_FILE_EXT)] + ROLLUP_FILE_EXT
+
+
+# the DAO used by the parallel scan worker processes
+_worker_dao = None
+
+
+def _init_scan_worker(config, channel):
+    """ Initializes a parallel scan worker process.
+    """
+    global _worker_dao
+    _worker_dao = EventsDAO(channel, config, readonly=True)
+
+
+def _scan_day_task(args):
+    """ Parallel scan worker process task, returning the projection of the
+    records of a day as a list.
+
+    :param tuple args: the day, followed by the other parameters of
+        EventsDAO._get_day_records()
+    """
+    day = args[0]
+    return list(_worker_dao._get_day_records(day.year, day.month, day.day, *args[1:]))
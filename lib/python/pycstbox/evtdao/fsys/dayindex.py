@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Sidecar index of the day files used by the file based DAO.
+
+For each day file "YYMMDD.evt-log", an index file "YYMMDD.evt-idx" records
+the byte ranges occupied by the records of each variable, so that queries
+filtered on the variable type or name can seek directly to the matching
+records instead of reading and splitting the whole file.
+
+It also contains sparse time checkpoints: the records are grouped in blocks of
+a fixed number of consecutive records, and the offset of each block is stored
+together with the lowest and highest timestamps found in it. Time bounded
+queries only read the blocks intersecting the requested time span. Since the
+bounds of the blocks are computed from their actual content, records appended
+out of chronological order are correctly taken in account.
+
+The index also stores the size of the data file it covers. When the data file
+has grown since the index was saved (other process writing it, daemon stopped
+before saving the index,...) the index is caught up by scanning the tail of
+the data file only.
+"""
+
+import os
+import json
+import heapq
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+INDEX_FILE_EXT = '.evt-idx'
+
+_FLD_SEP = '\t'
+
+# number of records grouped in a time checkpoint block
+BLOCK_SIZE = 256
+
+# ranges separated by less than this number of bytes are read in a single
+# operation (the few records in between are discarded by the caller filters)
+READ_GAP = 4096
+
+
+class DayIndex(object):
+    """ The index of a day file.
+
+    Byte ranges are stored per variable as a flat list of offset and length
+    pairs, contiguous records of the same variable being merged in a single
+    range.
+
+    Time checkpoints are stored as a list of [offset, min_ts, max_ts] blocks,
+    timestamps being kept in their raw (and lexicographically ordered) storage
+    format.
+    """
+    def __init__(self):
+        self.size = 0
+        self.records = 0
+        # var_type -> var_name -> [offset, length, offset, length,...]
+        self.vars = {}
+        # [[offset, min_ts, max_ts],...]
+        self.blocks = []
+        # number of records in the last block
+        self.block_records = 0
+
+    def add(self, offset, length, var_type, var_name, timestamp):
+        """ Records the location of a record.
+
+        :param int offset: the offset of the record in the data file
+        :param int length: the length of the record, including the line terminator
+        :param str var_type: the variable type
+        :param str var_name: the variable name
+        :param str timestamp: the record timestamp, in raw storage format
+        """
+        ranges = self.vars.setdefault(var_type, {}).setdefault(var_name, [])
+        if ranges and ranges[-2] + ranges[-1] == offset:
+            ranges[-1] += length
+        else:
+            ranges.extend((offset, length))
+
+        if not self.blocks or self.block_records >= BLOCK_SIZE:
+            self.blocks.append([offset, timestamp, timestamp])
+            self.block_records = 0
+        else:
+            block = self.blocks[-1]
+            if timestamp < block[1]:
+                block[1] = timestamp
+            elif timestamp > block[2]:
+                block[2] = timestamp
+        self.block_records += 1
+
+        self.records += 1
+        self.size = max(self.size, offset + length)
+
+    def update_from(self, fp):
+        """ Catches up the index with the records appended to the data file
+        since it was last indexed.
+
+        Only complete lines are taken in account, so that a record being
+        written by another process is not indexed with a wrong length.
+
+        :param file fp: the data file, opened for reading
+        :returns: the number of records added to the index
+        """
+        fp.seek(self.size)
+        offset = self.size
+        count = 0
+        for record in fp:
+            if not record.endswith('\n'):
+                break
+            length = len(record)
+            fields = record.split(_FLD_SEP, 3)
+            if len(fields) == 4:
+                self.add(offset, length, fields[1], fields[2], fields[0].ljust(20, '0'))
+                count += 1
+            else:
+                # corrupted record: skip it but keep track of the covered size
+                self.size = offset + length
+            offset += length
+        return count
+
+    def var_types(self):
+        return self.vars.keys()
+
+    def var_names(self, var_type=None):
+        if var_type:
+            return self.vars.get(var_type, {}).keys()
+        return list(set(n for names in self.vars.itervalues() for n in names))
+
+    def time_spans(self, from_ts=None, to_ts=None):
+        """ Returns the byte spans of the blocks which may contain records
+        in the given time span.
+
+        :param str from_ts: inclusive lower bound, in raw storage format
+        :param str to_ts: inclusive upper bound, in raw storage format
+        :returns: a list of (offset, length) tuples
+        """
+        spans = []
+        for i, (offset, min_ts, max_ts) in enumerate(self.blocks):
+            if (from_ts and max_ts < from_ts) or (to_ts and min_ts > to_ts):
+                continue
+            end = self.blocks[i + 1][0] if i + 1 < len(self.blocks) else self.size
+            if spans and spans[-1][0] + spans[-1][1] == offset:
+                spans[-1] = (spans[-1][0], end - spans[-1][0])
+            else:
+                spans.append((offset, end - offset))
+        return spans
+
+    def ranges_for(self, var_type=None, var_name=None, from_ts=None, to_ts=None):
+        """ Returns the byte ranges of the records matching the given variable
+        type and/or name, and possibly included in a given time span.
+
+        Ranges are sorted by offset, and ranges close enough to be read in
+        a single operation are coalesced.
+
+        :param var_type: the variable types filter (see evtdao.VarFilter), None for all
+        :param var_name: the variable names filter (see evtdao.VarFilter), None for all
+        :returns: a list of (offset, length) tuples
+        """
+        if var_type or var_name:
+            if var_type:
+                types = [self.vars[t] for t in var_type.select(self.vars)]
+            else:
+                types = self.vars.values()
+
+            selected = []
+            for names in types:
+                if var_name:
+                    selected.extend(names[n] for n in var_name.select(names))
+                else:
+                    selected.extend(names.values())
+            ranges = heapq.merge(*[zip(r[::2], r[1::2]) for r in selected])
+            if from_ts or to_ts:
+                ranges = _intersect(ranges, self.time_spans(from_ts, to_ts))
+        else:
+            ranges = self.time_spans(from_ts, to_ts)
+
+        result = []
+        for offset, length in ranges:
+            if result and offset - (result[-1][0] + result[-1][1]) <= READ_GAP:
+                last_offset = result[-1][0]
+                result[-1] = (last_offset, max(result[-1][1], offset + length - last_offset))
+            else:
+                result.append((offset, length))
+        return result
+
+    def as_dict(self):
+        return {
+            'size': self.size,
+            'records': self.records,
+            'vars': self.vars,
+            'blocks': self.blocks,
+            'block_records': self.block_records
+        }
+
+    def save(self, path):
+        """ Saves the index in the given file.
+
+        The file is written under a temporary name and then renamed, so that
+        concurrent readers never see a partially written index.
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(self.as_dict(), fp, separators=(',', ':'))
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """ Loads an index from the given file.
+
+        :returns: the index
+        :raises IOError: if the file cannot be read
+        :raises ValueError: if its content is not valid
+        """
+        with open(path) as fp:
+            d = json.load(fp)
+        index = cls()
+        try:
+            index.size = d['size']
+            index.records = d['records']
+            index.vars = {
+                str(var_type): {str(var_name): ranges for var_name, ranges in names.iteritems()}
+                for var_type, names in d['vars'].iteritems()
+            }
+            index.blocks = [[offset, str(min_ts), str(max_ts)] for offset, min_ts, max_ts in d['blocks']]
+            index.block_records = d['block_records']
+        except (KeyError, AttributeError, TypeError, ValueError) as e:
+            raise ValueError('invalid index content (%s)' % e)
+        return index
+
+
+def _intersect(ranges, spans):
+    """ Generator returning the parts of the ranges included in the spans.
+
+    Both lists must be sorted by offset. Since ranges and spans boundaries are
+    record boundaries, so are the ones of the result.
+    """
+    spans = iter(spans)
+    try:
+        span_start, span_length = next(spans)
+    except StopIteration:
+        return
+    span_end = span_start + span_length
+
+    for offset, length in ranges:
+        end = offset + length
+        while offset < end:
+            while span_end <= offset:
+                try:
+                    span_start, span_length = next(spans)
+                except StopIteration:
+                    return
+                span_end = span_start + span_length
+            if span_start >= end:
+                break
+            start = max(offset, span_start)
+            stop = min(end, span_end)
+            yield start, stop - start
+            offset = stop
+
+
+def read_ranges(fp, ranges):
+    """ Generator returning the records stored in the given byte ranges of a
+    data file.
+
+    Incomplete trailing lines (record being written by another process) are
+    ignored.
+
+    :param file fp: the data file, opened for reading
+    :param list ranges: the (offset, length) tuples, as returned by DayIndex.ranges_for()
+    """
+    for offset, length in ranges:
+        fp.seek(offset)
+        for record in fp.read(length).splitlines(True):
+            if record.endswith('\n'):
+                yield record
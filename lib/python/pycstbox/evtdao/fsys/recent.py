@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" In-memory buffer of the most recently written events.
+
+Events written by the DAO are kept already decoded in a bounded buffer, so
+that queries on the recent past are answered without reading and parsing the
+day files again.
+
+The buffer is bounded by the time span covered and by an estimation of its
+memory footprint. It keeps track of the time from which it holds *all* the
+stored events (its coverage start), so that it is only used for queries
+starting at or after this time.
+"""
+
+import collections
+import threading
+from datetime import timedelta
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+# estimated memory footprint of a buffered event, in addition to its record size
+_EVENT_OVERHEAD = 400
+
+
+class RecentEvents(object):
+    """ The buffer of the recent events.
+
+    Events are stored in insertion order, as (timestamp, var_type, var_name,
+    value, data, size) tuples, timestamp being a naive UTC datetime and size
+    the length of their storage record.
+    """
+    def __init__(self, coverage_start, max_span=None, max_bytes=None):
+        """
+        :param datetime coverage_start: the time from which all the events
+            stored from now on will be buffered. It must be later than the
+            timestamps of the events already stored.
+        :param int max_span: the maximum time span of the buffered events, in seconds
+        :param int max_bytes: the maximum estimated memory footprint of the buffer
+        """
+        self._coverage_start = coverage_start
+        self._max_span = timedelta(seconds=max_span) if max_span else None
+        self._max_bytes = max_bytes
+        self._events = collections.deque()
+        self._bytes = 0
+        self._newest = None
+        self._lock = threading.Lock()
+
+    @property
+    def coverage_start(self):
+        return self._coverage_start
+
+    def __len__(self):
+        return len(self._events)
+
+    def add(self, evts):
+        """ Adds a sequence of events, and discards the oldest ones if the
+        buffer limits are exceeded.
+        """
+        with self._lock:
+            for evt in evts:
+                if evt[0] < self._coverage_start:
+                    # late event, outside the buffer coverage anyway
+                    continue
+                self._events.append(evt)
+                self._bytes += evt[5] + _EVENT_OVERHEAD
+                if self._newest is None or evt[0] > self._newest:
+                    self._newest = evt[0]
+
+            limit = self._newest - self._max_span if self._max_span and self._newest else None
+            while self._events and (
+                    (self._max_bytes and self._bytes > self._max_bytes) or
+                    (limit and self._events[0][0] < limit)):
+                evt = self._events.popleft()
+                self._bytes -= evt[5] + _EVENT_OVERHEAD
+                # events of this time could have been discarded
+                discarded_until = evt[0] + timedelta(microseconds=1)
+                if discarded_until > self._coverage_start:
+                    self._coverage_start = discarded_until
+
+    def select(self, from_time, to_time=None, var_type=None, var_name=None):
+        """ Returns the buffered events matching the given criteria, if the
+        buffer covers the requested time span.
+
+        Events are sorted by day, and in insertion order within a day, as
+        they would be read from the day files.
+
+        :param var_type: the variable types filter (see evtdao.VarFilter), None for all
+        :param var_name: the variable names filter (see evtdao.VarFilter), None for all
+        :returns: a list of event tuples, or None if the time span is not covered
+        """
+        with self._lock:
+            if from_time < self._coverage_start:
+                return None
+            evts = [
+                evt for evt in self._events
+                if (not from_time or evt[0] >= from_time) and (not to_time or evt[0] <= to_time)
+                and (not var_type or var_type.match(evt[1])) and (not var_name or var_name.match(evt[2]))
+            ]
+        evts.sort(key=lambda evt: evt[0].date())
+        return evts
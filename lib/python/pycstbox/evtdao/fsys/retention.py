@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Retention policy of the file based DAO.
+
+The policy is defined by the following DAO configuration parameters, each one
+being disabled if not set or null:
+
+    - retention_max_age : the number of days the events are kept. Older days
+      are removed, including their rollups.
+    - retention_max_bytes : the maximum disk space used by the channel. The
+      oldest days are removed until it is respected.
+    - retention_downsample_age : the number of days the raw events are kept.
+      The events of older days are removed, but their rollups are kept, so
+      that aggregate queries can still be answered for them.
+
+Each parameter can also be a dictionary keyed by channel name, so that the
+policy of each channel is configured separately, the None key giving the
+value of the channels not listed.
+
+The current day and the days opened for writing are never removed.
+"""
+
+from datetime import datetime, timedelta
+
+from pycstbox import evtdao
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+
+class RetentionPolicy(object):
+    """ The retention policy of a channel.
+    """
+    def __init__(self, max_age=None, max_bytes=None, downsample_age=None):
+        """
+        :param int max_age: the number of days the events are kept
+        :param int max_bytes: the maximum disk space used by the channel
+        :param int downsample_age: the number of days the raw events are kept
+        """
+        self.max_age = max_age or None
+        self.max_bytes = max_bytes or None
+        self.downsample_age = downsample_age or None
+
+    @classmethod
+    def from_config(cls, config, channel=None):
+        """ Returns the policy defined by a DAO configuration for a channel.
+
+        :param dict config: the DAO configuration
+        :param str channel: the channel, for the parameters defined per channel
+        """
+        def setting(key):
+            value = config.get(key)
+            if isinstance(value, dict):
+                value = value.get(channel, value.get(None))
+            return value
+
+        return cls(
+            max_age=setting(evtdao.CFGKEY_RETENTION_MAX_AGE),
+            max_bytes=setting(evtdao.CFGKEY_RETENTION_MAX_BYTES),
+            downsample_age=setting(evtdao.CFGKEY_RETENTION_DOWNSAMPLE_AGE)
+        )
+
+    @property
+    def enabled(self):
+        return bool(self.max_age or self.max_bytes or self.downsample_age)
+
+    def expiry_limit(self, today=None):
+        """ Returns the first day which must be kept according to the maximum
+        age, or None if not limited.
+        """
+        if not self.max_age:
+            return None
+        return (today or datetime.utcnow().date()) - timedelta(days=self.max_age - 1)
+
+    def downsampling_limit(self, today=None):
+        """ Returns the first day which raw events must be kept, or None if
+        not limited.
+        """
+        if not self.downsample_age:
+            return None
+        return (today or datetime.utcnow().date()) - timedelta(days=self.downsample_age - 1)
+
+    def raw_events_limit(self, today=None):
+        """ Returns the first day which raw events must be kept, whatever the
+        reason, or None if not limited.
+        """
+        limits = [l for l in (self.expiry_limit(today), self.downsampling_limit(today)) if l]
+        return max(limits) if limits else None
+
+    def __str__(self):
+        return 'max_age=%s max_bytes=%s downsample_age=%s' % (self.max_age, self.max_bytes, self.downsample_age)
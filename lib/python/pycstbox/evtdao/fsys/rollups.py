@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Per-day rollups of the day files used by the file based DAO.
+
+Once a day is closed, its events are summarized per variable in a rollup file
+"YYMMDD.evt-sum" stored next to the day file. For each variable it contains
+the count of events, and the count, min, max, sum, first and last values
+(with their timestamps) of its numeric values, for the whole day and for each
+hour of the day.
+
+Rollups are used to answer aggregate queries and statistics requests without
+reading the raw events again.
+"""
+
+import os
+import json
+
+from pycstbox.evtdao import Aggregate, to_number
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+ROLLUP_FILE_EXT = '.evt-sum'
+
+_FLD_SEP = '\t'
+
+_HOUR_MS = 3600 * 1000
+
+
+class VarRollup(object):
+    """ The summary of the events of a variable for a given day.
+    """
+    __slots__ = ['events', 'day', 'hours']
+
+    def __init__(self):
+        self.events = 0
+        self.day = Aggregate()
+        # hour of the day -> Aggregate
+        self.hours = {}
+
+    def add(self, msecs, value):
+        """ Adds an event to the summary.
+
+        :param int msecs: the event timestamp, in milliseconds since the epoch
+        :param value: the event value (as a number, or None if not numeric)
+        """
+        self.events += 1
+        if value is None:
+            return
+        self.day.add(msecs, value)
+        hour = (msecs // _HOUR_MS) % 24
+        try:
+            agg = self.hours[hour]
+        except KeyError:
+            agg = self.hours[hour] = Aggregate()
+        agg.add(msecs, value)
+
+    def as_dict(self):
+        return {
+            'events': self.events,
+            'day': self.day.as_list(),
+            'hours': {str(h): agg.as_list() for h, agg in self.hours.iteritems()}
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        rollup = cls()
+        rollup.events = d['events']
+        rollup.day = Aggregate.from_list(d['day'])
+        rollup.hours = {int(h): Aggregate.from_list(l) for h, l in d['hours'].iteritems()}
+        return rollup
+
+
+class DayRollup(object):
+    """ The summaries of the variables of a given day.
+
+    The size of the (uncompressed) day file at computation time is stored too,
+    so that rollups can be invalidated if late events have been added since.
+    """
+    def __init__(self, size=0):
+        self.size = size
+        # (var_type, var_name) -> VarRollup
+        self.vars = {}
+
+    def add(self, msecs, var_type, var_name, value):
+        key = (var_type, var_name)
+        try:
+            rollup = self.vars[key]
+        except KeyError:
+            rollup = self.vars[key] = VarRollup()
+        rollup.add(msecs, value)
+
+    def for_var(self, var_type=None, var_name=None):
+        """ Returns the summaries of the variables matching the given type and/or name.
+
+        :returns: a list of ((var_type, var_name), VarRollup) tuples
+        """
+        return [
+            (key, rollup) for key, rollup in self.vars.iteritems()
+            if (not var_type or key[0] == var_type) and (not var_name or key[1] == var_name)
+        ]
+
+    def save(self, path):
+        """ Saves the rollup in the given file, using a temporary file for
+        not exposing partial content to concurrent readers.
+        """
+        d = {
+            'size': self.size,
+            'vars': {
+                _FLD_SEP.join(key): rollup.as_dict() for key, rollup in self.vars.iteritems()
+            }
+        }
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(d, fp, separators=(',', ':'))
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """ Loads a rollup from the given file.
+
+        :raises IOError: if the file cannot be read
+        :raises ValueError: if its content is not valid
+        """
+        with open(path) as fp:
+            d = json.load(fp)
+        try:
+            rollup = cls(d['size'])
+            rollup.vars = {
+                tuple(str(key).split(_FLD_SEP, 1)): VarRollup.from_dict(v)
+                for key, v in d['vars'].iteritems()
+            }
+        except (KeyError, AttributeError, TypeError, ValueError) as e:
+            raise ValueError('invalid rollup content (%s)' % e)
+        return rollup
+
+
+def raw_ts_to_ms(raw_ts, day_ms):
+    """ Converts a raw record timestamp ("YYMMDD-HHMMSS.ffffff") into
+    milliseconds since the epoch, without going through datetime parsing.
+
+    :param str raw_ts: the raw timestamp
+    :param int day_ms: the timestamp of the start of its day, in milliseconds since the epoch
+    """
+    return day_ms + (
+        (int(raw_ts[7:9]) * 60 + int(raw_ts[9:11])) * 60 + int(raw_ts[11:13])
+    ) * 1000 + int(raw_ts[14:17].ljust(3, '0'))
+
+
+def compute_rollup(fp, day_ms):
+    """ Computes the rollup of a day file.
+
+    Corrupted records are ignored.
+
+    :param file fp: the day file, opened for reading
+    :param int day_ms: the timestamp of the start of the day, in milliseconds since the epoch
+    :returns: the rollup
+    """
+    rollup = DayRollup()
+    size = 0
+    for record in fp:
+        if not record.endswith('\n'):
+            break
+        size += len(record)
+        fields = record.split(_FLD_SEP, 4)
+        if len(fields) != 5:
+            continue
+        try:
+            msecs = raw_ts_to_ms(fields[0], day_ms)
+        except ValueError:
+            continue
+        rollup.add(msecs, fields[1], fields[2], to_number(fields[3]))
+    rollup.size = size
+    return rollup
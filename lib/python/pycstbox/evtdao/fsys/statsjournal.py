@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Persistence of the per-variable statistics of the file based DAO.
+
+Statistics are stored as a snapshot ("stats.dat") and a journal
+("stats.jnl"). Each write appends to the journal only the entries which have
+changed since the previous one, one JSON encoded (key, value) record per line.
+The journal is periodically compacted into a new snapshot, written under a
+temporary name and then renamed, so that a complete snapshot is always
+available.
+
+Snapshot and journal share a generation number, stored in the snapshot and as
+the first line of the journal. A journal which generation does not match the
+one of the snapshot has already been merged in it (crash during compaction)
+and is ignored. Incomplete or invalid records at the end of the journal
+(crash during an append) are ignored too.
+"""
+
+import os
+import json
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+SNAPSHOT_FNAME = 'stats.dat'
+JOURNAL_FNAME = 'stats.jnl'
+
+
+class StatsJournal(object):
+    """ The snapshot and journal files of the statistics of a channel.
+    """
+    # number of records appended to the journal before it is compacted
+    COMPACTION_THRESHOLD = 10000
+
+    def __init__(self, dbhome, logger):
+        self._snapshot_path = os.path.join(dbhome, SNAPSHOT_FNAME)
+        self._journal_path = os.path.join(dbhome, JOURNAL_FNAME)
+        self._logger = logger
+        self._generation = 0
+        self._journal_fp = None
+        self._journal_records = 0
+
+    def load(self):
+        """ Loads the statistics from the snapshot and replays the journal.
+
+        :returns: the statistics, as a dictionary
+        """
+        stats = {}
+        try:
+            with open(self._snapshot_path) as fp:
+                d = json.load(fp)
+        except IOError:
+            d = {}
+        except ValueError as e:
+            self._logger.warning("could not load stats snapshot %s (%s)", self._snapshot_path, e)
+            d = {}
+        if 'generation' in d and 'stats' in d:
+            self._generation = d['generation']
+            stats.update(d['stats'])
+        else:
+            # snapshot written by previous versions
+            stats.update(d)
+
+        replayed = 0
+        try:
+            with open(self._journal_path) as fp:
+                header = fp.readline()
+                if header.strip() == str(self._generation):
+                    for line in fp:
+                        if not line.endswith('\n'):
+                            self._logger.warning("ignoring torn record at end of %s", self._journal_path)
+                            break
+                        try:
+                            key, value = json.loads(line)
+                        except ValueError:
+                            self._logger.warning("ignoring invalid record in %s", self._journal_path)
+                            continue
+                        stats[key] = value
+                        replayed += 1
+        except IOError:
+            pass
+
+        self._logger.info("stats data loaded (%d entries, %d journal records)", len(stats), replayed)
+        return stats
+
+    def append(self, entries):
+        """ Appends changed entries to the journal.
+
+        :param dict entries: the changed entries
+        :returns: True if the journal should now be compacted
+        """
+        if self._journal_fp is None:
+            self._journal_fp = open(self._journal_path, 'a')
+        self._journal_fp.write(''.join(json.dumps([k, v]) + '\n' for k, v in entries.iteritems()))
+        self._journal_fp.flush()
+        self._journal_records += len(entries)
+        return self._journal_records >= self.COMPACTION_THRESHOLD
+
+    def compact(self, stats):
+        """ Writes a new snapshot containing the given statistics, and starts
+        a new empty journal.
+
+        :param dict stats: the complete statistics
+        """
+        self._generation += 1
+        tmp_path = self._snapshot_path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump({'generation': self._generation, 'stats': stats}, fp, separators=(',', ':'))
+        os.rename(tmp_path, self._snapshot_path)
+
+        if self._journal_fp:
+            self._journal_fp.close()
+        tmp_path = self._journal_path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            fp.write('%d\n' % self._generation)
+        os.rename(tmp_path, self._journal_path)
+        self._journal_fp = open(self._journal_path, 'a')
+        self._journal_records = 0
+
+    def close(self):
+        if self._journal_fp:
+            self._journal_fp.close()
+            self._journal_fp = None
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Low overhead counters and latency histograms.
+
+They are used by the DAOs and the events database service for reporting what
+happens on their hot paths (insert rates, queries latency, flushes,...).
+
+Histograms use fixed buckets with exponentially growing bounds, so that
+recording a value only costs a bisection and an increment. Percentiles are
+estimated from the buckets, the upper bound of the bucket in which they fall
+(or the maximum recorded value if lower) being reported.
+"""
+
+import bisect
+import threading
+import time
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+# upper bounds (in seconds) of the latency histograms buckets, from 50us to 60s
+LATENCY_BOUNDS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30., 60.
+)
+
+
+class Histogram(object):
+    """ Distribution of latencies, in seconds.
+    """
+    __slots__ = ['counts', 'count', 'sum', 'max']
+
+    def __init__(self):
+        # the last bucket holds the values above the highest bound
+        self.counts = [0] * (len(LATENCY_BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """ Returns the estimated value of a percentile (0 < p <= 100), or
+        None if no value has been recorded.
+        """
+        if not self.count:
+            return None
+        rank = self.count * p / 100.
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(LATENCY_BOUNDS[i], self.max) if i < len(LATENCY_BOUNDS) else self.max
+        return self.max
+
+    def as_dict(self):
+        d = {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+        }
+        if self.count:
+            d.update({
+                'mean': self.sum / self.count,
+                'p50': self.percentile(50),
+                'p90': self.percentile(90),
+                'p99': self.percentile(99),
+            })
+        return d
+
+
+class Metrics(object):
+    """ A set of named counters and histograms.
+
+    Counters and histograms are created on first use. Updates are protected
+    by a single lock, held only for the duration of the update.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._started = time.time()
+
+    def inc(self, name, count=1):
+        """ Increments a counter.
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + count
+
+    def observe(self, name, value):
+        """ Records a value (in seconds) in a histogram.
+        """
+        with self._lock:
+            try:
+                histogram = self._histograms[name]
+            except KeyError:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def timed(self, name):
+        """ Returns a context manager recording the execution time of its
+        block in a histogram.
+
+        The duration is recorded whether the block raises or not.
+        """
+        return _Timer(self, name)
+
+    def snapshot(self):
+        """ Returns the current values.
+
+        :returns: a dictionary containing the uptime (in seconds), the counters
+            values and the histograms summaries (see Histogram.as_dict())
+        """
+        with self._lock:
+            return {
+                'uptime': time.time() - self._started,
+                'counters': dict(self._counters),
+                'histograms': {name: h.as_dict() for name, h in self._histograms.iteritems()},
+            }
+
+
+class _Timer(object):
+    __slots__ = ['_metrics', '_name', '_started']
+
+    def __init__(self, metrics, name):
+        self._metrics = metrics
+        self._name = name
+        self._started = None
+
+    def __enter__(self):
+        self._started = time.time()
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self._metrics.observe(self._name, time.time() - self._started)
+        return False
@@ -0,0 +1,451 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+""" SQLite based storage for events.
+
+The events of a channel are stored in a single database file named
+"<channel>.sqlite", with the following tables:
+
+    - events : one row per event (timestamp in milliseconds since the epoch,
+      variable type and name, value, additional data as JSON)
+    - days : the list of days for which events are available
+    - last_values : the latest event of each variable, updated in the same
+      transaction as the events
+
+The database is used in WAL mode, so that other processes can query it while
+the daemon writes. Events are inserted by batches, each batch being a single
+transaction, and queries filters are evaluated by SQLite using the composite
+(var_name, ts) and (var_type, ts) indexes.
+
+When flash memory support is declared, successive batches are grouped in a
+transaction committed after a short delay or when enough rows are pending,
+instead of being committed one by one. Uncommitted events are not visible to
+the queries, which use their own connections.
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+
+from pycstbox import evtdao
+from pycstbox import evtmgr
+from pycstbox import events
+from pycstbox import sysutils
+from pycstbox.evtdao.deadband import DeadbandPolicy
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+
+_DB_FILE_EXT = '.sqlite'
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS events ("
+    "ts INTEGER NOT NULL, var_type TEXT NOT NULL, var_name TEXT NOT NULL, value, data TEXT)",
+    "CREATE INDEX IF NOT EXISTS events_var_name_ts ON events (var_name, ts)",
+    "CREATE INDEX IF NOT EXISTS events_var_type_ts ON events (var_type, ts)",
+    "CREATE INDEX IF NOT EXISTS events_ts ON events (ts)",
+    "CREATE TABLE IF NOT EXISTS days (day TEXT PRIMARY KEY)",
+    "CREATE TABLE IF NOT EXISTS last_values ("
+    "var_type TEXT NOT NULL, var_name TEXT NOT NULL, ts INTEGER NOT NULL, value, data TEXT, "
+    "PRIMARY KEY (var_type, var_name))",
+]
+
+_SQL_INSERT_EVENT = "INSERT INTO events (ts, var_type, var_name, value, data) VALUES (?, ?, ?, ?, ?)"
+_SQL_INSERT_DAY = "INSERT OR IGNORE INTO days (day) VALUES (?)"
+# parameters are the ones of _SQL_INSERT_EVENT, the stored event being kept
+# if more recent
+_SQL_UPSERT_LAST_VALUE = (
+    "INSERT OR REPLACE INTO last_values (var_type, var_name, ts, value, data) "
+    "SELECT ?2, ?3, ?1, ?4, ?5 WHERE NOT EXISTS "
+    "(SELECT 1 FROM last_values WHERE var_type = ?2 AND var_name = ?3 AND ts > ?1)"
+)
+_SQL_SELECT_EVENTS = "SELECT ts, var_type, var_name, value, data FROM events"
+_SQL_SELECT_LAST_VALUES = (
+    "SELECT ts, var_type, var_name, value, data FROM last_values ORDER BY var_type, var_name"
+)
+# SQLite returns the columns of the row holding the maximum for the bare ones.
+# Only used for databases written before the last_values table existed.
+_SQL_SELECT_LAST_EVENTS = (
+    "SELECT MAX(ts), var_type, var_name, value, data FROM events "
+    "GROUP BY var_type, var_name ORDER BY var_type, var_name"
+)
+_SQL_INIT_LAST_VALUES = (
+    "INSERT INTO last_values (var_type, var_name, ts, value, data) "
+    "SELECT var_type, var_name, MAX(ts), value, data FROM events GROUP BY var_type, var_name"
+)
+
+# number of rows fetched at once by the queries
+_FETCH_SIZE = 1000
+
+
+class EventsDAO(evtdao.AbstractDAO):
+    """ Implements the event data object as an SQLite database.
+
+    See module documentation for the storage layout.
+    """
+    FLASH_COMMIT_DELAY = 30         # max delay before committing writes in flash memory mode (seconds)
+    FLASH_COMMIT_ROWS = 5000        # max count of uncommitted rows in flash memory mode
+    BUSY_TIMEOUT = 10               # seconds
+
+    class Error(Exception):
+        """ Exceptions specialized for this DAO."""
+        pass
+
+    def __init__(self,
+                 events_channel=evtmgr.SENSOR_EVENT_CHANNEL,
+                 config=None,
+                 readonly=False):
+        """ Constructor.
+
+        The database file is stored in the directory defined by the
+        configuration, and created if not yet available when opened in write
+        mode.
+
+        Parameters:
+            events_channel:
+                the channel (ie sensor, sysmon,...) of the events to be stored
+            config:
+                the DAO configuration parameters (mandatory)
+            readonly:
+                guess what... (default: False)
+
+        Raises:
+            ValueError:
+                if mandatory parameters not provided
+            IOError:
+                if provided dbhome does not exists, is not a directory or
+                cannot be written to
+        """
+        if not config:
+            raise ValueError("missing mandatory parameter : config")
+
+        dbhome = config[evtdao.CFGKEY_EVTS_DB_HOME_DIR]
+        if not os.path.exists(dbhome):
+            if readonly:
+                raise IOError('path not found : %s' % dbhome)
+            else:
+                os.mkdir(dbhome)
+        else:
+            if not os.path.isdir(dbhome):
+                raise IOError('path is not a directory : %s' % dbhome)
+
+        super(EventsDAO, self).__init__(events_channel)
+
+        self._db_path = os.path.join(dbhome, events_channel + _DB_FILE_EXT)
+        if readonly and not os.path.exists(self._db_path):
+            raise IOError('path not found : %s' % self._db_path)
+
+        self._readonly = readonly
+        self._flash_memory = config.get(evtdao.CFGKEY_FLASH_MEM_SUPPORT, False)
+        if self._flash_memory:
+            self._logger.warning(
+                "flash memory support declared: writes will be committed every %ds or %d rows",
+                self.FLASH_COMMIT_DELAY, self.FLASH_COMMIT_ROWS
+            )
+        self._uncommitted = 0
+        self._commit_timer = None
+
+        self._deadband = DeadbandPolicy.from_config(config)
+        if self._deadband:
+            self._logger.info("deadband policy: %s", self._deadband)
+
+        self._conn = None
+        self._write_lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def _connect(self):
+        """ Returns a new connection to the database.
+
+        Connections can be used by any thread, since query generators can
+        be consumed by successive threads of the queries pool. They are
+        however never shared between concurrent queries.
+        """
+        conn = sqlite3.connect(self._db_path, timeout=self.BUSY_TIMEOUT, check_same_thread=False)
+        conn.text_factory = str
+        return conn
+
+    def open(self):
+        """ Opens the write connection, creating the database if needed.
+        """
+        self._opened = True
+        if self._readonly:
+            return
+        with self._write_lock:
+            if self._conn:
+                self._logger.warning('database already opened')
+                return
+            self._conn = self._connect()
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in _SCHEMA:
+                self._conn.execute(statement)
+            # databases written before the last_values table existed
+            if not self._conn.execute("SELECT 1 FROM last_values LIMIT 1").fetchone():
+                self._conn.execute(_SQL_INIT_LAST_VALUES)
+            self._conn.commit()
+
+    def close(self):
+        self._opened = False
+        with self._write_lock:
+            if self._conn:
+                self._commit()
+                self._conn.close()
+                self._conn = None
+
+    def flush(self):
+        """ Commits the pending writes.
+        """
+        with self.metrics.timed('flush'), self._write_lock:
+            if self._conn:
+                self._commit()
+        self._logger.info('on-demand data flush executed')
+
+    def _commit(self):
+        """ Commits the current transaction. Must be called with the write lock held.
+        """
+        if self._commit_timer:
+            self._commit_timer.cancel()
+            self._commit_timer = None
+        self._conn.commit()
+        self._uncommitted = 0
+
+    def _delayed_commit(self):
+        """ Commits the writes grouped in flash memory mode once their delay has expired.
+        """
+        with self._write_lock:
+            self._commit_timer = None
+            if self._conn and self._uncommitted:
+                self._commit()
+
+    def insert_event(self, msecs, var_type, var_name, data):
+        """ See DAOObject class"""
+        assert msecs
+        assert var_type
+        assert var_name
+        assert data
+
+        self.insert_events([(msecs, var_type, var_name, data)])
+
+    def insert_events(self, evts):
+        """ See DAOObject class
+
+        The whole batch is inserted in a single transaction.
+        """
+        if self._readonly:
+            msg = 'database opened in readonly'
+            self._logger.error(msg)
+            raise IOError(msg)
+
+        rows = []
+        days = set()
+        # the latest event of each variable in the batch
+        last_rows = {}
+        suppressed = 0
+        deadband_changes = {}
+        for msecs, var_type, var_name, data in evts:
+            if type(data) is dict:
+                data_dict = dict(data)
+            else:
+                try:
+                    data_dict = json.loads(data)
+                except ValueError as e:
+                    self._logger.error('malformed event data (%s): %s', data, e.message)
+                    continue
+
+            try:
+                value = data_dict.pop(events.DataKeys.VALUE)
+            except KeyError:
+                self._logger.error('missing value field in data (%s)', data)
+                continue
+
+            if self._deadband and not self._deadband.accept(msecs, var_type, var_name, value, deadband_changes):
+                suppressed += 1
+                continue
+
+            row = (int(msecs), var_type, var_name, value, json.dumps(data_dict))
+            rows.append(row)
+            key = (var_type, var_name)
+            if key not in last_rows or row[0] >= last_rows[key][0]:
+                last_rows[key] = row
+            days.add(datetime.utcfromtimestamp(msecs / 1000.0).date().isoformat())
+
+        if suppressed:
+            self.metrics.inc('events_suppressed', suppressed)
+        if not rows:
+            if deadband_changes:
+                self._deadband.commit(deadband_changes)
+            return
+
+        with self.metrics.timed('insert_events'), self._write_lock:
+            if not self._conn:
+                self.open()
+            self._conn.executemany(_SQL_INSERT_EVENT, rows)
+            self._conn.executemany(_SQL_INSERT_DAY, ((day,) for day in days))
+            self._conn.executemany(_SQL_UPSERT_LAST_VALUE, last_rows.itervalues())
+
+            self._uncommitted += len(rows)
+            if not self._flash_memory or self._uncommitted >= self.FLASH_COMMIT_ROWS:
+                self._commit()
+            elif not self._commit_timer:
+                self._commit_timer = threading.Timer(self.FLASH_COMMIT_DELAY, self._delayed_commit)
+                self._commit_timer.daemon = True
+                self._commit_timer.start()
+            if deadband_changes:
+                self._deadband.commit(deadband_changes)
+        self.metrics.inc('events_inserted', len(rows))
+
+    def get_available_days(self, month=None):
+        """ See DAOObject class"""
+        if month and not isinstance(month, tuple):
+            raise ValueError('month must be a tuple')
+
+        sql = "SELECT day FROM days"
+        params = ()
+        if month:
+            yy, mm = month
+            if yy < 100:
+                yy += 2000
+            sql += " WHERE day >= ? AND day < ?"
+            params = ('%04d-%02d-01' % (yy, mm), '%04d-%02d-32' % (yy, mm))
+        sql += " ORDER BY day"
+
+        for (day,) in self._query(sql, params):
+            yield datetime.strptime(day, evtdao.DATE_FMT).date()
+
+    def get_events_for_day(self, day, var_type=None, var_name=None):
+        """ See DAOObject class"""
+        self._logger.debug("get_events_for_day('%s','%s','%s') called" %
+                           (day, var_type, var_name))
+
+        if not isinstance(day, date):
+            yyyy, mm, dd = (int(x) for x in day[:10].replace('/', '-').split('-'))
+            day = date(yyyy, mm, dd)
+
+        from_time = datetime(day.year, day.month, day.day)
+        return self._get_events(
+            sysutils.to_milliseconds(from_time),
+            sysutils.to_milliseconds(from_time + timedelta(days=1)) - 1,
+            var_type, var_name
+        )
+
+    def get_events(self, from_time=None, to_time=None, var_type=None, var_name=None):
+        """ See DAOObject class"""
+        self._logger.debug("get_events(%s,%s,%s,%s) called", from_time, to_time, var_type, var_name)
+
+        return self._get_events(
+            sysutils.to_milliseconds(from_time) if from_time else None,
+            sysutils.to_milliseconds(to_time) if to_time else None,
+            var_type, var_name
+        )
+
+    def get_last_values(self, pattern=None):
+        """ See DAOObject class
+
+        The latest events are maintained by the writes in the last_values
+        table. Databases not opened for writing since it exists are scanned
+        for the latest event of each variable.
+        """
+        try:
+            rows = list(self._query(_SQL_SELECT_LAST_VALUES))
+        except sqlite3.OperationalError:
+            rows = self._query(_SQL_SELECT_LAST_EVENTS)
+
+        result = []
+        for msecs, var_type, var_name, value, data in rows:
+            if pattern and not self._match_var_pattern(pattern, var_type, var_name):
+                continue
+            try:
+                data = json.loads(data) if data else {}
+            except ValueError:
+                self.metrics.inc('corrupted_records')
+                self._logger.warning("ignoring corrupted event (%s, %s, %s)", msecs, var_type, var_name)
+                continue
+            result.append(events.make_timed_event(
+                datetime.utcfromtimestamp(msecs / 1000.0), var_type, var_name,
+                value=value,
+                **data
+            ))
+        return result
+
+    def _get_events(self, from_ms, to_ms, var_type, var_name):
+        """ Generator returning the events matching the given criteria, the
+        filtering being done by SQLite.
+
+        Variable filters made of exact names are evaluated by SQLite. The ones
+        containing patterns are evaluated on the returned rows.
+        """
+        where, params = [], []
+        matchers = []
+        # the filters evaluated on the rows, with the position of the filtered column
+        for pos, column, var_filter in ((1, 'var_type', var_type), (2, 'var_name', var_name)):
+            var_filter = evtdao.VarFilter.from_spec(var_filter)
+            if not var_filter:
+                continue
+            if var_filter.exact:
+                where.append("%s IN (%s)" % (column, ','.join('?' * len(var_filter.names))))
+                params.extend(var_filter.names)
+            else:
+                matchers.append((pos, var_filter))
+        if from_ms is not None:
+            where.append("ts >= ?")
+            params.append(from_ms)
+        if to_ms is not None:
+            where.append("ts <= ?")
+            params.append(to_ms)
+
+        sql = _SQL_SELECT_EVENTS
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY ts, rowid"
+
+        for row in self._query(sql, params):
+            if matchers and not all(var_filter.match(row[pos]) for pos, var_filter in matchers):
+                continue
+            msecs, rec_var_type, rec_var_name, value, data = row
+            try:
+                data = json.loads(data) if data else {}
+            except ValueError:
+                self.metrics.inc('corrupted_records')
+                self._logger.warning("ignoring corrupted event (%s, %s, %s)", msecs, rec_var_type, rec_var_name)
+                continue
+            yield events.make_timed_event(
+                datetime.utcfromtimestamp(msecs / 1000.0), rec_var_type, rec_var_name,
+                value=value,
+                **data
+            )
+
+    def _query(self, sql, params=()):
+        """ Generator returning the rows of a query executed on a dedicated
+        connection, so that it does not interfere with the writes nor with
+        the other queries.
+        """
+        conn = self._connect()
+        try:
+            cursor = conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(_FETCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            conn.close()
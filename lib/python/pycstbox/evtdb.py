@@ -29,11 +29,29 @@ upper layers.
 The concrete DAO to be used must be passed to the constructor.
 """
 
+import os
+import json
+import tempfile
+import cProfile
+import pstats
+import itertools
+import operator
+import time
+import uuid
+import threading
+import Queue
+from multiprocessing.pool import ThreadPool
+
+import dbus
 import dbus.exceptions
 import dbus.service
 import dateutil.parser
+import gobject
 
 from pycstbox.log import Loggable
+from pycstbox.evtdao.metrics import Metrics
+import pycstbox.evtdao as evtdao
+import pycstbox.evtdao.export as export
 import pycstbox.evtmgr as evtmgr
 import pycstbox.service as service
 import pycstbox.dbuslib as dbuslib
@@ -54,6 +72,275 @@ FILTER_TO_TIME = 'to_time'
 FILTER_VAR_TYPE = 'var_type'
 FILTER_VAR_NAME = 'var_name'
 
+# default limits of the query cursors
+DEFAULT_MAX_CURSORS = 16
+DEFAULT_CURSOR_TIMEOUT = 300        # seconds
+
+# default settings of the queries execution
+DEFAULT_QUERY_WORKERS = 2
+DEFAULT_QUERY_TIMEOUT = 120         # seconds
+
+
+# default settings of the events write queue
+DEFAULT_WRITE_QUEUE_SIZE = 10000
+DEFAULT_WRITE_BATCH_SIZE = 500
+DEFAULT_WRITE_MAX_LATENCY = 0.5     # seconds
+DEFAULT_WRITE_PUT_TIMEOUT = 0.1     # seconds
+
+# default period of the metrics file update
+DEFAULT_METRICS_PERIOD = 60         # seconds
+
+# default directory of the profiling data files
+DEFAULT_PROFILE_DIR = os.path.join(tempfile.gettempdir(), 'evtdb-profiles')
+
+
+class CallProfiler(Loggable):
+    """ Opt-in profiling of the service calls.
+
+    When enabled, the calls are executed under cProfile, and the statistics
+    are accumulated per method. They are written as "<channel>-<method>.pstats"
+    files (to be examined with the pstats module, or tools such as snakeviz
+    or gprof2dot) on request and when the profiling is disabled.
+
+    Independently, the calls lasting more than a given threshold are logged
+    together with their arguments.
+    """
+    def __init__(self, channel, output_dir=DEFAULT_PROFILE_DIR, slow_threshold=0, enabled=False):
+        """
+        :param str channel: the event channel
+        :param str output_dir: the directory in which the statistics files are written
+        :param float slow_threshold: the duration (in seconds) beyond which calls
+            are logged, 0 for none
+        :param bool enabled: True if the profiling is enabled from the start
+        """
+        Loggable.__init__(self, logname='PR:%s' % channel)
+        self._channel = channel
+        self._output_dir = output_dir
+        self._slow_threshold = slow_threshold
+        self._lock = threading.Lock()
+        # method name -> pstats.Stats
+        self._stats = {}
+        self.enabled = enabled
+
+    def call(self, name, args, func, *func_args):
+        """ Executes a call, profiling it if enabled and logging it if slow.
+
+        :param str name: the method name, used for grouping the statistics
+        :param tuple args: the method arguments, logged if the call is slow
+        :param callable func: the function to be called
+        :param func_args: the function arguments
+        :returns: the function result
+        """
+        profile = cProfile.Profile() if self.enabled else None
+        started = time.time()
+        try:
+            if profile:
+                return profile.runcall(func, *func_args)
+            return func(*func_args)
+        finally:
+            duration = time.time() - started
+            if profile:
+                with self._lock:
+                    if name in self._stats:
+                        self._stats[name].add(profile)
+                    else:
+                        self._stats[name] = pstats.Stats(profile)
+            if self._slow_threshold and duration >= self._slow_threshold:
+                self.log_warning('slow call: %s%r took %.3fs', name, tuple(args), duration)
+
+    def set_enabled(self, enabled):
+        """ Enables or disables the profiling.
+
+        The statistics are written and reset when the profiling is disabled.
+
+        :returns: the list of the written files
+        """
+        self.enabled = enabled
+        self.log_info('profiling %s', 'enabled' if enabled else 'disabled')
+        if enabled:
+            return []
+        paths = self.dump()
+        with self._lock:
+            self._stats.clear()
+        return paths
+
+    def dump(self):
+        """ Writes the statistics accumulated so far.
+
+        :returns: the list of the written files
+        """
+        with self._lock:
+            if not self._stats:
+                return []
+            if not os.path.isdir(self._output_dir):
+                os.makedirs(self._output_dir)
+            paths = []
+            for name, stats in self._stats.iteritems():
+                path = os.path.join(self._output_dir, '%s-%s.pstats' % (self._channel, name))
+                stats.dump_stats(path)
+                paths.append(path)
+        self.log_info('profiling statistics written to %s', self._output_dir)
+        return sorted(paths)
+
+
+class EventsWriter(threading.Thread, Loggable):
+    """ Writes the received events to the database from a dedicated thread.
+
+    Events are queued by the D-Bus signal handler and written by batches, so
+    that the main loop is not stalled by the storage I/O during bursts of
+    events. A batch is committed as soon as it reaches its maximum size or as
+    soon as its oldest event has been waiting for the maximum latency.
+
+    When the queue is full, put() waits for some room during a limited time
+    (thus slowing down the processing of the incoming signals) and drops the
+    event if none is made available.
+    """
+    def __init__(self, dao, channel,
+                 queue_size=DEFAULT_WRITE_QUEUE_SIZE,
+                 batch_size=DEFAULT_WRITE_BATCH_SIZE,
+                 max_latency=DEFAULT_WRITE_MAX_LATENCY,
+                 put_timeout=DEFAULT_WRITE_PUT_TIMEOUT,
+                 profiler=None):
+        """
+        :param dao: the DAO in which events are written
+        :param str channel: the event channel
+        :param int queue_size: the maximum number of queued events
+        :param int batch_size: the maximum number of events written in a single batch
+        :param float max_latency: the maximum delay (in seconds) before a queued event is written
+        :param float put_timeout: the maximum delay (in seconds) a full queue blocks
+            the producer before the event is dropped
+        :param CallProfiler profiler: optional profiler of the batches writes
+        """
+        threading.Thread.__init__(self, name='evtdb-writer-' + channel)
+        Loggable.__init__(self, logname='WR:%s' % channel)
+        self.daemon = True
+
+        self._dao = dao
+        self._queue = Queue.Queue(maxsize=queue_size)
+        self._batch_size = batch_size
+        self._max_latency = max_latency
+        self._put_timeout = put_timeout
+        self._profiler = profiler
+        self._terminate = False
+
+        self.received = 0
+        self.dropped = 0
+        self.waits = 0
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+
+    def put(self, evt):
+        """ Queues an event for writing.
+
+        :param tuple evt: the event, as a (msecs, var_type, var_name, data) tuple
+        :returns: True if the event has been queued, False if it has been dropped
+        """
+        self.received += 1
+        try:
+            self._queue.put_nowait(evt)
+        except Queue.Full:
+            # apply backpressure on the producer before giving up
+            self.waits += 1
+            try:
+                self._queue.put(evt, timeout=self._put_timeout)
+            except Queue.Full:
+                self.dropped += 1
+                if self.dropped % 1000 == 1:
+                    self.log_warning('write queue full: %d event(s) dropped so far', self.dropped)
+                return False
+        return True
+
+    def run(self):
+        while not (self._terminate and self._queue.empty()):
+            try:
+                batch = [self._queue.get(timeout=1)]
+            except Queue.Empty:
+                continue
+
+            deadline = time.time() + self._max_latency
+            while len(batch) < self._batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except Queue.Empty:
+                    break
+
+            try:
+                if self._profiler:
+                    self._profiler.call('write', (len(batch),), self._dao.insert_events, batch)
+                else:
+                    self._dao.insert_events(batch)
+            except Exception as e: #pylint: disable=W0703
+                self.errors += 1
+                self.log_exception(e)
+            else:
+                self.written += len(batch)
+                self.batches += 1
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def drain(self):
+        """ Waits until all the queued events have been written."""
+        self._queue.join()
+
+    def stop(self):
+        """ Writes the pending events and terminates the thread."""
+        self._terminate = True
+        self.join()
+
+    def get_stats(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'received': self.received,
+            'written': self.written,
+            'batches': self.batches,
+            'waits': self.waits,
+            'dropped': self.dropped,
+            'errors': self.errors
+        }
+
+
+class QueryError(dbus.exceptions.DBusException):
+    """ Error reported to D-Bus clients for invalid query cursor operations."""
+    _dbus_error_name = SERVICE_INTERFACE + '.QueryError'
+
+
+class QueryTimeout(QueryError):
+    """ Error reported to D-Bus clients when a query exceeds its allowed execution time."""
+    _dbus_error_name = SERVICE_INTERFACE + '.QueryTimeout'
+
+
+class _QueryCursor(object):
+    """ Server side state of a query opened with open_query().
+
+    It keeps alive the generator returned by the DAO, so that the events are
+    produced only as they are fetched by the client.
+    """
+    def __init__(self, events, event_filter):
+        self.events = events
+        self.event_filter = event_filter
+        self.last_access = time.time()
+        self.busy = False
+        self.cancelled = False
+
+    def next_events(self, count):
+        """ Generator returning the next events of the query, which gives up
+        if the cursor is cancelled meanwhile.
+
+        :raises QueryError: if the cursor is cancelled
+        """
+        for evt in itertools.islice(self.events, count):
+            if self.cancelled:
+                raise QueryError('query cancelled')
+            yield evt
+
+    def close(self):
+        self.events.close()
+
 
 class EventsDatabase(service.ServiceContainer):
     """ CSTBox Event database service.
@@ -62,24 +349,60 @@ class EventsDatabase(service.ServiceContainer):
     to keep the various communication separated, and this easing the subscription
     to a given kind of channel.
     """
-    def __init__(self, conn, daos):
+    def __init__(self, conn, daos, metrics_file=None, metrics_period=DEFAULT_METRICS_PERIOD, **options):
         """
         :param conn:
             the D-Bus connection (Session, System,...)
 
         :param daos:
             a list of tuples, containing the channel name and the DAO instance managing
-            its events
+            its events. The DAOs not opened yet are opened when the service objects
+            are started. Opening them before the D-Bus connection is set up avoids
+            that the processes they fork (if any) inherit it
+
+        :param str metrics_file:
+            optional path of a file in which the metrics of all the channels
+            are periodically written as JSON
+
+        :param int metrics_period:
+            the period (in seconds) of the metrics file update
+
+        :param options:
+            optional keyword parameters passed to the service objects constructor
         """
         if not daos:
             raise ValueError('no DAO provided')
 
-        svc_objects = [
-            (EventDatabaseObject(channel, dao), '/' + channel) for channel, dao in daos
+        self._channel_objects = [
+            (channel, EventDatabaseObject(channel, dao, **options)) for channel, dao in daos
         ]
+        svc_objects = [(obj, '/' + channel) for channel, obj in self._channel_objects]
 
         super(EventsDatabase, self).__init__(SERVICE_NAME, conn, svc_objects)
 
+        self._metrics_file = metrics_file
+        if metrics_file:
+            gobject.timeout_add_seconds(metrics_period, self._write_metrics)
+
+    def _write_metrics(self):
+        """ Writes the metrics of the channels in the metrics file.
+
+        A temporary file is used for not exposing partial content to its readers.
+        """
+        metrics = {
+            'time': time.time(),
+            'channels': {channel: obj.get_metrics_snapshot() for channel, obj in self._channel_objects}
+        }
+        tmp_path = self._metrics_file + '.tmp'
+        try:
+            with open(tmp_path, 'w') as fp:
+                json.dump(metrics, fp, sort_keys=True)
+            os.rename(tmp_path, self._metrics_file)
+        except (IOError, OSError) as e:
+            self.log_error("cannot write metrics file %s (%s)", self._metrics_file, e)
+        # keep the timer running
+        return True
+
 
 class EventDatabaseObject(dbus.service.Object, Loggable):
     """ The service object for a given event database.
@@ -87,14 +410,41 @@ class EventDatabaseObject(dbus.service.Object, Loggable):
     One instance of this class is created for managing the persistence of
     each event channel to be managed (see EventDatabase.__init__().
     """
-    def __init__(self, channel, dao): #pylint: disable=E1002
+    def __init__(self, channel, dao,
+                 max_cursors=DEFAULT_MAX_CURSORS,
+                 cursor_timeout=DEFAULT_CURSOR_TIMEOUT,
+                 write_options=None,
+                 query_workers=DEFAULT_QUERY_WORKERS,
+                 query_timeout=DEFAULT_QUERY_TIMEOUT,
+                 profiling=False,
+                 profile_dir=DEFAULT_PROFILE_DIR,
+                 slow_call_threshold=0): #pylint: disable=E1002
         """
         :param str channel: the event channel
+        :param dao: the DAO managing the events of the channel
+        :param int max_cursors: the maximum number of simultaneously opened query cursors
+        :param int cursor_timeout: the delay (in seconds) after which an idle cursor is discarded
+        :param dict write_options: optional keyword parameters of the EventsWriter constructor
+        :param int query_workers: the number of threads executing the queries
+        :param int query_timeout: the maximum execution time (in seconds) of a query
+        :param bool profiling: True if the calls are profiled from the start
+        :param str profile_dir: the directory in which the profiling statistics are written
+        :param float slow_call_threshold: the duration (in seconds) beyond which
+            calls are logged, 0 for none
         """
         super(EventDatabaseObject, self).__init__()
 
         self._channel = channel
         self._dao = dao
+        self._max_cursors = max_cursors
+        self._cursor_timeout = cursor_timeout
+        self._cursors = {}
+        self._profiler = CallProfiler(channel, profile_dir, slow_call_threshold, profiling)
+        self._writer = EventsWriter(dao, channel, profiler=self._profiler, **(write_options or {}))
+        self._query_workers = query_workers
+        self._query_timeout = query_timeout
+        self._query_pool = None
+        self._metrics = Metrics()
 
         Loggable.__init__(self, logname='SO:%s' % self._channel)
 
@@ -102,12 +452,18 @@ class EventDatabaseObject(dbus.service.Object, Loggable):
         self.log_debug(
             "recording event : timestamp=%s var_type=%s var_name=%s data=%s",
             timestamp, var_type, var_name, data)
-        self._dao.insert_event(timestamp, var_type, var_name, data)
+        self._profiler.call(
+            'event_signal_handler', (var_type, var_name),
+            self._writer.put, (timestamp, var_type, var_name, data)
+        )
 
     def start(self):
         """ Service objet runtime initialization """
         self.log_info('starting svcobj for channel %s', self._channel)
-        self._dao.open()
+        if not self._dao.opened:
+            self._dao.open()
+        self._writer.start()
+        self._query_pool = ThreadPool(self._query_workers)
 
         try:
             svc = evtmgr.get_object(self._channel)
@@ -121,13 +477,164 @@ class EventDatabaseObject(dbus.service.Object, Loggable):
             self.log_info('connected to EventManager onCSTBoxEvent signal')
 
     def stop(self):
-        """ Cleanup before stop """
+        """ Cleanup before stop
+
+        The cursors being fetched are cancelled and the other ones closed
+        before waiting for the running queries, since a cursor cannot be
+        closed while a worker is producing its events.
+        """
+        for query_id, cursor in self._cursors.items():
+            if cursor.busy:
+                cursor.cancelled = True
+            else:
+                self._close_cursor(query_id)
+        if self._query_pool:
+            self._query_pool.close()
+            self._query_pool.join()
+            self._query_pool = None
+        for query_id in self._cursors.keys():
+            self._close_cursor(query_id)
+        if self._writer.is_alive():
+            self._writer.stop()
         self._dao.close()
+        if self._profiler.enabled:
+            self._profiler.dump()
 
-    @dbus.service.method(SERVICE_INTERFACE)
-    def flush(self):
-        """ Flushes pending writes. """
-        self._dao.flush()
+    @dbus.service.method(SERVICE_INTERFACE,
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def flush(self, reply_handler, error_handler):
+        """ Flushes pending writes, including the events waiting in the write queue.
+
+        Waiting for the write queue to be drained and flushing the storage are
+        executed by the queries worker threads, so that the main loop keeps
+        processing the incoming events meanwhile.
+        """
+        def query(_deadline):
+            self._writer.drain()
+            self._dao.flush()
+
+        # the method has no result
+        self._run_query(query, lambda _result: reply_handler(), error_handler, 'flush')
+
+    @dbus.service.method(SERVICE_INTERFACE,
+                         in_signature='a(tssa{sv})',
+                         out_signature='u',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def insert_events(self, evts, reply_handler, error_handler):
+        """ Stores a batch of events at once.
+
+        This is intended for backfilling the database (restoration of data
+        buffered during a network outage, migration of history,...) without
+        replaying the events one by one as signals. The events are sorted by
+        time, so that the storage can write the ones of each day at once.
+
+        The insertion is executed by the queries worker threads, and does not
+        go through the write queue of the events received as signals.
+
+        :param list evts:
+            the events, as (timestamp in milliseconds since the epoch, var_type,
+            var_name, data) tuples, the data dictionary including the value
+            of the event
+
+        :returns: the number of events submitted to the storage
+        """
+        self.log_debug("insert_events(<%d events>) called", len(evts))
+
+        def query(_deadline):
+            batch = sorted(
+                ((int(msecs), str(var_type), str(var_name), dict((str(k), v) for k, v in data.iteritems()))
+                 for msecs, var_type, var_name, data in evts),
+                key=operator.itemgetter(0)
+            )
+            self._dao.insert_events(batch)
+            return len(batch)
+
+        self._run_query(query, reply_handler, error_handler, 'insert_events', len(evts))
+
+    @dbus.service.method(SERVICE_INTERFACE, out_signature='a{sv}')
+    def get_writer_stats(self):
+        """ Returns the counters of the events write queue.
+
+        The result is a dictionary containing the current depth of the queue,
+        the counts of received, written and dropped events, of written
+        batches, of producer waits due to a full queue and of write errors.
+        """
+        return self._writer.get_stats()
+
+    @dbus.service.method(SERVICE_INTERFACE, out_signature='a{sv}')
+    def get_metrics(self):
+        """ Returns the metrics of the channel.
+
+        The result is a dictionary containing:
+
+            - service : the metrics of the D-Bus methods executed by the query
+              workers. For each method, the latency histograms (in seconds) of
+              the wait for a worker (<method>.wait), of the execution
+              (<method>.execute, including the conversion of the result to
+              D-Bus types) and of the reply (<method>.reply, including the
+              D-Bus serialization), and the counts of errors and timeouts
+            - dao : the metrics of the storage (inserted events count,
+              insert, flush latencies,... depending on the storage)
+            - writer : the counters of the events write queue (see get_writer_stats())
+
+        Metrics are dictionaries containing the uptime (in seconds), the
+        counters and the histograms summaries (count, sum, mean, max and
+        estimated percentiles).
+        """
+        return _as_dbus_value(self.get_metrics_snapshot())
+
+    def get_metrics_snapshot(self):
+        """ Returns the metrics of the channel as plain Python types (see get_metrics()).
+        """
+        return {
+            'service': self._metrics.snapshot(),
+            'dao': self._dao.metrics.snapshot(),
+            'writer': self._writer.get_stats(),
+        }
+
+    @dbus.service.method(SERVICE_INTERFACE, in_signature='b', out_signature='as')
+    def set_profiling(self, enabled):
+        """ Enables or disables the profiling of the service calls.
+
+        When disabled, the statistics collected so far are written in the
+        profiling directory, one file per method.
+
+        :param bool enabled: True for enabling the profiling
+        :returns: the list of the written statistics files
+        """
+        return self._profiler.set_enabled(bool(enabled))
+
+    @dbus.service.method(SERVICE_INTERFACE, out_signature='as')
+    def dump_profiles(self):
+        """ Writes the profiling statistics collected so far, without
+        disabling the profiling.
+
+        :returns: the list of the written statistics files
+        """
+        return self._profiler.dump()
+
+    @dbus.service.method(SERVICE_INTERFACE, out_signature='a{sv}')
+    def get_retention_report(self):
+        """ Returns the report of the retention policy enforcement.
+
+        For storages supporting it, the result is a dictionary containing the
+        policy settings, the count of runs, the time of the last one and its
+        duration, the cumulated counts of removed and downsampled days, of
+        reclaimed bytes and of discarded late events, and the current disk
+        usage. It is empty otherwise.
+        """
+        return dbus.Dictionary(self._dao.get_retention_report(), signature='sv')
+
+    @dbus.service.method(SERVICE_INTERFACE, out_signature='a{sv}')
+    def get_deadband_report(self):
+        """ Returns the report of the write side compression.
+
+        When a deadband policy is configured, the result is a dictionary
+        containing its rules, and the counts of stored and suppressed events,
+        globally and per variable (keyed by "var_type:var_name"). It is empty
+        otherwise.
+        """
+        return _as_dbus_value(self._dao.get_deadband_report())
 
     @dbus.service.method(SERVICE_INTERFACE, in_signature="nn", out_signature='as')
     def get_available_days(self, year=0, month=0):
@@ -152,10 +659,59 @@ class EventDatabaseObject(dbus.service.Object, Loggable):
 
         return result
 
+    @dbus.service.method(SERVICE_INTERFACE, in_signature='s', out_signature='a(sssva{sv})')
+    def get_last_values(self, pattern):
+        """ Returns the most recent event of each variable.
+
+        The result is maintained in memory by the storage, so that no query
+        is executed.
+
+        :param str pattern:
+            a variable type, or a glob pattern matched against the variable
+            types and the "var_type:var_name" keys (empty for all variables)
+
+        :returns: a list of events, as serializable tuples
+        :raises QueryError: if not supported by the storage
+        """
+        self.log_debug("get_last_values('%s') called", pattern)
+
+        try:
+            return [self._event_as_tuple(evt) for evt in self._dao.get_last_values(pattern or None)]
+        except NotImplementedError:
+            raise QueryError('last values not supported by the storage')
+
+    @dbus.service.method(SERVICE_INTERFACE,
+                         in_signature='nn',
+                         out_signature='a(sxx)',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def get_days_catalog(self, year, month, reply_handler, error_handler):
+        """ Returns the list of days for which events have been stored, with
+        their number of events and storage size.
+
+        :param int year: the year (0 if no filtering)
+        :param int month: the month number (1 <= month <= 12) or 0 if no
+            filtering on the month. Ignored if year is 0
+
+        :returns: a list of (day as "YYYY-MM-DD", events count, size in bytes)
+            tuples, counts and sizes being -1 if not known
+        :raises QueryTimeout: if the query exceeds the maximum execution time
+        """
+        self.log_debug("get_days_catalog(%d,%d) called", year, month)
+
+        time_line_filter = (int(year), int(month)) if year else None
+        self._run_query(
+            lambda deadline: [
+                (str(day), records, size)
+                for day, records, size in self._dao.get_days_catalog(time_line_filter)
+            ],
+            reply_handler, error_handler, 'get_days_catalog', year, month
+        )
+
     @dbus.service.method(SERVICE_INTERFACE,
                          in_signature='sss',
-                         out_signature='a(sssva{sv})')
-    def get_events_for_day(self, day, var_type=None, var_name=None):
+                         out_signature='a(sssva{sv})',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def get_events_for_day(self, day, var_type, var_name, reply_handler, error_handler):
         """ Returns the list of events matching the provided criteria.
 
         The result is an array of tuples representing the properties of the
@@ -172,60 +728,467 @@ class EventDatabaseObject(dbus.service.Object, Loggable):
             (optional) the var_name of events for filtering the returned list
 
         :returns: a list of events, as serializable tuples
+        :raises QueryTimeout: if the query exceeds the maximum execution time
         """
         self.log_debug("get_events_for_day('%s','%s','%s') called" %
                            (day, var_type, var_name))
 
-        return [(
-                    evt.timestamp.strftime(TIMESTAMP_FMT),
-                    evt.var_type,
-                    evt.var_name,
-                    evt.value,
-                    evt.data
-                )
-                for evt in self._dao.get_events_for_day(day, var_type, var_name)]
+        self._run_query(
+            lambda deadline: self._collect(self._dao.get_events_for_day(day, var_type, var_name), deadline),
+            reply_handler, error_handler, 'get_events_for_day', day, var_type, var_name
+        )
 
     @dbus.service.method(SERVICE_INTERFACE,
                          in_signature='a{sv}',
-                         out_signature='a(sssva{sv})')
-    def get_events(self, event_filter):
+                         out_signature='a(sssva{sv})',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def get_events(self, event_filter, reply_handler, error_handler):
         """ Returns the list of events matching the provided filter.
 
         Events are returned in D-Bus compatible format
 
         :param dict event_filter:
-            DAOs get_events() method keyword parameters as a dictionary
+            DAOs get_events() method keyword parameters as a dictionary. The
+            var_type and var_name entries can be lists and/or patterns, so that
+            the events of several variables are retrieved with a single query
 
         :returns: a list of events, as serializable tuples
+        :raises QueryTimeout: if the query exceeds the maximum execution time
         """
         self.log_debug("get_events(%s) called", event_filter)
 
+        kwargs = self._parse_filter(event_filter)
+        self._run_query(
+            lambda deadline: self._collect(self._dao.get_events(**kwargs), deadline),
+            reply_handler, error_handler, 'get_events', event_filter
+        )
+
+    @dbus.service.method(SERVICE_INTERFACE,
+                         in_signature='a{sv}',
+                         out_signature='a(sssvss)',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def get_value_intervals(self, event_filter, reply_handler, error_handler):
+        """ Returns the intervals during which the values of the variables
+        matching the provided filter remained valid.
+
+        With a deadband policy, a stored event stands for the suppressed ones
+        which followed it, its value being valid until the next stored event
+        of the variable or the expiration of its heartbeat period.
+
+        :param dict event_filter:
+            same as for get_events()
+
+        :returns: a list of (var_type, var_name, value, valid_from, valid_to)
+            tuples, times being formatted as the events timestamps and valid_to
+            being empty when not bounded
+        :raises QueryError: if the parameters are invalid
+        :raises QueryTimeout: if the query exceeds the maximum execution time
+        """
+        self.log_debug("get_value_intervals(%s) called", event_filter)
+
+        kwargs = self._parse_filter(event_filter)
+
+        def query(deadline):
+            result = []
+            for var_type, var_name, value, valid_from, valid_to in self._dao.get_value_intervals(**kwargs):
+                result.append((
+                    var_type, var_name, value,
+                    valid_from.strftime(TIMESTAMP_FMT),
+                    valid_to.strftime(TIMESTAMP_FMT) if valid_to else ''
+                ))
+                if deadline and time.time() > deadline:
+                    raise QueryTimeout('query execution time exceeded (max=%ds)' % self._query_timeout)
+            return result
+
+        self._run_query(query, reply_handler, error_handler, 'get_value_intervals', event_filter)
+
+    @dbus.service.method(SERVICE_INTERFACE,
+                         in_signature='a{sv}ass',
+                         out_signature='aav',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def get_records(self, event_filter, fields, ts_format, reply_handler, error_handler):
+        """ Returns the requested fields of the events matching the provided filter.
+
+        Only the requested fields are decoded by the storage, which makes it
+        much faster than get_events() when the additional data are not needed.
+
+        :param dict event_filter:
+            same as for get_events()
+        :param list fields:
+            the requested fields, among ts, var_type, var_name, value and data,
+            in the order they must appear in the records (all of them if empty)
+        :param str ts_format:
+            the form of the timestamps : "text" (default) for the same format
+            as get_events(), "epoch" for milliseconds since the epoch, or "raw"
+            for the storage native form
+
+        :returns: a list of records, as arrays of the requested fields values
+        :raises QueryError: if the parameters are invalid
+        :raises QueryTimeout: if the query exceeds the maximum execution time
+        """
+        self.log_debug("get_records(%s,%s,%s) called", event_filter, fields, ts_format)
+
+        kwargs = self._parse_filter(event_filter)
+        fields = [str(f) for f in fields] or list(evtdao.RECORD_FIELDS)
+        ts_format = str(ts_format) or evtdao.TS_TEXT
+        if ts_format == evtdao.TS_DATETIME:
+            raise QueryError('unsupported timestamp format : %s' % ts_format)
+
+        converters = {
+            evtdao.FIELD_TS: dbus.Int64 if ts_format == evtdao.TS_EPOCH else str,
+            evtdao.FIELD_DATA: lambda d: dbus.Dictionary(d, signature='sv'),
+        }
+        converters = [converters.get(f, lambda v: v) for f in fields]
+
+        def query(deadline):
+            result = []
+            try:
+                for record in self._dao.get_records(fields=fields, ts_format=ts_format, **kwargs):
+                    result.append([convert(v) for convert, v in zip(converters, record)])
+                    if deadline and time.time() > deadline:
+                        raise QueryTimeout('query execution time exceeded (max=%ds)' % self._query_timeout)
+            except ValueError as e:
+                raise QueryError(str(e))
+            return result
+
+        self._run_query(query, reply_handler, error_handler, 'get_records', event_filter, fields, ts_format)
+
+    @dbus.service.method(SERVICE_INTERFACE,
+                         in_signature='a{sv}sh',
+                         out_signature='t',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def export_events(self, event_filter, fmt, fd, reply_handler, error_handler):
+        """ Writes the events matching the provided filter to a file descriptor
+        passed by the caller (the write end of a pipe, or a file opened for
+        writing).
+
+        The events are streamed by chunks, instead of being returned as D-Bus
+        structures, which makes it suitable for bulk extractions. The file
+        descriptor is closed once the export is complete.
+
+        :param dict event_filter:
+            same as for get_events()
+        :param str fmt:
+            the export format: "ndjson", "csv" or "raw" (see pycstbox.evtdao.export)
+        :param fd:
+            the file descriptor (UNIX fd passing)
+
+        :returns: the number of written bytes
+        :raises QueryError: if the parameters are invalid or if the output
+            cannot be written (reader closed f.i.)
+        :raises QueryTimeout: if the export exceeds the maximum execution time
+        """
+        self.log_debug("export_events(%s,%s) called", event_filter, fmt)
+
+        fmt = str(fmt)
+        if fmt not in export.EXPORT_FORMATS:
+            raise QueryError('unsupported export format : %s' % fmt)
+        kwargs = self._parse_filter(event_filter)
+
+        # take the ownership of the descriptor, so that it stays open after the
+        # call returns. It must be closed from now on, whatever happens.
+        fd = fd.take()
+
+        def query(deadline):
+            try:
+                return export.export_events(self._dao, fd, fmt, deadline=deadline, **kwargs)
+            except export.ExportTimeout:
+                raise QueryTimeout('query execution time exceeded (max=%ds)' % self._query_timeout)
+            except export.ExportError as e:
+                raise QueryError('export aborted (%s)' % e)
+            finally:
+                os.close(fd)
+
+        try:
+            self._run_query(query, reply_handler, error_handler, 'export_events', event_filter, fmt)
+        except Exception:
+            os.close(fd)
+            raise
+
+    @dbus.service.method(SERVICE_INTERFACE,
+                         in_signature='sssuas',
+                         out_signature='a(sa{sd})',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def get_aggregates(self, var_name, from_time, to_time, bucket_seconds, functions,
+                       reply_handler, error_handler):
+        """ Returns statistics of the values of a variable over time buckets.
+
+        They are computed inside the daemon, so that only the results are sent
+        back instead of the raw events.
+
+        :param str var_name: the name of the variable
+        :param str from_time: inclusive lower bound of the time span (empty if none)
+        :param str to_time: inclusive upper bound of the time span (empty if none)
+        :param int bucket_seconds: the duration of the buckets, in seconds
+        :param list functions: the aggregation functions to be computed, among
+            min, max, mean, count, first and last (all of them if empty)
+
+        :returns: a list of (bucket start time, {function: result}) tuples,
+            sorted by bucket start time. Buckets without values are omitted.
+        :raises QueryError: if the parameters are invalid
+        :raises QueryTimeout: if the query exceeds the maximum execution time
+        """
+        self.log_debug("get_aggregates(%s,%s,%s,%s,%s) called",
+                       var_name, from_time, to_time, bucket_seconds, functions)
+
+        try:
+            from_time = dateutil.parser.parse(from_time) if from_time else None
+            to_time = dateutil.parser.parse(to_time) if to_time else None
+        except ValueError as e:
+            raise QueryError('invalid time bound (%s)' % e)
+        functions = [str(f) for f in functions] or list(evtdao.AGG_FUNCTIONS)
+
+        def query(deadline):
+            try:
+                aggregates = self._dao.get_aggregates(
+                    var_name, from_time, to_time, bucket_seconds, functions
+                )
+            except ValueError as e:
+                raise QueryError(str(e))
+            return [
+                (bucket.strftime(TIMESTAMP_FMT),
+                 dbus.Dictionary(
+                     {f: float(v) for f, v in results.iteritems() if v is not None},
+                     signature='sd'
+                 ))
+                for bucket, results in aggregates
+            ]
+
+        self._run_query(
+            query, reply_handler, error_handler,
+            'get_aggregates', var_name, from_time, to_time, bucket_seconds, functions
+        )
+
+    @dbus.service.method(SERVICE_INTERFACE,
+                         in_signature='s',
+                         out_signature='a(ss)',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def get_variables_for_day(self, day, reply_handler, error_handler):
+        """ Returns the variables for which events have been stored a given day.
+
+        :param str day: the date of the day (as a valid SQL date)
+
+        :returns: a list of (var_type, var_name) tuples, sorted by type and name
+        :raises QueryTimeout: if the query exceeds the maximum execution time
+        """
+        self.log_debug("get_variables_for_day('%s') called", day)
+
+        self._run_query(
+            lambda deadline: self._dao.get_variables_for_day(day),
+            reply_handler, error_handler, 'get_variables_for_day', day
+        )
+
+    @dbus.service.method(SERVICE_INTERFACE,
+                         in_signature='a{sv}',
+                         out_signature='s')
+    def open_query(self, event_filter):
+        """ Opens a query cursor for the events matching the provided filter.
+
+        The events are then retrieved by successive calls to fetch(), so that
+        the memory used on both sides is bounded by the size of the pages,
+        whatever the extent of the query is.
+
+        Cursors which stay idle for too long are discarded, and the number of
+        simultaneously opened cursors is limited.
+
+        :param dict event_filter:
+            same as for get_events()
+
+        :returns: the cursor id, to be used for fetch() and close_query() calls
+        :raises QueryError: if the maximum number of opened cursors is reached
+        """
+        self.log_debug("open_query(%s) called", event_filter)
+
+        self._discard_idle_cursors()
+        if len(self._cursors) >= self._max_cursors:
+            raise QueryError('too many opened queries (max=%d)' % self._max_cursors)
+
+        query_id = uuid.uuid4().hex
+        self._cursors[query_id] = _QueryCursor(
+            self._dao.get_events(**self._parse_filter(event_filter)), event_filter
+        )
+        return query_id
+
+    @dbus.service.method(SERVICE_INTERFACE,
+                         in_signature='su',
+                         out_signature='a(sssva{sv})',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def fetch(self, query_id, max_count, reply_handler, error_handler):
+        """ Returns the next page of events of a query opened by open_query().
+
+        A page containing less than the requested count of events means that
+        the query is exhausted. Its cursor is then automatically closed. It
+        is closed too if the page cannot be produced within the maximum query
+        execution time.
+
+        :param str query_id: the cursor id, as returned by open_query()
+        :param int max_count: the maximum number of events to be returned
+
+        :returns: a list of events, as serializable tuples
+        :raises QueryError: if the cursor does not exist, has expired or is
+            already busy with a previous fetch
+        :raises QueryTimeout: if the query exceeds the maximum execution time
+        """
+        self._discard_idle_cursors()
+        cursor = self._get_cursor(query_id)
+        if cursor.busy:
+            raise QueryError('query %s is busy' % query_id)
+        cursor.busy = True
+
+        def on_reply(result):
+            cursor.busy = False
+            cursor.last_access = time.time()
+            if len(result) < max_count:
+                self._close_cursor(query_id)
+            reply_handler(result)
+
+        def on_error(e):
+            cursor.busy = False
+            self._close_cursor(query_id)
+            error_handler(e)
+
+        self._run_query(
+            lambda deadline: self._collect(cursor.next_events(max_count), deadline),
+            on_reply, on_error, 'fetch', cursor.event_filter, max_count
+        )
+
+    @dbus.service.method(SERVICE_INTERFACE, in_signature='s')
+    def close_query(self, query_id):
+        """ Closes a query opened by open_query() before it is exhausted.
+
+        :param str query_id: the cursor id, as returned by open_query()
+        :raises QueryError: if the cursor does not exist or has expired
+        """
+        self._get_cursor(query_id)
+        self._close_cursor(query_id)
+
+    def _get_cursor(self, query_id):
+        try:
+            return self._cursors[query_id]
+        except KeyError:
+            raise QueryError('unknown or expired query id : %s' % query_id)
+
+    def _close_cursor(self, query_id):
+        cursor = self._cursors.pop(query_id, None)
+        if cursor:
+            cursor.close()
+
+    def _discard_idle_cursors(self):
+        limit = time.time() - self._cursor_timeout
+        for query_id in [k for k, c in self._cursors.iteritems() if c.last_access < limit and not c.busy]:
+            self.log_info('discarding idle query cursor %s', query_id)
+            self._close_cursor(query_id)
+
+    def _run_query(self, query, reply_handler, error_handler, name, *args):
+        """ Executes a query in the worker threads pool and sends its result
+        as the reply of the D-Bus method call.
+
+        Replies are sent from the main loop, so that the D-Bus connection is
+        only used from there.
+
+        The time spent waiting for a worker, executing the query and sending
+        the reply (which includes the D-Bus serialization of the result) are
+        recorded in the metrics, under the name of the method.
+
+        :param callable query: the function computing the result. It is passed
+            the deadline (as a time.time() value) beyond which it must give up
+        :param callable reply_handler: the D-Bus method reply callback
+        :param callable error_handler: the D-Bus method error callback
+        :param str name: the name of the method, used for the metrics and the profiling
+        :param args: the method arguments, logged if the call is slow
+        """
+        submitted = time.time()
+        deadline = submitted + self._query_timeout if self._query_timeout else None
+        metrics = self._metrics
+
+        def reply(result):
+            with metrics.timed(name + '.reply'):
+                reply_handler(result)
+
+        def execute():
+            started = time.time()
+            metrics.observe(name + '.wait', started - submitted)
+            try:
+                result = self._profiler.call(name, args, query, deadline)
+            except Exception as e: #pylint: disable=W0703
+                metrics.inc(name + ('.timeouts' if isinstance(e, QueryTimeout) else '.errors'))
+                if not isinstance(e, QueryError):
+                    self.log_exception(e)
+                gobject.idle_add(error_handler, e)
+            else:
+                metrics.observe(name + '.execute', time.time() - started)
+                gobject.idle_add(reply, result)
+
+        self._query_pool.apply_async(execute)
+
+    def _collect(self, evts, deadline):
+        """ Returns the D-Bus compatible representation of the events produced
+        by an iterable, checking the deadline while iterating.
+
+        :raises QueryTimeout: if the deadline is exceeded
+        """
+        result = []
+        for evt in evts:
+            result.append(self._event_as_tuple(evt))
+            if deadline and time.time() > deadline:
+                raise QueryTimeout('query execution time exceeded (max=%ds)' % self._query_timeout)
+        return result
+
+    @staticmethod
+    def _parse_filter(event_filter):
+        """ Converts a D-Bus events filter into DAO get_events() keyword parameters.
+
+        Variable types and names can be given as a single string or as a list
+        of strings, each of them being an exact name, a glob pattern or a
+        regular expression (see evtdao.VarFilter).
+
+        :raises QueryError: if a variable filter is invalid
+        """
         if FILTER_FROM_TIME in event_filter:
             from_time = dateutil.parser.parse(event_filter[FILTER_FROM_TIME])
-            from_day = from_time.date()
         else:
-            from_time = from_day = None
+            from_time = None
 
         if FILTER_TO_TIME in event_filter:
             to_time = dateutil.parser.parse(event_filter[FILTER_TO_TIME])
-            to_day = to_time.date()
         else:
-            to_time = to_day = None
-
-        return [(
-                    evt.timestamp.strftime(TIMESTAMP_FMT),
-                    evt.var_type,
-                    evt.var_name,
-                    evt.value,
-                    evt.data
-                )
-                for evt in
-                self._dao.get_events(
-                    from_time=from_time,
-                    to_time=to_time,
-                    var_type=event_filter.get(FILTER_VAR_TYPE, None),
-                    var_name=event_filter.get(FILTER_VAR_NAME, None)
-                )]
+            to_time = None
+
+        try:
+            var_type = evtdao.VarFilter.from_spec(event_filter.get(FILTER_VAR_TYPE, None))
+            var_name = evtdao.VarFilter.from_spec(event_filter.get(FILTER_VAR_NAME, None))
+        except (ValueError, TypeError) as e:
+            raise QueryError(str(e))
+
+        return {
+            'from_time': from_time,
+            'to_time': to_time,
+            'var_type': var_type,
+            'var_name': var_name
+        }
+
+    @staticmethod
+    def _event_as_tuple(evt):
+        """ Returns the D-Bus compatible representation of an event.
+        """
+        return (
+            evt.timestamp.strftime(TIMESTAMP_FMT),
+            evt.var_type,
+            evt.var_name,
+            evt.value,
+            evt.data
+        )
+
+
+def _as_dbus_value(value):
+    """ Returns the D-Bus compatible representation of a metrics structure.
+
+    Dictionaries are converted to string keyed variant dictionaries, so that
+    their values can be of mixed types.
+    """
+    if isinstance(value, dict):
+        return dbus.Dictionary({str(k): _as_dbus_value(v) for k, v in value.iteritems()}, signature='sv')
+    return value
 
 
 def get_object(channel):
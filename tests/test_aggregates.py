@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests of the aggregation of the variable values over time buckets.
+"""
+
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from pycstbox import evtdao
+from pycstbox import sysutils
+from pycstbox.evtdao.sqlite.dao_sqlite import EventsDAO
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+
+class AggregateTestCase(unittest.TestCase):
+    def test_unordered_values(self):
+        agg = evtdao.Aggregate()
+        for ts, value in [(3, 5.), (1, 2.), (2, 8.), (5, 1.)]:
+            agg.add(ts, value)
+        self.assertEqual(agg.result(), {
+            evtdao.AGG_MIN: 1., evtdao.AGG_MAX: 8., evtdao.AGG_MEAN: 4., evtdao.AGG_COUNT: 4,
+            evtdao.AGG_FIRST: 2., evtdao.AGG_LAST: 1.
+        })
+
+    def test_merge(self):
+        agg, other, merged = evtdao.Aggregate(), evtdao.Aggregate(), evtdao.Aggregate()
+        for ts, value in [(3, 5.), (6, 2.)]:
+            agg.add(ts, value)
+            merged.add(ts, value)
+        for ts, value in [(1, 7.), (4, -1.)]:
+            other.add(ts, value)
+            merged.add(ts, value)
+        agg.merge(other)
+        agg.merge(evtdao.Aggregate())
+        self.assertEqual(agg.as_list(), merged.as_list())
+        self.assertEqual(evtdao.Aggregate.from_list(agg.as_list()).result(), merged.result())
+
+
+class GetAggregatesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        self.dao = EventsDAO('sensor', {evtdao.CFGKEY_EVTS_DB_HOME_DIR: self.home})
+        self.dao.open()
+        start_ms = sysutils.to_milliseconds(datetime(2017, 7, 14))
+        # a value every 10 minutes during 3 hours, with a non numeric one
+        self.dao.insert_events(
+            [(start_ms + i * 600000, 'temperature', 't1', {'value': float(i)}) for i in xrange(18)] +
+            [(start_ms + 60000, 'temperature', 't1', {'value': 'n/a'}),
+             (start_ms, 'temperature', 't2', {'value': 100.})]
+        )
+
+    def tearDown(self):
+        self.dao.close()
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def test_buckets(self):
+        result = self.dao.get_aggregates('t1', bucket_seconds=3600)
+        self.assertEqual([ts for ts, _ in result], [
+            datetime(2017, 7, 14, 0), datetime(2017, 7, 14, 1), datetime(2017, 7, 14, 2)
+        ])
+        self.assertEqual(result[1][1], {
+            evtdao.AGG_MIN: 6., evtdao.AGG_MAX: 11., evtdao.AGG_MEAN: 8.5, evtdao.AGG_COUNT: 6,
+            evtdao.AGG_FIRST: 6., evtdao.AGG_LAST: 11.
+        })
+
+    def test_time_span_and_functions(self):
+        result = self.dao.get_aggregates(
+            't1', datetime(2017, 7, 14, 0, 30), datetime(2017, 7, 14, 1, 30),
+            bucket_seconds=86400, functions=(evtdao.AGG_COUNT, evtdao.AGG_MEAN)
+        )
+        self.assertEqual(result, [(datetime(2017, 7, 14), {evtdao.AGG_COUNT: 7, evtdao.AGG_MEAN: 6.})])
+
+    def test_invalid_arguments(self):
+        self.assertRaises(ValueError, self.dao.get_aggregates, 't1', bucket_seconds=0)
+        self.assertRaises(ValueError, self.dao.get_aggregates, 't1', functions=('median',))
+
+
+if __name__ == '__main__':
+    unittest.main()
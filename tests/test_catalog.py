@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests of the days catalog of the file based DAO.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from datetime import date, datetime
+
+from pycstbox import evtdao
+from pycstbox import sysutils
+from pycstbox.evtdao.fsys.dao_fsys import EventsDAO
+from pycstbox.evtdao.fsys.catalog import DayCatalog, UNKNOWN
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+
+class DayCatalogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        # the signatures of the day files, as returned by the scanner
+        self.days = {
+            date(2017, 7, 14): [('170714.evt-log', 1, 1)],
+            date(2017, 7, 15): [('170715.evt-log', 1, 1)],
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def scanner(self):
+        return dict(self.days)
+
+    def test_round_trip(self):
+        catalog = DayCatalog(self.scanner)
+        catalog.refresh()
+        catalog.set_info(date(2017, 7, 14), 100, 4000)
+        path = os.path.join(self.home, 'catalog.dat')
+        catalog.save(path)
+
+        loaded = DayCatalog(self.scanner)
+        loaded.refresh()
+        loaded.load(path)
+        self.assertEqual(loaded.get_info(date(2017, 7, 14)), (100, 4000))
+        self.assertEqual(loaded.get_info(date(2017, 7, 15)), (UNKNOWN, UNKNOWN))
+        self.assertEqual(loaded.select(), [date(2017, 7, 14), date(2017, 7, 15)])
+
+    def test_selections(self):
+        self.days[date(2017, 8, 1)] = [('170801.evt-log', 1, 1)]
+        catalog = DayCatalog(self.scanner)
+        catalog.refresh()
+        self.assertEqual(catalog.select(from_day=date(2017, 7, 15)), [date(2017, 7, 15), date(2017, 8, 1)])
+        self.assertEqual(catalog.select(to_day=date(2017, 7, 15)), [date(2017, 7, 14), date(2017, 7, 15)])
+        self.assertEqual(catalog.select_month(2017, 8), [date(2017, 8, 1)])
+
+    def test_modified_day_is_reset(self):
+        catalog = DayCatalog(self.scanner)
+        catalog.refresh()
+        catalog.set_info(date(2017, 7, 14), 100, 4000)
+        self.days[date(2017, 7, 14)] = [('170714.evt-log', 2, 2)]
+        self.days[date(2017, 7, 16)] = [('170716.evt-log', 1, 1)]
+        catalog.refresh()
+        self.assertEqual(catalog.get_info(date(2017, 7, 14)), (UNKNOWN, UNKNOWN))
+        self.assertEqual(len(catalog.select()), 3)
+
+    def test_tracked_catalog_is_not_rescanned(self):
+        catalog = DayCatalog(self.scanner, tracked=True)
+        catalog.refresh()
+        self.days[date(2017, 7, 16)] = [('170716.evt-log', 1, 1)]
+        catalog.refresh()
+        self.assertEqual(len(catalog.select()), 2)
+        catalog.add(date(2017, 7, 16))
+        catalog.remove(date(2017, 7, 14))
+        self.assertEqual(catalog.select(), [date(2017, 7, 15), date(2017, 7, 16)])
+
+    def test_invalid_content(self):
+        path = os.path.join(self.home, 'catalog.dat')
+        with open(path, 'w') as fp:
+            json.dump({'170714': 'x'}, fp)
+        catalog = DayCatalog(self.scanner)
+        catalog.refresh()
+        self.assertRaises(ValueError, catalog.load, path)
+
+    def test_reader_sees_the_new_days(self):
+        config = {evtdao.CFGKEY_EVTS_DB_HOME_DIR: self.home}
+        writer = EventsDAO('sensor', config)
+        reader = EventsDAO('sensor', config, readonly=True)
+        self.assertEqual(list(reader.get_available_days()), [])
+        writer.insert_events([
+            (sysutils.to_milliseconds(datetime(2017, 7, day)), 'temperature', 't1', {'value': day})
+            for day in (14, 16)
+        ])
+        writer.flush()
+        self.assertEqual(list(writer.get_available_days()), [date(2017, 7, 14), date(2017, 7, 16)])
+        self.assertEqual(list(reader.get_available_days()), [date(2017, 7, 14), date(2017, 7, 16)])
+        writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
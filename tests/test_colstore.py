@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests of the binary columnar storage DAO.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date, datetime
+
+from pycstbox import evtdao
+from pycstbox import sysutils
+from pycstbox.evtdao.colstore.dao_colstore import EventsDAO
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+
+class ColumnStoreTestCase(unittest.TestCase):
+    DAY = date(2017, 7, 14)
+    START_MS = sysutils.to_milliseconds(datetime(2017, 7, 14))
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        self.config = {evtdao.CFGKEY_EVTS_DB_HOME_DIR: self.home}
+        # 1000 events of 10 variables over two days, with values of all the
+        # supported types (strings being restored as unicode ones)
+        values = [12.5, 3, True, u'on', -7, 0.1, False, 2 ** 60, None]
+        self.evts = []
+        for i in xrange(1000):
+            data = {'value': values[i % len(values)]}
+            if i % 3:
+                data['unit'] = 'C'
+            self.evts.append(
+                (self.START_MS + i * 172800, 'temperature' if i % 2 else 'switch', 'v%d' % (i % 5), data)
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def store(self, evts, **config):
+        dao = EventsDAO('sensor', dict(self.config, **config))
+        dao.insert_events([(ms, vt, vn, dict(data)) for ms, vt, vn, data in evts])
+        dao.close()
+
+    def read_back(self, evts):
+        return [(sysutils.to_milliseconds(e.timestamp), e.var_type, e.var_name, dict(e.data)) for e in evts]
+
+    def test_round_trip(self):
+        self.store(self.evts)
+        dao = EventsDAO('sensor', self.config, readonly=True)
+        self.assertEqual(self.read_back(dao.get_events()), self.evts)
+        self.assertEqual(list(dao.get_available_days()), [self.DAY, date(2017, 7, 15)])
+
+    def test_value_types(self):
+        self.store(self.evts[:9])
+        dao = EventsDAO('sensor', self.config, readonly=True)
+        self.assertEqual(
+            [(e.value, type(e.value)) for e in dao.get_events()],
+            [(data['value'], type(data['value'])) for _, _, _, data in self.evts[:9]]
+        )
+
+    def test_filters(self):
+        self.store(self.evts)
+        dao = EventsDAO('sensor', self.config, readonly=True)
+        from_time = datetime(2017, 7, 14, 12)
+        to_time = datetime(2017, 7, 15, 6)
+        from_ms, to_ms = sysutils.to_milliseconds(from_time), sysutils.to_milliseconds(to_time)
+        self.assertEqual(
+            self.read_back(dao.get_events(from_time, to_time, var_name=['v1', 'v3'])),
+            [e for e in self.evts if e[2] in ('v1', 'v3') and from_ms <= e[0] <= to_ms]
+        )
+        self.assertEqual(
+            self.read_back(dao.get_events_for_day(self.DAY, var_type='switch')),
+            [e for e in self.evts if e[1] == 'switch' and e[0] < self.START_MS + 86400000]
+        )
+
+    def test_records(self):
+        self.store(self.evts)
+        dao = EventsDAO('sensor', self.config, readonly=True)
+        self.assertEqual(
+            list(dao.get_records(fields=(evtdao.FIELD_VAR_NAME, evtdao.FIELD_VALUE), ts_format=evtdao.TS_EPOCH)),
+            [[vn, data['value']] for _, _, vn, data in self.evts]
+        )
+
+    def test_appends(self):
+        self.store(self.evts[:400])
+        self.store(self.evts[400:])
+        dao = EventsDAO('sensor', self.config, readonly=True)
+        self.assertEqual(self.read_back(dao.get_events()), self.evts)
+
+    def test_pending_rows_are_returned(self):
+        dao = EventsDAO('sensor', dict(self.config, **{evtdao.CFGKEY_FLASH_MEM_SUPPORT: True}))
+        dao.insert_events([(ms, vt, vn, dict(data)) for ms, vt, vn, data in self.evts[:500]])
+        dao.flush()
+        dao.insert_events([(ms, vt, vn, dict(data)) for ms, vt, vn, data in self.evts[500:]])
+        self.assertEqual(self.read_back(dao.get_events()), self.evts)
+        dao.close()
+
+    def test_interrupted_commit_is_repaired(self):
+        first_day = [e for e in self.evts if e[0] < self.START_MS + 86400000]
+        self.store(first_day)
+        # simulate a commit interrupted after the timestamps of variable 0 were written
+        ts_path = os.path.join(self.home, 'sensor', '170714', '0.ts')
+        with open(ts_path, 'ab') as fp:
+            fp.write('\0' * 8 * 3)
+
+        # the day is repaired when opened again for writing
+        late = (self.START_MS + 1000, 'switch', 'v9', {'value': 1})
+        self.store([late])
+        dao = EventsDAO('sensor', self.config, readonly=True)
+        self.assertEqual(self.read_back(dao.get_events()), sorted(first_day + [late]))
+        self.assertEqual(os.path.getsize(ts_path), os.path.getsize(ts_path[:-len('.ts')] + '.val'))
+
+    def test_type_tags_are_required(self):
+        self.store(self.evts[:10])
+        os.remove(os.path.join(self.home, 'sensor', '170714', '0.typ'))
+        dao = EventsDAO('sensor', self.config, readonly=True)
+        self.assertEqual(self.read_back(dao.get_events()), [e for e in self.evts[:10] if e[1:3] != ('switch', 'v0')])
+
+    def test_last_values(self):
+        dao = EventsDAO('sensor', self.config)
+        dao.open()
+        dao.insert_events([(ms, vt, vn, dict(data)) for ms, vt, vn, data in self.evts[:600]])
+        # a late event, which is not the latest one of its variable
+        dao.insert_events([(self.START_MS + 1, 'switch', 'v0', {'value': 0})])
+        # a variable only present in the first day
+        dao.insert_events([(self.START_MS + 2, 'switch', 'old', {'value': 1.5})])
+        dao.insert_events([(ms, vt, vn, dict(data)) for ms, vt, vn, data in self.evts[600:]])
+        last = {}
+        for msecs, var_type, var_name, data in self.evts + [(self.START_MS + 2, 'switch', 'old', {'value': 1.5})]:
+            if (var_type, var_name) not in last or msecs >= last[(var_type, var_name)][0]:
+                last[(var_type, var_name)] = (msecs, var_type, var_name, data)
+        expected = [last[key] for key in sorted(last)]
+
+        self.assertEqual(self.read_back(dao.get_last_values()), expected)
+        self.assertEqual(
+            self.read_back(dao.get_last_values('switch')), [e for e in expected if e[1] == 'switch']
+        )
+        dao.close()
+
+        # searched in the stored days when not maintained by the writes
+        dao = EventsDAO('sensor', self.config, readonly=True)
+        self.assertEqual(self.read_back(dao.get_last_values()), expected)
+        self.assertEqual(self.read_back(dao.get_last_values('*:old')), [last[('switch', 'old')]])
+
+    def test_last_values_seeded_when_opened(self):
+        self.store(self.evts)
+        dao = EventsDAO('sensor', self.config)
+        dao.open()
+        dao.insert_events([(self.START_MS, 'switch', 'v1', {'value': 1})])
+        self.assertEqual(
+            self.read_back(dao.get_last_values('switch:v1')),
+            [[e for e in self.evts if e[1:3] == ('switch', 'v1')][-1]]
+        )
+        dao.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests of the day files sidecar index of the file based DAO.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from datetime import date, datetime
+
+from pycstbox import evtdao
+from pycstbox import sysutils
+from pycstbox.evtdao.fsys.dao_fsys import EventsDAO
+from pycstbox.evtdao.fsys.dayindex import DayIndex, INDEX_FILE_EXT, read_ranges
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+
+class DayIndexTestCase(unittest.TestCase):
+    DAY = date(2017, 7, 14)
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        start_ms = sysutils.to_milliseconds(datetime(2017, 7, 14))
+        # 2000 events of 10 variables, every 43.2 seconds
+        self.evts = [
+            (start_ms + i * 43200, 'temperature' if i % 2 else 'humidity', 'v%d' % (i % 5),
+             {'value': i % 100, 'unit': 'C'})
+            for i in xrange(2000)
+        ]
+        dao = EventsDAO('sensor', {evtdao.CFGKEY_EVTS_DB_HOME_DIR: self.home})
+        dao.insert_events([(ms, vt, vn, dict(data)) for ms, vt, vn, data in self.evts])
+        dao.close()
+        self.data_path = os.path.join(self.home, 'sensor', '170714.evt-log')
+        self.index = DayIndex.load(os.path.join(self.home, 'sensor', '170714' + INDEX_FILE_EXT))
+
+    def tearDown(self):
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def test_round_trip(self):
+        path = os.path.join(self.home, 'test' + INDEX_FILE_EXT)
+        self.index.save(path)
+        self.assertEqual(DayIndex.load(path).as_dict(), self.index.as_dict())
+
+    def test_maintained_index_matches_rebuilt_one(self):
+        rebuilt = DayIndex()
+        with open(self.data_path) as fp:
+            self.assertEqual(rebuilt.update_from(fp), 2000)
+        self.assertEqual(rebuilt.as_dict(), self.index.as_dict())
+
+    def test_catch_up(self):
+        partial = DayIndex()
+        with open(self.data_path) as fp:
+            partial.update_from(fp)
+            # a record being written by another process is not indexed
+            with open(self.data_path, 'a') as out:
+                out.write('170714-235959.000\thumidity\tv0')
+            self.assertEqual(partial.update_from(fp), 0)
+        self.assertEqual(partial.as_dict(), self.index.as_dict())
+
+    def test_ranges_contain_the_variable_records(self):
+        with open(self.data_path) as fp:
+            expected = [r for r in fp if r.split('\t')[2] == 'v3']
+            ranges = self.index.ranges_for(var_name=evtdao.VarFilter.from_spec('v3'))
+            selected = [r for r in read_ranges(fp, ranges) if r.split('\t')[2] == 'v3']
+        self.assertEqual(selected, expected)
+
+    def test_invalid_content(self):
+        path = os.path.join(self.home, 'test' + INDEX_FILE_EXT)
+        with open(path, 'w') as fp:
+            json.dump({'size': 0}, fp)
+        self.assertRaises(ValueError, DayIndex.load, path)
+
+    def test_indexed_reads(self):
+        dao = EventsDAO('sensor', {evtdao.CFGKEY_EVTS_DB_HOME_DIR: self.home}, readonly=True)
+        for var_type, var_name in [(None, 'v2'), ('humidity', None), ('temperature', 'v3')]:
+            self.assertEqual(
+                [(sysutils.to_milliseconds(e.timestamp), e.var_type, e.var_name, e.value)
+                 for e in dao.get_events_for_day(self.DAY, var_type, var_name)],
+                # the file based DAO stores the values as strings
+                [(ms, vt, vn, str(data['value'])) for ms, vt, vn, data in self.evts
+                 if (not var_type or vt == var_type) and (not var_name or vn == var_name)]
+            )
+
+    def test_time_bounded_reads(self):
+        dao = EventsDAO('sensor', {evtdao.CFGKEY_EVTS_DB_HOME_DIR: self.home}, readonly=True)
+        from_time = datetime(2017, 7, 14, 6, 17, 3)
+        to_time = datetime(2017, 7, 14, 15, 40)
+        from_ms, to_ms = sysutils.to_milliseconds(from_time), sysutils.to_milliseconds(to_time)
+        for var_name in (None, 'v1'):
+            self.assertEqual(
+                [(sysutils.to_milliseconds(e.timestamp), e.var_name)
+                 for e in dao.get_events(from_time, to_time, var_name=var_name)],
+                [(ms, vn) for ms, _, vn, _ in self.evts
+                 if from_ms <= ms <= to_ms and (not var_name or vn == var_name)]
+            )
+
+    def test_late_records(self):
+        # records appended out of chronological order must be found by the
+        # time bounded reads
+        late_ms = sysutils.to_milliseconds(datetime(2017, 7, 14, 1, 0, 0, 500000))
+        dao = EventsDAO('sensor', {evtdao.CFGKEY_EVTS_DB_HOME_DIR: self.home})
+        dao.insert_events([(late_ms, 'humidity', 'late', {'value': 1})])
+        dao.close()
+
+        dao = EventsDAO('sensor', {evtdao.CFGKEY_EVTS_DB_HOME_DIR: self.home}, readonly=True)
+        evts = list(dao.get_events(datetime(2017, 7, 14, 1), datetime(2017, 7, 14, 1, 0, 1)))
+        self.assertEqual([e.var_name for e in evts], ['late'])
+
+
+if __name__ == '__main__':
+    unittest.main()
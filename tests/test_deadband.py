@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests of the write side compression of the events.
+"""
+
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from pycstbox import evtdao
+from pycstbox import sysutils
+from pycstbox.evtdao.deadband import DeadbandRule, DeadbandPolicy
+from pycstbox.evtdao.fsys import dao_fsys
+from pycstbox.evtdao.sqlite import dao_sqlite
+from pycstbox.evtdao.colstore import dao_colstore
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+
+class DeadbandRuleTestCase(unittest.TestCase):
+    def test_from_string(self):
+        rule = DeadbandRule.from_spec('temperature, abs=0.5, rel=0.01, max_silence=600')
+        self.assertEqual(
+            (rule.pattern, rule.abs_deadband, rule.rel_deadband, rule.max_silence),
+            ('temperature', 0.5, 0.01, 600.)
+        )
+        self.assertEqual(str(rule), 'temperature,abs=0.5,rel=0.01,max_silence=600')
+
+    def test_from_dict(self):
+        rule = DeadbandRule.from_spec({'pattern': 'switch:*'})
+        self.assertEqual((rule.abs_deadband, rule.rel_deadband, rule.max_silence), (0., 0., None))
+
+    def test_invalid(self):
+        for spec in ('temperature,abs', 'temperature,foo=1', 'temperature,abs=x', 'temperature,abs=-1', {}, 42):
+            self.assertRaises(ValueError, DeadbandRule.from_spec, spec)
+
+    def test_matches(self):
+        rule = DeadbandRule('temp*')
+        self.assertTrue(rule.matches('temperature', 'temperature:t1'))
+        self.assertFalse(rule.matches('humidity', 'humidity:temp'))
+        rule = DeadbandRule('switch:s?')
+        self.assertTrue(rule.matches('switch', 'switch:s1'))
+        self.assertFalse(rule.matches('switch', 'switch:s10'))
+
+    def test_abs_deadband(self):
+        rule = DeadbandRule('*', abs_deadband=0.5)
+        self.assertFalse(rule.is_significant(1000, 20., 20., 20.5, 20.5))
+        self.assertTrue(rule.is_significant(1000, 20., 20., 20.6, 20.6))
+        self.assertTrue(rule.is_significant(1000, 20., 20., 19.4, 19.4))
+
+    def test_rel_deadband(self):
+        rule = DeadbandRule('*', abs_deadband=0.1, rel_deadband=0.01)
+        # the largest deadband applies
+        self.assertFalse(rule.is_significant(1000, 100., 100., 100.9, 100.9))
+        self.assertTrue(rule.is_significant(1000, 100., 100., 101.1, 101.1))
+        self.assertTrue(rule.is_significant(1000, 1., 1., 1.2, 1.2))
+
+    def test_non_numeric(self):
+        rule = DeadbandRule('*', abs_deadband=10)
+        self.assertFalse(rule.is_significant(1000, 'on', None, 'on', None))
+        self.assertTrue(rule.is_significant(1000, 'on', None, 'off', None))
+
+    def test_max_silence(self):
+        rule = DeadbandRule('*', abs_deadband=10, max_silence=60)
+        self.assertFalse(rule.is_significant(59999, 1., 1., 1., 1.))
+        self.assertTrue(rule.is_significant(60000, 1., 1., 1., 1.))
+
+
+class DeadbandPolicyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.policy = DeadbandPolicy.from_config({evtdao.CFGKEY_DEADBAND: ['temperature,abs=0.5', 'switch']})
+
+    def _insert(self, evts):
+        pending = {}
+        accepted = [e for e in evts if self.policy.accept(e[0], e[1], e[2], e[3], pending)]
+        return accepted, pending
+
+    def test_no_policy(self):
+        self.assertIsNone(DeadbandPolicy.from_config({}))
+
+    def test_first_rule_applies(self):
+        self.assertEqual(self.policy.rule_for('temperature', 't1').pattern, 'temperature')
+        self.assertEqual(self.policy.rule_for('switch', 's1').pattern, 'switch')
+        self.assertIsNone(self.policy.rule_for('humidity', 'h1'))
+
+    def test_batch(self):
+        accepted, pending = self._insert([
+            (1000, 'temperature', 't1', 20.),
+            (2000, 'temperature', 't1', 20.3),
+            (3000, 'temperature', 't1', 20.6),
+            # late event
+            (1500, 'temperature', 't1', 20.),
+            (4000, 'humidity', 'h1', 50),
+            (5000, 'humidity', 'h1', 50),
+        ])
+        self.assertEqual([e[0] for e in accepted], [1000, 3000, 1500, 4000, 5000])
+        self.policy.commit(pending)
+        self.assertEqual(self.policy.report()['variables'], {'temperature:t1': {'stored': 3, 'suppressed': 1}})
+        self.assertEqual(self.policy.suppressed, 1)
+
+        # the next batch is checked against the last stored event
+        accepted, pending = self._insert([(6000, 'temperature', 't1', 21.)])
+        self.assertEqual(accepted, [])
+
+    def test_state_unchanged_until_commit(self):
+        accepted, _ = self._insert([(1000, 'switch', 's1', 'on')])
+        self.assertEqual(len(accepted), 1)
+        # the batch is not committed (write failure) : the next event is
+        # checked against the same state
+        accepted, pending = self._insert([(2000, 'switch', 's1', 'on')])
+        self.assertEqual(len(accepted), 1)
+        self.assertEqual(self.policy.report()['stored'], 0)
+        self.policy.commit(pending)
+        accepted, _ = self._insert([(3000, 'switch', 's1', 'on')])
+        self.assertEqual(accepted, [])
+
+    def test_concurrent_batches(self):
+        _, older = self._insert([(1000, 'temperature', 't1', 20.)])
+        _, newer = self._insert([(5000, 'temperature', 't1', 30.)])
+        self.policy.commit(newer)
+        self.policy.commit(older)
+        # the most recent stored event is kept as reference
+        accepted, _ = self._insert([(6000, 'temperature', 't1', 20.)])
+        self.assertEqual(len(accepted), 1)
+
+
+class DAODeadbandTestCase(unittest.TestCase):
+    """ Checks the compression by all the storages."""
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        self.start_ms = sysutils.to_milliseconds(datetime(2017, 7, 14, 12))
+
+    def tearDown(self):
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def _check(self, module):
+        dao = module.EventsDAO('sensor', {
+            evtdao.CFGKEY_EVTS_DB_HOME_DIR: self.home,
+            evtdao.CFGKEY_HOUSEKEEPING: False,
+            evtdao.CFGKEY_DEADBAND: 'temperature,abs=1,max_silence=60'
+        })
+        try:
+            dao.insert_events([
+                (self.start_ms + i * 10000, 'temperature', 't1', {'value': 20 + (i % 3) * 0.4})
+                for i in xrange(20)
+            ] + [
+                (self.start_ms + i * 10000, 'humidity', 'h1', {'value': 50})
+                for i in xrange(20)
+            ])
+            # heartbeat every 6 events for the compressed variable
+            self.assertEqual(
+                [int(e.timestamp.second) + 60 * int(e.timestamp.minute) for e in dao.get_events(var_type='temperature')],
+                [0, 60, 120, 180]
+            )
+            self.assertEqual(len(list(dao.get_events(var_type='humidity'))), 20)
+            report = dao.get_deadband_report()
+            self.assertEqual((report['stored'], report['suppressed']), (4, 16))
+        finally:
+            dao.close()
+
+    def test_fsys(self):
+        self._check(dao_fsys)
+
+    def test_sqlite(self):
+        self._check(dao_sqlite)
+
+    def test_colstore(self):
+        self._check(dao_colstore)
+
+    def test_write_failure(self):
+        dao = dao_fsys.EventsDAO('sensor', {
+            evtdao.CFGKEY_EVTS_DB_HOME_DIR: self.home,
+            evtdao.CFGKEY_HOUSEKEEPING: False,
+            evtdao.CFGKEY_DEADBAND: 'switch'
+        })
+        get_writer = dao._get_writer
+
+        def failing_get_writer(day):
+            raise IOError('disk full')
+
+        try:
+            dao._get_writer = failing_get_writer
+            self.assertRaises(IOError, dao.insert_events, [(self.start_ms, 'switch', 's1', {'value': 'on'})])
+            dao._get_writer = get_writer
+            # the event which could not be written does not suppress the retry
+            dao.insert_events([(self.start_ms, 'switch', 's1', {'value': 'on'})])
+            self.assertEqual([e.value for e in dao.get_events()], ['on'])
+            self.assertEqual(dao.get_deadband_report()['stored'], 1)
+        finally:
+            dao.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests of the bulk export of events.
+"""
+
+import os
+import csv
+import json
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from pycstbox import evtdao
+from pycstbox import sysutils
+from pycstbox.evtdao import export
+from pycstbox.evtdao.fsys.dao_fsys import EventsDAO
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+
+class ExportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        cfg = {
+            evtdao.CFGKEY_EVTS_DB_HOME_DIR: self.home,
+            evtdao.CFGKEY_HOUSEKEEPING: False
+        }
+        dao = EventsDAO('sensor', cfg)
+        dao.insert_events([
+            (sysutils.to_milliseconds(datetime(2017, 7, 14, 12, 0, i)), 'temperature', 't%d' % (i % 2), {'value': i})
+            for i in xrange(10)
+        ] + [
+            (sysutils.to_milliseconds(datetime(2017, 7, 15, 12)), 'switch', 's1', {'value': 'on', 'unit': 'none'})
+        ])
+        dao.close()
+        # the day files are no more opened for writing once the DAO is closed
+        self.dao = EventsDAO('sensor', cfg)
+
+    def tearDown(self):
+        self.dao.close()
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def _export(self, fmt, **kwargs):
+        with tempfile.TemporaryFile() as fp:
+            written = export.export_events(self.dao, fp.fileno(), fmt, **kwargs)
+            fp.seek(0)
+            output = fp.read()
+        self.assertEqual(written, len(output))
+        return output
+
+    def test_ndjson(self):
+        lines = self._export(export.EXPORT_NDJSON).splitlines()
+        self.assertEqual(len(lines), 11)
+        first = json.loads(lines[0])
+        self.assertEqual(
+            (first['var_type'], first['var_name'], first['value']),
+            ('temperature', 't0', '0')
+        )
+        self.assertEqual(json.loads(lines[-1])['data'], {'unit': 'none'})
+
+    def test_csv(self):
+        rows = list(csv.reader(self._export(export.EXPORT_CSV).splitlines()))
+        self.assertEqual(rows[0], ['timestamp', 'var_type', 'var_name', 'value', 'data'])
+        self.assertEqual(len(rows), 12)
+        self.assertEqual(rows[-1][1:4], ['switch', 's1', 'on'])
+        self.assertEqual(json.loads(rows[-1][4]), {'unit': 'none'})
+
+    def test_raw_copies_past_days(self):
+        output = self._export(export.EXPORT_RAW)
+        with open(self.dao.get_day_file(datetime(2017, 7, 14).date())) as fp:
+            day_content = fp.read()
+        self.assertTrue(output.startswith(day_content))
+        self.assertEqual(len(output.splitlines()), 11)
+        self.assertTrue(output.splitlines()[-1].startswith('170715-120000.'))
+
+    def test_filter(self):
+        lines = self._export(
+            export.EXPORT_NDJSON,
+            from_time=datetime(2017, 7, 14, 12, 0, 2), to_time=datetime(2017, 7, 14, 12, 0, 7),
+            var_name=evtdao.VarFilter.from_spec('t1')
+        ).splitlines()
+        self.assertEqual([json.loads(line)['value'] for line in lines], ['3', '5', '7'])
+
+    def test_unsupported_format(self):
+        with tempfile.TemporaryFile() as fp:
+            self.assertRaises(ValueError, export.export_events, self.dao, fp.fileno(), 'xml')
+
+    def test_closed_reader(self):
+        rd, wr = os.pipe()
+        os.close(rd)
+        try:
+            self.assertRaises(export.ExportError, export.export_events, self.dao, wr, export.EXPORT_NDJSON)
+        finally:
+            os.close(wr)
+
+    def test_deadline(self):
+        with tempfile.TemporaryFile() as fp:
+            self.assertRaises(
+                export.ExportTimeout,
+                export.export_events, self.dao, fp.fileno(), export.EXPORT_NDJSON, deadline=1
+            )
+
+    def test_fd_left_open(self):
+        rd, wr = os.pipe()
+        try:
+            export.export_events(self.dao, wr, export.EXPORT_NDJSON, var_type=evtdao.VarFilter.from_spec('switch'))
+            # the descriptor is still usable by the caller
+            os.write(wr, 'end\n')
+            os.close(wr)
+            wr = None
+            with os.fdopen(rd) as fp:
+                rd = None
+                self.assertEqual(fp.read().splitlines()[-1], 'end')
+        finally:
+            for fd in (rd, wr):
+                if fd is not None:
+                    os.close(fd)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests of the parallel scan of the days by the file based DAO.
+"""
+
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from pycstbox import evtdao
+from pycstbox import sysutils
+from pycstbox.evtdao.fsys.dao_fsys import EventsDAO
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+
+class ParallelScanTestCase(unittest.TestCase):
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        self.config = {evtdao.CFGKEY_EVTS_DB_HOME_DIR: self.home}
+        start_ms = sysutils.to_milliseconds(datetime(2017, 7, 14))
+        # 10000 events of 6 variables over 4 days
+        dao = EventsDAO('sensor', self.config)
+        dao.insert_events([
+            (start_ms + i * 34560, 'temperature' if i % 3 else 'humidity', 'v%d' % (i % 6),
+             {'value': (i * 7) % 100, 'unit': 'C'})
+            for i in xrange(10000)
+        ])
+        dao.close()
+
+        self.serial = EventsDAO('sensor', dict(self.config, **{evtdao.CFGKEY_SCAN_WORKERS: 0}), readonly=True)
+        self.parallel = EventsDAO('sensor', dict(self.config, **{
+            evtdao.CFGKEY_SCAN_WORKERS: 2,
+            evtdao.CFGKEY_SCAN_MIN_DAYS: 2,
+        }), readonly=True)
+        self.parallel.open()
+
+    def tearDown(self):
+        self.parallel.close()
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def test_same_events_as_the_serial_scan(self):
+        from_time = datetime(2017, 7, 14, 6)
+        to_time = datetime(2017, 7, 17, 6)
+        for var_type, var_name in ((None, None), (None, 'v2'), ('humidity', ['v0', 'v3'])):
+            self.assertEqual(
+                [(e.timestamp, e.var_type, e.var_name, e.value, e.data)
+                 for e in self.parallel.get_events(from_time, to_time, var_type, var_name)],
+                [(e.timestamp, e.var_type, e.var_name, e.value, e.data)
+                 for e in self.serial.get_events(from_time, to_time, var_type, var_name)]
+            )
+        self.assertTrue(self.parallel._use_scan_pool(list(self.parallel.get_available_days())))
+
+    def test_same_records_as_the_serial_scan(self):
+        self.assertEqual(
+            list(self.parallel.get_records(fields=(evtdao.FIELD_TS, evtdao.FIELD_VALUE), ts_format=evtdao.TS_EPOCH)),
+            list(self.serial.get_records(fields=(evtdao.FIELD_TS, evtdao.FIELD_VALUE), ts_format=evtdao.TS_EPOCH))
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
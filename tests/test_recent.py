@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests of the recent events buffer of the file based DAO.
+"""
+
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from pycstbox import evtdao
+from pycstbox import sysutils
+from pycstbox.evtdao.fsys.dao_fsys import EventsDAO
+from pycstbox.evtdao.fsys.recent import RecentEvents
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+
+class RecentEventsTestCase(unittest.TestCase):
+    START = datetime(2017, 7, 14, 12)
+
+    def test_coverage(self):
+        recent = RecentEvents(self.START)
+        recent.add([
+            (self.START - timedelta(seconds=1), 'temperature', 'late', 20., {}, 50),
+            (self.START + timedelta(seconds=1), 'temperature', 't1', 21., {}, 50),
+        ])
+        self.assertEqual(len(recent), 1)
+        self.assertIsNone(recent.select(self.START - timedelta(seconds=1)))
+        self.assertEqual([evt[2] for evt in recent.select(self.START)], ['t1'])
+
+    def test_limits(self):
+        recent = RecentEvents(self.START, max_span=60)
+        recent.add([
+            (self.START + timedelta(seconds=i * 10), 'temperature', 't1', float(i), {}, 50)
+            for i in xrange(20)
+        ])
+        self.assertEqual(len(recent), 7)
+        self.assertEqual(recent.coverage_start, self.START + timedelta(seconds=120, microseconds=1))
+
+        recent = RecentEvents(self.START, max_bytes=10 * 450)
+        recent.add([
+            (self.START + timedelta(seconds=i * 10), 'temperature', 't1', float(i), {}, 50)
+            for i in xrange(20)
+        ])
+        self.assertEqual(len(recent), 10)
+
+    def test_filters(self):
+        recent = RecentEvents(self.START)
+        recent.add([
+            (self.START + timedelta(seconds=i), 'temperature' if i % 2 else 'humidity', 'v%d' % (i % 3), i, {}, 50)
+            for i in xrange(12)
+        ])
+        self.assertEqual(
+            [evt[3] for evt in recent.select(
+                self.START + timedelta(seconds=2), self.START + timedelta(seconds=9),
+                var_type=evtdao.VarFilter.from_spec('temperature'),
+                var_name=evtdao.VarFilter.from_spec(['v0', 'v1'])
+            )],
+            [3, 7, 9]
+        )
+
+
+class DAORecentEventsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        self.config = {evtdao.CFGKEY_EVTS_DB_HOME_DIR: self.home}
+
+    def tearDown(self):
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def test_same_results_as_the_day_files(self):
+        # the buffer only covers the events received after the creation of the DAO
+        dao = EventsDAO('sensor', self.config)
+        start = datetime.utcnow() + timedelta(seconds=1)
+        start_ms = sysutils.to_milliseconds(start)
+        dao.insert_events([
+            (start_ms + i * 1800, 'temperature' if i % 3 else 'humidity', 'v%d' % (i % 6),
+             {'value': (i * 7) % 100, 'unit': 'C'})
+            for i in xrange(2000)
+        ])
+        dao.flush()
+        reader = EventsDAO('sensor', self.config, readonly=True)
+
+        from_time = datetime.utcfromtimestamp((start_ms + 600000) / 1000.)
+        to_time = from_time + timedelta(minutes=20)
+        self.assertIsNotNone(dao._recent.select(from_time, to_time))
+        for var_name in (None, 'v3', ['v0', 'v1']):
+            self.assertEqual(
+                [(e.timestamp, e.var_type, e.var_name, e.value, e.data)
+                 for e in dao.get_events(from_time, to_time, var_name=var_name)],
+                [(e.timestamp, e.var_type, e.var_name, e.value, e.data)
+                 for e in reader.get_events(from_time, to_time, var_name=var_name)]
+            )
+        dao.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
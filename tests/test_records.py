@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests of the projected queries of the file based DAO.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from pycstbox import evtdao
+from pycstbox import sysutils
+from pycstbox.evtdao.fsys.dao_fsys import EventsDAO
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+
+class RecordsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        self.config = {evtdao.CFGKEY_EVTS_DB_HOME_DIR: self.home}
+        start_ms = sysutils.to_milliseconds(datetime(2017, 7, 14))
+        # 3000 events of 6 variables over 2 days, some without additional data
+        dao = EventsDAO('sensor', self.config)
+        dao.insert_events([
+            (start_ms + i * 57600 + 123, 'temperature' if i % 3 else 'humidity', 'v%d' % (i % 6),
+             {'value': (i * 7) % 100, 'unit': 'C'} if i % 4 else {'value': i})
+            for i in xrange(3000)
+        ])
+        dao.close()
+        self.dao = EventsDAO('sensor', self.config, readonly=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def test_same_records_as_the_events(self):
+        from_time = datetime(2017, 7, 14, 10, 30)
+        to_time = datetime(2017, 7, 15, 20)
+        for ts_format in (evtdao.TS_DATETIME, evtdao.TS_EPOCH, evtdao.TS_TEXT):
+            for fields in (evtdao.RECORD_FIELDS, (evtdao.FIELD_VALUE, evtdao.FIELD_TS), (evtdao.FIELD_DATA,)):
+                self.assertEqual(
+                    list(self.dao.get_records(from_time, to_time, var_name='v2', fields=fields, ts_format=ts_format)),
+                    list(evtdao.AbstractDAO.get_records(
+                        self.dao, from_time, to_time, var_name='v2', fields=fields, ts_format=ts_format
+                    ))
+                )
+        self.assertEqual(
+            list(self.dao.get_records(var_type='humidity')),
+            list(evtdao.AbstractDAO.get_records(self.dao, var_type='humidity'))
+        )
+
+    def test_raw_timestamps(self):
+        # raw timestamps are the ones of the day files records
+        with open(os.path.join(self.home, 'sensor', '170714.evt-log')) as fp:
+            expected = [[line.split('\t')[0]] for line in fp if line.split('\t')[2] == 'v1']
+        self.assertEqual(
+            list(self.dao.get_records(
+                to_time=datetime(2017, 7, 14, 23, 59, 59, 999999),
+                var_name='v1', fields=(evtdao.FIELD_TS,), ts_format=evtdao.TS_RAW
+            )),
+            expected
+        )
+
+    def test_invalid_arguments(self):
+        self.assertRaises(ValueError, list, self.dao.get_records(fields=('unit',)))
+        self.assertRaises(ValueError, list, self.dao.get_records(ts_format='iso'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests of the retention policy of the file based DAO.
+"""
+
+import shutil
+import tempfile
+import unittest
+from datetime import date, datetime, timedelta
+
+from pycstbox import evtdao
+from pycstbox import sysutils
+from pycstbox.evtdao.fsys.dao_fsys import EventsDAO
+from pycstbox.evtdao.fsys.retention import RetentionPolicy
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+
+class RetentionPolicyTestCase(unittest.TestCase):
+    def test_limits(self):
+        policy = RetentionPolicy(max_age=10, downsample_age=3)
+        today = date(2017, 7, 14)
+        self.assertEqual(policy.expiry_limit(today), date(2017, 7, 5))
+        self.assertEqual(policy.downsampling_limit(today), date(2017, 7, 12))
+        self.assertEqual(policy.raw_events_limit(today), date(2017, 7, 12))
+        self.assertFalse(RetentionPolicy(max_age=0).enabled)
+
+    def test_per_channel_settings(self):
+        config = {
+            evtdao.CFGKEY_RETENTION_MAX_AGE: {None: 30, 'sysmon': 7},
+            evtdao.CFGKEY_RETENTION_MAX_BYTES: {'sensor': 10 ** 6},
+            evtdao.CFGKEY_RETENTION_DOWNSAMPLE_AGE: 5,
+        }
+        sensor = RetentionPolicy.from_config(config, 'sensor')
+        sysmon = RetentionPolicy.from_config(config, 'sysmon')
+        self.assertEqual((sensor.max_age, sensor.max_bytes, sensor.downsample_age), (30, 10 ** 6, 5))
+        self.assertEqual((sysmon.max_age, sysmon.max_bytes, sysmon.downsample_age), (7, None, 5))
+
+
+class RetentionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        self.today = datetime.utcnow().date()
+        # the past 10 days, with an event per hour of 2 variables
+        self.days = [self.today - timedelta(days=i) for i in xrange(10, 0, -1)]
+        self.evts = [
+            (sysutils.to_milliseconds(datetime(day.year, day.month, day.day, hour)), 'temperature', name,
+             {'value': hour})
+            for day in self.days for hour in xrange(24) for name in ('t1', 't2')
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def get_dao(self, channel='sensor', **config):
+        """ Returns a DAO using a given retention policy, the events being
+        stored before it is set up (they would be discarded otherwise)."""
+        config[evtdao.CFGKEY_EVTS_DB_HOME_DIR] = self.home
+        config[evtdao.CFGKEY_HOUSEKEEPING] = False
+        dao = EventsDAO(channel, {evtdao.CFGKEY_EVTS_DB_HOME_DIR: self.home, evtdao.CFGKEY_HOUSEKEEPING: False})
+        dao.insert_events([(ms, vt, vn, dict(data)) for ms, vt, vn, data in self.evts])
+        dao.close()
+        return EventsDAO(channel, config)
+
+    def test_max_age(self):
+        dao = self.get_dao(**{evtdao.CFGKEY_RETENTION_MAX_AGE: 5})
+        dao._enforce_retention()
+        self.assertEqual(list(dao.get_available_days()), self.days[-4:])
+        self.assertEqual(dao.get_retention_report()['days_removed'], 6)
+
+    def test_downsampling(self):
+        dao = self.get_dao(**{evtdao.CFGKEY_RETENTION_DOWNSAMPLE_AGE: 3})
+        dao._enforce_retention()
+        self.assertEqual(list(dao.get_available_days()), self.days[-2:])
+        # the aggregates of the downsampled days are still available
+        aggregates = dao.get_aggregates('t1', bucket_seconds=86400)
+        self.assertEqual([ts.date() for ts, _ in aggregates], self.days)
+        self.assertEqual(aggregates[0][1][evtdao.AGG_COUNT], 24)
+
+    def test_max_bytes(self):
+        usage = self.get_dao().get_retention_report()['disk_usage']
+        dao = EventsDAO('sensor', {
+            evtdao.CFGKEY_EVTS_DB_HOME_DIR: self.home,
+            evtdao.CFGKEY_HOUSEKEEPING: False,
+            evtdao.CFGKEY_RETENTION_MAX_BYTES: usage // 2,
+        })
+        dao._enforce_retention()
+        report = dao.get_retention_report()
+        self.assertLessEqual(report['disk_usage'], usage // 2)
+        self.assertEqual(list(dao.get_available_days()), self.days[report['days_removed']:])
+
+    def test_per_channel_policy(self):
+        config = {evtdao.CFGKEY_RETENTION_MAX_AGE: {None: 8, 'sysmon': 3}}
+        sensor = self.get_dao('sensor', **dict(config))
+        sysmon = self.get_dao('sysmon', **dict(config))
+        sensor._enforce_retention()
+        sysmon._enforce_retention()
+        self.assertEqual(list(sensor.get_available_days()), self.days[-7:])
+        self.assertEqual(list(sysmon.get_available_days()), self.days[-2:])
+
+
+if __name__ == '__main__':
+    unittest.main()
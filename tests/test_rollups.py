@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests of the per-day rollups of the file based DAO.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from pycstbox import evtdao
+from pycstbox import sysutils
+from pycstbox.evtdao.fsys.dao_fsys import EventsDAO
+from pycstbox.evtdao.fsys.rollups import DayRollup, ROLLUP_FILE_EXT, compute_rollup
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+
+class RollupsTestCase(unittest.TestCase):
+    START = datetime(2017, 7, 14)
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        self.config = {evtdao.CFGKEY_EVTS_DB_HOME_DIR: self.home}
+        self.dbhome = os.path.join(self.home, 'sensor')
+        start_ms = sysutils.to_milliseconds(self.START)
+        # 6000 events of 6 variables over 3 days, every 43.2 seconds
+        dao = EventsDAO('sensor', self.config)
+        dao.insert_events([
+            (start_ms + i * 43200, 'temperature' if i % 3 else 'humidity', 'v%d' % (i % 6),
+             {'value': (i * 7) % 100, 'unit': 'C'})
+            for i in xrange(6000)
+        ])
+        dao.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def test_round_trip(self):
+        fpath = os.path.join(self.dbhome, '170714.evt-log')
+        with open(fpath) as fp:
+            rollup = compute_rollup(fp, sysutils.to_milliseconds(self.START))
+        self.assertEqual(rollup.size, os.path.getsize(fpath))
+        self.assertEqual(len(rollup.vars), 6)
+        var_rollup = rollup.vars[('temperature', 'v1')]
+        self.assertEqual(var_rollup.events, len(xrange(1, 2000, 6)))
+        self.assertEqual(sum(agg.count for agg in var_rollup.hours.itervalues()), var_rollup.events)
+
+        path = os.path.join(self.home, 'test' + ROLLUP_FILE_EXT)
+        rollup.save(path)
+        loaded = DayRollup.load(path)
+        self.assertEqual(loaded.size, rollup.size)
+        self.assertEqual(
+            {key: r.as_dict() for key, r in loaded.vars.iteritems()},
+            {key: r.as_dict() for key, r in rollup.vars.iteritems()}
+        )
+
+    def test_invalid_content(self):
+        path = os.path.join(self.home, 'test' + ROLLUP_FILE_EXT)
+        with open(path, 'w') as fp:
+            json.dump({'vars': {}}, fp)
+        self.assertRaises(ValueError, DayRollup.load, path)
+
+    def test_aggregates_from_rollups(self):
+        dao = EventsDAO('sensor', self.config, readonly=True)
+        self.assertEqual(dao.build_rollups(), 3)
+        for bucket_seconds in (3600, 86400):
+            self.assertEqual(
+                dao.get_aggregates('v1', bucket_seconds=bucket_seconds),
+                evtdao.AbstractDAO.get_aggregates(dao, 'v1', bucket_seconds=bucket_seconds)
+            )
+        # partially covered days are aggregated from their events
+        from_time = self.START + timedelta(hours=13, minutes=30)
+        to_time = self.START + timedelta(days=2, hours=2)
+        self.assertEqual(
+            dao.get_aggregates('v1', from_time, to_time),
+            evtdao.AbstractDAO.get_aggregates(dao, 'v1', from_time, to_time)
+        )
+
+    def test_build_leaves_the_service_state_untouched(self):
+        # the state of the service writing the database, as left by its last flush
+        dao = EventsDAO('sensor', self.config)
+        dao.insert_events([(sysutils.to_milliseconds(self.START) + 1, 'humidity', 'v0', {'value': 1})])
+        dao.flush()
+        before = {
+            name: os.stat(os.path.join(self.dbhome, name)).st_ino
+            for name in os.listdir(self.dbhome) if name.startswith('stats.')
+        }
+
+        builder = EventsDAO('sensor', self.config, readonly=True)
+        self.assertEqual(builder.build_rollups(force=True), 3)
+        builder.close()
+        self.assertEqual(
+            {name: os.stat(os.path.join(self.dbhome, name)).st_ino
+             for name in os.listdir(self.dbhome) if name.startswith('stats.')},
+            before
+        )
+        self.assertEqual(len([n for n in os.listdir(self.dbhome) if n.endswith(ROLLUP_FILE_EXT)]), 3)
+        dao.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests of the SQLite DAO.
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import date, datetime
+
+from pycstbox import evtdao
+from pycstbox import sysutils
+from pycstbox.evtdao.sqlite.dao_sqlite import EventsDAO
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+
+class SQLiteTestCase(unittest.TestCase):
+    DAY = date(2017, 7, 14)
+    START_MS = sysutils.to_milliseconds(datetime(2017, 7, 14))
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        self.config = {evtdao.CFGKEY_EVTS_DB_HOME_DIR: self.home}
+        # 1000 events of 10 variables over two days
+        values = [12.5, 3, 'on', -7, 0.1, 2 ** 60]
+        self.evts = []
+        for i in xrange(1000):
+            data = {'value': values[i % len(values)]}
+            if i % 3:
+                data['unit'] = 'C'
+            self.evts.append(
+                (self.START_MS + i * 172800, 'temperature' if i % 2 else 'switch', 'v%d' % (i % 5), data)
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def get_dao(self, readonly=False, **config):
+        dao = EventsDAO('sensor', dict(self.config, **config), readonly=readonly)
+        dao.open()
+        return dao
+
+    def store(self, evts):
+        dao = self.get_dao()
+        dao.insert_events([(ms, vt, vn, dict(data)) for ms, vt, vn, data in evts])
+        dao.close()
+
+    def read_back(self, evts):
+        return [(sysutils.to_milliseconds(e.timestamp), e.var_type, e.var_name, dict(e.data)) for e in evts]
+
+    def test_round_trip(self):
+        self.store(self.evts)
+        dao = self.get_dao(readonly=True)
+        self.assertEqual(self.read_back(dao.get_events()), self.evts)
+        self.assertEqual(list(dao.get_available_days()), [self.DAY, date(2017, 7, 15)])
+
+    def test_value_types(self):
+        self.store(self.evts[:6] + [(self.START_MS, 'switch', 'b', {'value': True})])
+        dao = self.get_dao(readonly=True)
+        self.assertEqual(
+            [(e.value, type(e.value)) for e in dao.get_events(var_name='v*')],
+            [(data['value'], type(data['value'])) for _, _, _, data in self.evts[:6]]
+        )
+        # SQLite has no boolean type, booleans being restored as integers
+        self.assertEqual([e.value for e in dao.get_events(var_name='b')], [1])
+
+    def test_filters(self):
+        self.store(self.evts)
+        dao = self.get_dao(readonly=True)
+        from_time = datetime(2017, 7, 14, 12)
+        to_time = datetime(2017, 7, 15, 6)
+        from_ms, to_ms = sysutils.to_milliseconds(from_time), sysutils.to_milliseconds(to_time)
+        self.assertEqual(
+            self.read_back(dao.get_events(from_time, to_time, var_name=['v1', 'v3'])),
+            [e for e in self.evts if e[2] in ('v1', 'v3') and from_ms <= e[0] <= to_ms]
+        )
+        self.assertEqual(
+            self.read_back(dao.get_events_for_day(self.DAY, var_type='switch')),
+            [e for e in self.evts if e[1] == 'switch' and e[0] < self.START_MS + 86400000]
+        )
+
+    def test_appends(self):
+        self.store(self.evts[:400])
+        self.store(self.evts[400:])
+        dao = self.get_dao(readonly=True)
+        self.assertEqual(self.read_back(dao.get_events()), self.evts)
+
+    def test_flash_memory_grouped_commit(self):
+        dao = self.get_dao(**{evtdao.CFGKEY_FLASH_MEM_SUPPORT: True})
+        dao.insert_events([(ms, vt, vn, dict(data)) for ms, vt, vn, data in self.evts])
+        reader = self.get_dao(readonly=True)
+        self.assertEqual(list(reader.get_events()), [])
+        dao.flush()
+        self.assertEqual(self.read_back(reader.get_events()), self.evts)
+        dao.close()
+
+    def test_last_values(self):
+        dao = self.get_dao()
+        dao.insert_events([(ms, vt, vn, dict(data)) for ms, vt, vn, data in self.evts[:600]])
+        # a late event, which is not the latest one of its variable
+        dao.insert_events([(self.START_MS + 1, 'switch', 'v0', {'value': 0})])
+        dao.insert_events([(ms, vt, vn, dict(data)) for ms, vt, vn, data in self.evts[600:]])
+        dao.close()
+        last = {}
+        for msecs, var_type, var_name, data in self.evts:
+            last[(var_type, var_name)] = (msecs, var_type, var_name, data)
+        expected = [last[key] for key in sorted(last)]
+
+        dao = self.get_dao(readonly=True)
+        self.assertEqual(self.read_back(dao.get_last_values()), expected)
+        self.assertEqual(
+            self.read_back(dao.get_last_values('switch')), [e for e in expected if e[1] == 'switch']
+        )
+
+    def test_last_values_of_previous_databases(self):
+        self.store(self.evts)
+        last = {}
+        for msecs, var_type, var_name, data in self.evts:
+            last[(var_type, var_name)] = (msecs, var_type, var_name, data)
+        expected = [last[key] for key in sorted(last)]
+
+        # database written before the last values were maintained
+        conn = sqlite3.connect(os.path.join(self.home, 'sensor.sqlite'))
+        conn.execute("DROP TABLE last_values")
+        conn.commit()
+        conn.close()
+        self.assertEqual(self.read_back(self.get_dao(readonly=True).get_last_values()), expected)
+
+        # the table is built when opened in write mode
+        self.get_dao().close()
+        conn = sqlite3.connect(os.path.join(self.home, 'sensor.sqlite'))
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM last_values").fetchone(), (len(expected),))
+        conn.close()
+        self.assertEqual(self.read_back(self.get_dao(readonly=True).get_last_values()), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests of the variable stats journal of the file based DAO.
+"""
+
+import os
+import json
+import shutil
+import logging
+import tempfile
+import unittest
+from datetime import datetime
+
+from pycstbox import evtdao
+from pycstbox import sysutils
+from pycstbox.evtdao.fsys.dao_fsys import EventsDAO
+from pycstbox.evtdao.fsys.statsjournal import StatsJournal, SNAPSHOT_FNAME, JOURNAL_FNAME
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+
+class StatsJournalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dbhome = tempfile.mkdtemp()
+        self.logger = logging.getLogger('test')
+
+    def tearDown(self):
+        shutil.rmtree(self.dbhome, ignore_errors=True)
+
+    def test_snapshot_and_journal(self):
+        journal = StatsJournal(self.dbhome, self.logger)
+        journal.compact({'temperature:v1': [1000, 20.5, {}]})
+        journal.append({'temperature:v1': [2000, 21.0, {'unit': 'C'}], 'humidity:v2': [1500, 50, {}]})
+        journal.close()
+
+        with open(os.path.join(self.dbhome, SNAPSHOT_FNAME)) as fp:
+            snapshot = json.load(fp)
+        self.assertEqual(snapshot, {'generation': 1, 'stats': {'temperature:v1': [1000, 20.5, {}]}})
+
+        self.assertEqual(StatsJournal(self.dbhome, self.logger).load(), {
+            'temperature:v1': [2000, 21.0, {'unit': 'C'}],
+            'humidity:v2': [1500, 50, {}]
+        })
+
+    def test_merged_journal_is_ignored(self):
+        journal = StatsJournal(self.dbhome, self.logger)
+        journal.compact({'temperature:v1': [1000, 20.5, {}]})
+        journal.append({'temperature:v1': [2000, 21.0, {}]})
+        journal.close()
+        # crash after the new snapshot has been written, but before the journal is reset
+        with open(os.path.join(self.dbhome, SNAPSHOT_FNAME), 'w') as fp:
+            json.dump({'generation': 2, 'stats': {'temperature:v1': [3000, 22.0, {}]}}, fp)
+
+        self.assertEqual(StatsJournal(self.dbhome, self.logger).load(), {'temperature:v1': [3000, 22.0, {}]})
+
+    def test_torn_record_is_ignored(self):
+        journal = StatsJournal(self.dbhome, self.logger)
+        journal.compact({})
+        journal.append({'temperature:v1': [2000, 21.0, {}]})
+        journal.close()
+        with open(os.path.join(self.dbhome, JOURNAL_FNAME), 'a') as fp:
+            fp.write('["temperature:v1", [3000')
+
+        self.assertEqual(StatsJournal(self.dbhome, self.logger).load(), {'temperature:v1': [2000, 21.0, {}]})
+
+    def test_legacy_snapshot(self):
+        with open(os.path.join(self.dbhome, SNAPSHOT_FNAME), 'w') as fp:
+            json.dump({'temperature:v1': 1000}, fp)
+        self.assertEqual(StatsJournal(self.dbhome, self.logger).load(), {'temperature:v1': 1000})
+
+    def test_dao_stats_persistence(self):
+        config = {evtdao.CFGKEY_EVTS_DB_HOME_DIR: self.dbhome}
+        start_ms = sysutils.to_milliseconds(datetime(2017, 7, 14))
+        dao = EventsDAO('sensor', config)
+        dao.insert_events([(start_ms + i * 1000, 'temperature', 'v%d' % (i % 3), {'value': i}) for i in xrange(10)])
+        dao.insert_events([(start_ms + 20000, 'temperature', 'v1', {'value': 20})])
+        dao.close()
+
+        stats = StatsJournal(os.path.join(self.dbhome, 'sensor'), self.logger).load()
+        self.assertEqual(
+            {key: entry[0] for key, entry in stats.iteritems()},
+            {'temperature:v0': start_ms + 9000, 'temperature:v1': start_ms + 20000, 'temperature:v2': start_ms + 8000}
+        )
+    def test_dao_last_values(self):
+        config = {evtdao.CFGKEY_EVTS_DB_HOME_DIR: self.dbhome}
+        start_ms = sysutils.to_milliseconds(datetime(2017, 7, 14))
+        dao = EventsDAO('sensor', config)
+        dao.insert_events([(start_ms + i * 1000, 'temperature', 'v%d' % (i % 3), {'value': i}) for i in xrange(10)])
+        dao.insert_events([(start_ms + 20000, 'humidity', 'v1', {'value': 20})])
+        self.assertEqual(
+            [(e.var_type, e.var_name, e.value) for e in dao.get_last_values('temperature')],
+            [('temperature', 'v0', '9'), ('temperature', 'v1', '7'), ('temperature', 'v2', '8')]
+        )
+        dao.close()
+
+        dao = EventsDAO('sensor', config, readonly=True)
+        self.assertEqual(
+            [(e.var_type, e.var_name, sysutils.to_milliseconds(e.timestamp)) for e in dao.get_last_values('*:v1')],
+            [('humidity', 'v1', start_ms + 20000), ('temperature', 'v1', start_ms + 7000)]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests of the variable filters.
+"""
+
+import pickle
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from pycstbox import evtdao
+from pycstbox import sysutils
+from pycstbox.evtdao.fsys import dao_fsys
+from pycstbox.evtdao.sqlite import dao_sqlite
+from pycstbox.evtdao.colstore import dao_colstore
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+
+class VarFilterTestCase(unittest.TestCase):
+    def test_exact_name(self):
+        f = evtdao.VarFilter('t1')
+        self.assertTrue(f.exact)
+        self.assertTrue(f.match('t1'))
+        self.assertFalse(f.match('t10'))
+
+    def test_list(self):
+        f = evtdao.VarFilter(['t1', 't2'])
+        self.assertTrue(f.exact)
+        self.assertEqual([v for v in ('t1', 't2', 't3') if f.match(v)], ['t1', 't2'])
+
+    def test_glob(self):
+        f = evtdao.VarFilter('room_*.t?')
+        self.assertFalse(f.exact)
+        self.assertTrue(f.match('room_12.t1'))
+        self.assertFalse(f.match('room_12.t10'))
+        self.assertFalse(f.match('hall.t1'))
+
+    def test_regex(self):
+        f = evtdao.VarFilter('re:t[0-9]+')
+        self.assertTrue(f.match('t42'))
+        # the whole name must match
+        self.assertFalse(f.match('t42x'))
+        self.assertFalse(f.match('xt42'))
+
+    def test_mixed(self):
+        f = evtdao.VarFilter(['hall', 'room_*', 're:t[0-9]'])
+        self.assertEqual(
+            [v for v in ('hall', 'room_1', 't1', 'hallway', 't12') if f.match(v)],
+            ['hall', 'room_1', 't1']
+        )
+
+    def test_invalid_regex(self):
+        self.assertRaises(ValueError, evtdao.VarFilter, 're:t(')
+
+    def test_from_spec(self):
+        self.assertIsNone(evtdao.VarFilter.from_spec(None))
+        self.assertIsNone(evtdao.VarFilter.from_spec(''))
+        self.assertIsNone(evtdao.VarFilter.from_spec([]))
+        f = evtdao.VarFilter('t1')
+        self.assertIs(evtdao.VarFilter.from_spec(f), f)
+
+    def test_select(self):
+        values = ['t1', 't2', 't3']
+        self.assertEqual(evtdao.VarFilter(['t3', 't1']).select(values), ['t1', 't3'])
+        self.assertEqual(sorted(evtdao.VarFilter(['t3', 't9']).select(dict.fromkeys(values))), ['t3'])
+        self.assertEqual(evtdao.VarFilter('t[12]').select(values), ['t1', 't2'])
+
+    def test_pickle(self):
+        f = pickle.loads(pickle.dumps(evtdao.VarFilter(['t1', 'room_*'])))
+        self.assertTrue(f.match('t1'))
+        self.assertTrue(f.match('room_2'))
+        self.assertFalse(f.match('t2'))
+
+
+class DAOFilterTestCase(unittest.TestCase):
+    """ Checks that all the storages apply the filters the same way."""
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        start_ms = sysutils.to_milliseconds(datetime(2017, 7, 14, 12))
+        self.evts = [
+            (start_ms + i * 1000, 'temperature' if i % 2 else 'humidity', 'room_%d.s%d' % (i % 4, i % 3), {'value': i})
+            for i in xrange(120)
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def _check(self, module):
+        dao = module.EventsDAO('sensor', {
+            evtdao.CFGKEY_EVTS_DB_HOME_DIR: self.home,
+            evtdao.CFGKEY_HOUSEKEEPING: False
+        })
+        try:
+            dao.insert_events([(ts, var_type, var_name, dict(data)) for ts, var_type, var_name, data in self.evts])
+            for var_type, var_name in (
+                ('temperature', None),
+                (['temperature', 'humidity'], 'room_1.s0'),
+                (None, ['room_1.s0', 'room_2.*']),
+                ('re:temp.*', 're:room_[13]\\.s[12]'),
+                ('hum*', ['room_0.s0', 're:room_3\\..*']),
+                (None, 'unknown'),
+            ):
+                expected = [
+                    int(data['value']) for _, t, n, data in self.evts
+                    if (var_type is None or evtdao.VarFilter(var_type).match(t))
+                    and (var_name is None or evtdao.VarFilter(var_name).match(n))
+                ]
+                self.assertEqual(
+                    [int(e.value) for e in dao.get_events(var_type=var_type, var_name=var_name)],
+                    expected, '%s %s' % (var_type, var_name)
+                )
+        finally:
+            dao.close()
+
+    def test_fsys(self):
+        self._check(dao_fsys)
+
+    def test_sqlite(self):
+        self._check(dao_sqlite)
+
+    def test_colstore(self):
+        self._check(dao_colstore)
+
+
+if __name__ == '__main__':
+    unittest.main()
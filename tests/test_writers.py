@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests of the day file writers of the file based DAO.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date, datetime
+
+from pycstbox import evtdao
+from pycstbox import sysutils
+from pycstbox.evtdao.fsys.dao_fsys import EventsDAO
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+
+class DayWritersTestCase(unittest.TestCase):
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        self.dao = EventsDAO('sensor', {
+            evtdao.CFGKEY_EVTS_DB_HOME_DIR: self.home,
+            evtdao.CFGKEY_HOUSEKEEPING: False
+        })
+
+    def tearDown(self):
+        self.dao.close()
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def test_events_around_midnight(self):
+        midnight_ms = sysutils.to_milliseconds(datetime(2017, 7, 15))
+        # events of both days interleaved, as received from late sensors
+        self.dao.insert_events([
+            (midnight_ms + (i - 50) * 1000 + (-1 if i % 2 else 1) * 60000, 'temperature', 't%d' % (i % 2), {'value': i})
+            for i in xrange(100)
+        ])
+        self.assertEqual(list(self.dao.get_available_days()), [date(2017, 7, 14), date(2017, 7, 15)])
+        for day in (date(2017, 7, 14), date(2017, 7, 15)):
+            for e in self.dao.get_events_for_day(day):
+                self.assertEqual(e.timestamp.date(), day)
+        self.assertEqual(len(list(self.dao.get_events())), 100)
+
+    def test_same_day_of_another_month(self):
+        self.dao.insert_events([
+            (sysutils.to_milliseconds(datetime(2017, 7, 14, 12)), 'temperature', 't1', {'value': 1}),
+            (sysutils.to_milliseconds(datetime(2017, 8, 14, 12)), 'temperature', 't1', {'value': 2}),
+        ])
+        self.dao.flush()
+        self.assertEqual(
+            sorted(n for n in os.listdir(os.path.join(self.home, 'sensor')) if n.endswith('.evt-log')),
+            ['170714.evt-log', '170814.evt-log']
+        )
+        self.assertEqual([e.value for e in self.dao.get_events_for_day(date(2017, 8, 14))], ['2'])
+
+    def test_open_days_limit(self):
+        days = [date(2017, 7, d) for d in xrange(1, EventsDAO.MAX_OPEN_DAYS + 3)]
+        for i, day in enumerate(days):
+            self.dao.insert_events([
+                (sysutils.to_milliseconds(datetime(day.year, day.month, day.day, 12)), 'temperature', 't1', {'value': i})
+            ])
+        self.assertEqual(len(self.dao._writers), EventsDAO.MAX_OPEN_DAYS)
+        # the least recently used days are the closed ones
+        self.assertEqual(list(self.dao._writers), days[-EventsDAO.MAX_OPEN_DAYS:])
+        self.assertEqual([e.value for e in self.dao.get_events()], [str(i) for i in xrange(len(days))])
+
+
+if __name__ == '__main__':
+    unittest.main()